@@ -1 +1,28 @@
-from .simulator import Simulator
\ No newline at end of file
+import importlib
+
+from .simulator import Simulator
+from .events import EventSimulator
+from .batch import BatchSimulator
+from .trajectory import TrajectoryRecorder, Trajectory, loadTrajectory
+from .scenario import ScenarioSpec, loadScenario, preset
+from .policies import WorldView, registerPolicy, getPolicy, policyNames
+from .metrics import SimulationMetrics
+
+# names of the modules that import multiprocessing, concurrent.futures or sqlite3, imported when first used so
+# "from simulator import Simulator" does not pay for them
+_LAZY = {"runTrials": ".runner", "RunningStats": ".runner",
+         "TauSweep": ".sweep", "sweepTau": ".sweep",
+         "ResultCache": ".cache",
+         "runUntilPrecise": ".adaptive", "AdaptiveResult": ".adaptive"}
+
+
+def __getattr__(name):
+    if name not in _LAZY:
+        raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
+    value = getattr(importlib.import_module(_LAZY[name], __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_LAZY))
@@ -0,0 +1,184 @@
+"""
+Adaptive Monte-Carlo experiments: run trials chunk by chunk until the confidence intervals of chosen targets are
+tight enough, or until a budget of trials is spent.
+
+A target is one of the result columns (see runner.RESULT_COLUMNS), e.g. "combatants_killed", or a ratio of two of
+them such as "civilians_killed/civilians", the fraction of civilians killed pooled over all trials. Ratio intervals
+come from the delta method. Trivial configurations stop after the first chunk, while rare events at high tau get as
+many trials as the budget allows:
+
+    result = runUntilPrecise(3, 0.95, ["civilians_killed/civilians"], precision=0.002, max_trials=10**6, seed=1)
+    result.targets["civilians_killed/civilians"]["ci"]
+
+    python -m simulator.adaptive --scenario 3 --tau 0.95 --target civilians_killed/civilians --precision 0.002
+
+The chunks are seeded and folded like runTrials() does, so a run that stopped after n trials has exactly the
+statistics of runTrials(..., n, seed=seed) with the same chunk size, and it can use a ResultCache the same way.
+"""
+import argparse
+from statistics import NormalDist
+
+import numpy as np
+
+from .runner import DEFAULT_CHUNK_SIZE, RESULT_COLUMNS, runTrials
+
+# z of the two-sided 95% interval, the default of estimate()
+_Z95 = NormalDist().inv_cdf(0.975)
+
+
+def _columns(target):
+    """
+    :param target: column name or "numerator/denominator" of two column names
+    :return: (column index, None) or (numerator index, denominator index)
+    :raises: ValueError for unknown names
+    """
+    names = target.split("/")
+    if len(names) > 2 or not all(name in RESULT_COLUMNS for name in names):
+        raise ValueError("targets are result columns ({}) or a ratio of two of them, not {!r}".format(
+            ", ".join(RESULT_COLUMNS), target))
+    indices = [RESULT_COLUMNS.index(name) for name in names]
+    return indices[0], indices[1] if len(indices) == 2 else None
+
+
+def estimate(stats, target, z=_Z95):
+    """
+    Point estimate and standard error of a target. A target that has not varied at all and is still zero, like a
+    kill rate that has not seen a kill yet, gets the standard error that puts z of them at the upper bound of a rate
+    with no events in n trials, -ln(1 - confidence)/n (the rule of three, 3/n, at 95%), instead of 0, so it does not
+    pass for precise
+    :param stats: RunningStats of the result rows
+    :param target: column name or "numerator/denominator"
+    :param z: z of the confidence level of the intervals, NormalDist().inv_cdf((1 + confidence) / 2)
+    :return: (estimate, standard error), nan when nothing can be said yet
+    """
+    if stats.count < 2:
+        return np.nan, np.nan
+    a, b = _columns(target)
+    n = stats.count
+    if b is None:
+        value = stats.mean[a]
+        error = stats.std_error[a]
+        scale = 1.0
+    else:
+        if stats.mean[b] == 0:
+            return np.nan, np.nan
+        value = stats.mean[a] / stats.mean[b]
+        cov = stats.covariance
+        variance = cov[a, a] - 2*value*cov[a, b] + value**2*cov[b, b]
+        error = np.sqrt(max(variance, 0.0) / n) / stats.mean[b]
+        scale = stats.mean[b]
+    if value == 0 and error == 0:
+        # 1 - confidence from z, as the upper tails on both sides
+        error = -np.log(2*NormalDist().cdf(-z)) / (n*scale) / z
+    return value, error
+
+
+class AdaptiveResult:
+    def __init__(self, stats, targets, confidence, stopped):
+        """
+        :param stats: RunningStats of all trials that were run
+        :param targets: dict of target -> dict with estimate, std_error, half_width, ci (low, high) and precise
+        :param confidence: confidence level of the intervals
+        :param stopped: "precision" when every target was precise enough, "budget" when max_trials ran out first
+        """
+        self.stats = stats
+        self.targets = targets
+        self.confidence = confidence
+        self.stopped = stopped
+
+    @property
+    def trials(self):
+        return self.stats.count
+
+
+def _summaries(stats, precision, z):
+    summaries = {}
+    for target, (wanted, relative) in precision.items():
+        value, error = estimate(stats, target, z)
+        half_width = z*error
+        limit = wanted*abs(value) if relative else wanted
+        summaries[target] = {"estimate": float(value), "std_error": float(error), "half_width": float(half_width),
+                             "ci": (float(value - half_width), float(value + half_width)),
+                             "precise": bool(half_width <= limit)}
+    return summaries
+
+
+def runUntilPrecise(scenario, tau, targets, precision, max_trials, confidence=0.95, relative=False, min_trials=None,
+                    chunk_size=DEFAULT_CHUNK_SIZE, callback=None, **kwargs):
+    """
+    Runs chunks of trials until the confidence interval of every target is within its precision, or max_trials
+    have run
+    :param scenario: scenario number 1 2 or 3, ScenarioSpec, preset name or scenario file, see scenario.py
+    :param tau: the classification threshold
+    :param targets: column names or "numerator/denominator" ratios of them, see the module docstring
+    :param precision: wanted half-width of the intervals, one for all targets or a dict per target
+    :param max_trials: budget of trials, the run stops once they are spent
+    :param confidence: confidence level of the (normal) intervals
+    :param relative: precision is relative to the estimates, e.g. 0.05 for +-5%
+    :param min_trials: trials to run before the intervals are trusted at all, defaults to two chunks
+    :param chunk_size: trials per chunk, the precision is checked after every chunk
+    :param callback: called with the RunningStats after every chunk
+    :param kwargs: passed to runTrials(), e.g. workers, greedy, seed, cache, backend
+    :return: AdaptiveResult
+    """
+    targets = list(targets)
+    if not targets:
+        raise ValueError("give at least one target")
+    for target in targets:
+        _columns(target)
+    if not isinstance(precision, dict):
+        precision = {target: precision for target in targets}
+    if set(precision) != set(targets) or not all(p > 0 for p in precision.values()):
+        raise ValueError("precision must be a positive number, or one per target")
+    if not (0 < confidence < 1):
+        raise ValueError("confidence must be in (0, 1)")
+    if min_trials is None:
+        min_trials = 2*chunk_size
+    wanted = {target: (precision[target], relative) for target in targets}
+    z = NormalDist().inv_cdf((1 + confidence) / 2)
+
+    def check(stats):
+        if callback is not None:
+            callback(stats)
+        if stats.count < min_trials:
+            return False
+        return all(s["precise"] for s in _summaries(stats, wanted, z).values())
+
+    stats = runTrials(scenario, tau, max_trials, chunk_size=chunk_size, callback=check, **kwargs)
+    summaries = _summaries(stats, wanted, z)
+    stopped = "precision" if stats.count >= min_trials and all(s["precise"] for s in summaries.values()) else "budget"
+    return AdaptiveResult(stats, summaries, confidence, stopped)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run trials until the confidence intervals are tight enough")
+    parser.add_argument("--scenario", nargs="+", default=["1"],
+                        help="scenario numbers, preset names or scenario files, see scenario.py")
+    parser.add_argument("--tau", type=float, nargs="+", default=[0.9])
+    parser.add_argument("--target", nargs="+", default=["civilians_killed/civilians"],
+                        help="result columns or ratios of them, e.g. civilians_killed/civilians")
+    parser.add_argument("--precision", type=float, default=0.01, help="wanted half-width of the intervals")
+    parser.add_argument("--relative", action="store_true", help="precision is relative to the estimates")
+    parser.add_argument("--confidence", type=float, default=0.95)
+    parser.add_argument("--max-trials", type=int, default=10**6)
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--greedy", action=argparse.BooleanOptionalAction, default=True)
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--cache", help="SQLite file of cached results, see cache.py")
+    args = parser.parse_args(argv)
+
+    for scenario in args.scenario:
+        for tau in args.tau:
+            result = runUntilPrecise(scenario, tau, args.target, args.precision, args.max_trials,
+                                     confidence=args.confidence, relative=args.relative, chunk_size=args.chunk_size,
+                                     workers=args.workers, greedy=args.greedy, seed=args.seed, cache=args.cache)
+            print("Scenario {}, tau {}, greedy={}: {} trials, stopped by {} (seed entropy {})".format(
+                scenario, tau, args.greedy, result.trials, result.stopped, result.stats.seed))
+            for target, summary in result.targets.items():
+                print("\t{:30} {:.5f} +- {:.5f}, {:.0%} CI [{:.5f}, {:.5f}]".format(
+                    target, summary["estimate"], summary["half_width"], result.confidence, *summary["ci"]))
+
+
+if __name__ == '__main__':
+    main()
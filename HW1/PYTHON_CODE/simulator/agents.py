@@ -0,0 +1,74 @@
+"""
+Array-backed state of one kind of agent (sensors, lethals, human warfighters or unknowns).
+
+Positions and goals are contiguous float32 arrays of shape (..., n, 2), the alive mask and the combatant ground truth
+are bool arrays of shape (..., n). Any leading axes, like the trial axis of BatchSimulator, are carried through.
+
+The simulators keep their older attribute names (sensor_loc, human_alive, unknown_goal, ...) as properties that
+forward to the groups, see groupAttribute().
+"""
+import numpy as np
+
+FIELDS = ("pos", "alive", "goal", "is_combatant")
+
+
+class AgentGroup:
+    def __init__(self, positions, goals=None, is_combatant=None):
+        """
+        :param positions: (..., n, 2) array of starting locations
+        :param goals: (..., n, 2) array of goal locations, for the agents that walk to goals
+        :param is_combatant: (..., n) bool ground truth, for the unknowns
+        """
+        self.pos = np.ascontiguousarray(positions, dtype=np.float32)
+        self.alive = np.ones(self.pos.shape[:-1], dtype=bool)
+        self.goal = None if goals is None else np.ascontiguousarray(goals, dtype=np.float32)
+        self.is_combatant = None if is_combatant is None else np.ascontiguousarray(is_combatant, dtype=bool)
+
+    def __len__(self):
+        return self.pos.shape[-2]
+
+    @property
+    def nbytes(self):
+        """Memory held by the arrays of the group"""
+        return sum(getattr(self, name).nbytes for name in FIELDS if getattr(self, name) is not None)
+
+    def select(self, rows):
+        """
+        :param rows: index array or bool mask along the leading (trial) axis
+        :return: new AgentGroup holding copies of those rows
+        """
+        group = AgentGroup.__new__(AgentGroup)
+        for name in FIELDS:
+            value = getattr(self, name)
+            setattr(group, name, None if value is None else value[rows])
+        return group
+
+    def assign(self, rows, other):
+        """
+        Writes the state of another group into some rows of this one
+        :param rows: index array along the leading (trial) axis
+        :param other: AgentGroup with len(rows) rows
+        :return: None
+        """
+        for name in FIELDS:
+            value = getattr(self, name)
+            if value is not None:
+                value[rows] = getattr(other, name)
+
+
+def groupAttribute(group, field):
+    """
+    Property forwarding one of the older loose attributes to a field of an AgentGroup, e.g.
+    human_loc = groupAttribute("humans", "pos"). Assigned values are converted to the dtype of the field.
+    :param group: name of the AgentGroup attribute
+    :param field: name of the field of the group
+    :return: property
+    """
+    def get(self):
+        return getattr(getattr(self, group), field)
+
+    def set(self, value):
+        agents = getattr(self, group)
+        setattr(agents, field, np.ascontiguousarray(value, dtype=getattr(agents, field).dtype))
+
+    return property(get, set, doc="{}.{}".format(group, field))
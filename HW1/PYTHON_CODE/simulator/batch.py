@@ -0,0 +1,362 @@
+"""
+Batched version of the Simulator: runs many independent trials of the same scenario in lock-step.
+
+Every piece of world state carries a leading trial axis, e.g. sensor_loc is (n_trials, num_sensors, 2) and
+unknown_alive is (n_trials, num_unknown). Each tick goes through the same phases, in the same order, as
+Simulator.run(). The robots move with the same policy functions as Simulator (see policies.py), which take all
+agents of all trials in one call, and the walkers and the estimates are updated as whole arrays, so the Python
+overhead of a tick does not grow with the number of agents or trials.
+
+Everything is mirrored from simulator.py as it is written there, including the quirks, so that a batch of trials is
+statistically interchangeable with the same number of separate Simulator objects.
+"""
+import numpy as np
+
+from .agents import AgentGroup, groupAttribute
+from .distances import DistanceCache
+from .estimation import updateEstimates, outcomeDecided
+from .metrics import runPhase
+from .policies import WorldView, defaultPolicy, getPolicy
+from .scenario import scenarioSpec
+
+# state that is taken apart by row when trials finish early, see BatchSimulator.retire()
+GROUPS = ("sensors", "lethals", "humans", "unknowns")
+RETIRED_STATE = GROUPS + ("unknown_estimates", "tau")
+
+
+class BatchSimulator:
+    sensor_loc = groupAttribute("sensors", "pos")
+    lethal_loc = groupAttribute("lethals", "pos")
+    human_loc = groupAttribute("humans", "pos")
+    human_alive = groupAttribute("humans", "alive")
+    human_goal = groupAttribute("humans", "goal")
+    unknown_loc = groupAttribute("unknowns", "pos")
+    unknown_alive = groupAttribute("unknowns", "alive")
+    unknown_goal = groupAttribute("unknowns", "goal")
+    unknown_is_combatant = groupAttribute("unknowns", "is_combatant")
+
+    def __init__(self, scenario, tau, n_trials, greedy=True, seed=None, rng=None, trajectory=None, sensor_policy=None,
+                 lethal_policy=None, early_stop=True, metrics=None):
+        """
+        Batched counterpart of Simulator. Call .run() to execute all trials.
+
+        :param scenario: int, should be 1 2 or 3. Will throw a ValueError if not one of those values. Can also be a
+                         ScenarioSpec, a preset name or a scenario file, see scenario.py
+        :param tau: the classification threshold for
+        :param n_trials: number of independent trials to run side by side
+        :param greedy: use the greedy sensor/lethal policies instead of the per-scenario ones
+        :param seed: seed for the random generator of this batch, anything np.random.default_rng() accepts
+        :param rng: a numpy.random.Generator to draw from instead, can not be combined with seed
+        :param trajectory: a TrajectoryRecorder that run() records every tick of every trial into
+        :param sensor_policy: name of a registered sensor policy or a policy function, see policies.py
+        :param lethal_policy: the same for the lethal robots
+        :param early_stop: take trials out of the tick loop as soon as their outcome is decided, see
+                           Simulator.outcomeDecided(). The remaining trials run on smaller arrays
+        :param metrics: a SimulationMetrics that run() times and counts every tick into, summed over the trials, see
+                        metrics.py
+        """
+        spec = scenarioSpec(scenario)
+        if not (0 <= tau <= 1):
+            raise ValueError("tau must be a float in [0, 1]")
+        if n_trials < 1:
+            raise ValueError("n_trials must be a positive int")
+        if rng is not None and seed is not None:
+            raise ValueError("pass either seed or rng, not both")
+        # Draws are made in the same order and shapes as Simulator, plus the trial axis, so a batch of one trial
+        # reproduces Simulator with the same seed
+        self.rng = rng if rng is not None else np.random.default_rng(seed)
+        self.spec = spec
+        self.tau = tau
+        self.endTime = spec.end_time
+        self.n_trials = n_trials
+        self.trajectory = trajectory
+        self.early_stop = early_stop
+        self.metrics = metrics
+        # (n_trials,) number of ticks every trial ran, set by run()
+        self.termination_tick = None
+        # the trials that are still running, their state is what the *_loc, *_alive, ... arrays hold
+        self.active_rows = np.arange(n_trials)
+        # full size state the finished trials are kept in while the others run, see retire()
+        self._retired = None
+
+        # world parameters
+        self.xy_size = spec.xy_size
+        self.lethal_radius = spec.lethal_radius
+        self.scene = spec.policy
+
+        # agent counts in each category
+        self.num_sensors = spec.num_sensors
+        self.num_lethal = spec.num_lethal
+        self.num_humans = spec.num_humans
+        self.num_unknown = spec.num_unknown
+
+        # User defined agent parameters:
+        self.sensor_max_step_size = spec.sensor_max_step_size
+        self.lethal_max_step_size = spec.lethal_max_step_size
+        self.use_greedy = greedy
+        self.sensor_policy = getPolicy("sensor", sensor_policy or defaultPolicy(greedy, self.scene))
+        self.lethal_policy = getPolicy("lethal", lethal_policy or defaultPolicy(greedy, self.scene))
+        self.sensor_range = spec.sensor_range
+
+        # starting locations
+        sensor_loc = self.drawLocations([n_trials, self.num_sensors, 2])
+        lethal_loc = self.drawLocations([n_trials, self.num_lethal, 2])
+        human_loc = self.drawLocations([n_trials, self.num_humans, 2])
+        unknown_loc = self.drawLocations([n_trials, self.num_unknown, 2])
+
+        # create random goal locations for each human to reach
+        human_goal = self.drawLocations([n_trials, self.num_humans, 2])
+
+        # prior for each certainty of combatant
+        self.unknown_estimates = np.full((n_trials, self.num_unknown), float(spec.prior))
+
+        # ground truth, True for combatants
+        is_combatant = ~(self.drawUniform((n_trials, self.num_unknown)) > spec.combatant_ratio)
+
+        # lastly, the location goals of the unknowns
+        unknown_goal = self.drawLocations([n_trials, self.num_unknown, 2])
+
+        self.sensors = AgentGroup(sensor_loc)
+        self.lethals = AgentGroup(lethal_loc)
+        self.humans = AgentGroup(human_loc, goals=human_goal)
+        self.unknowns = AgentGroup(unknown_loc, goals=unknown_goal, is_combatant=is_combatant)
+
+        self._trials = np.arange(n_trials)
+        self.distance_cache = DistanceCache(self)
+
+    def run(self):
+        """
+        Executes every trial for the configured number of timesteps, or until its outcome is decided with early_stop.
+        The number of ticks of every trial is left in termination_tick.
+        :return: (n_trials, 6) int array, one row per trial with the same columns as Simulator.run():
+                 num_combatants_killed, num_warfighters_killed, num_civilians_killed
+                 num_combatants, num_warfighters, num_civilians
+        """
+        if self.trajectory is not None:
+            self.trajectory.start(self)
+        self.termination_tick = np.full(self.n_trials, self.endTime)
+        metrics = self.metrics
+        phase = runPhase if metrics is None else metrics.phase  # times and counts the phases when metrics are on
+        for t in range(self.endTime):
+            if self.early_stop:
+                decided = outcomeDecided(self.unknown_alive, self.unknown_is_combatant, self.human_alive,
+                                         self.tau, self.scene)
+                if decided.any():
+                    self.termination_tick[self.active_rows[decided]] = t
+                    self.retire(decided)
+                    if not len(self.active_rows):
+                        break
+
+            if metrics is not None:
+                metrics.startTick(self, t)
+            # update agent locations
+            phase(self, "sensor_move", self.updateSensorLocations)
+            phase(self, "lethal_move", self.updateLethalLocations)
+            phase(self, "human_move", self.updateHumanLocations)
+            phase(self, "unknown_move", self.updateUnknownLocations)
+
+            # update estimates of combatant versus noncombatant
+            phase(self, "estimate_update", self.updateCombatantEstimate)
+
+            # update lethal actions (combatants against humans and lethal robots against combatants)
+            phase(self, "lethal_actions", self.updateLethalActions)
+
+            if self.trajectory is not None:
+                self.trajectory.record(self, t)
+
+            if metrics is not None:
+                metrics.endTick(self, t)
+
+        self.restoreRetired()
+        if self.trajectory is not None:
+            self.trajectory.close()
+        return self.results()
+
+    def retire(self, rows):
+        """
+        Takes finished trials out of the arrays the tick loop works on. Their state is put aside in full size arrays
+        until restoreRetired()
+        :param rows: (len(active_rows),) bool mask of the trials to take out
+        :return: None
+        """
+        if self._retired is None:
+            self._retired = {name: getattr(self, name) for name in RETIRED_STATE}
+        self._putAside(rows)
+        keep = ~rows
+        for name in GROUPS:
+            setattr(self, name, getattr(self, name).select(keep))
+        self.unknown_estimates = self.unknown_estimates[keep]
+        if np.ndim(self.tau):
+            self.tau = self.tau[keep]
+        self.active_rows = self.active_rows[keep]
+        self._trials = np.arange(len(self.active_rows))
+        self.distance_cache.clear()
+
+    def _putAside(self, rows):
+        finished = self.active_rows[rows]
+        for name in GROUPS:
+            self._retired[name].assign(finished, getattr(self, name).select(rows))
+        self._retired["unknown_estimates"][finished] = self.unknown_estimates[rows]
+
+    def restoreRetired(self):
+        """
+        Puts the state of all trials back together after run(), so the arrays hold every trial again
+        :return: None
+        """
+        if self._retired is None:
+            return
+        if len(self.active_rows):
+            self._putAside(np.ones(len(self.active_rows), dtype=bool))
+        for name, value in self._retired.items():
+            setattr(self, name, value)
+        self._retired = None
+        self.active_rows = np.arange(self.n_trials)
+        self._trials = np.arange(self.n_trials)
+        self.distance_cache.clear()
+
+    def activeRows(self, draws):
+        """
+        :param draws: array drawn for all n_trials trials
+        :return: the rows of the trials that are still running. Draws are always made for every trial so the random
+                 stream of a trial does not depend on which other trials finished
+        """
+        if len(self.active_rows) == self.n_trials:
+            return draws
+        return draws[self.active_rows]
+
+    def drawLocations(self, shape):
+        """
+        Every random location and goal of the batch is drawn here
+        :param shape: shape of the draw, starting with the trial axis
+        :return: int array of uniform draws from [0, xy_size)
+        """
+        return self.rng.integers(0, self.xy_size, shape)
+
+    def drawUniform(self, shape):
+        """
+        Every other random number of the batch (ground truth, sensor noise) is drawn here
+        :param shape: shape of the draw, starting with the trial axis
+        :return: float array of uniform draws from [0, 1)
+        """
+        return self.rng.random(shape)
+
+    def results(self):
+        """
+        Final statistics for every trial, see run()
+        :return: (n_trials, 6) int array
+        """
+        combatant = self.unknown_is_combatant
+        dead = ~self.unknown_alive
+        data = np.zeros((self.n_trials, 6), dtype=int)
+        data[:, 0] = np.sum(combatant & dead, axis=1)
+        data[:, 1] = np.sum(~self.human_alive, axis=1)
+        data[:, 2] = np.sum(~combatant & dead, axis=1)
+        data[:, 3] = np.sum(combatant, axis=1)
+        data[:, 4] = self.num_humans
+        data[:, 5] = np.sum(~combatant, axis=1)
+        return data
+
+    def updateSensorLocations(self):
+        """
+        Moves every sensor robot in all trials with one call of the sensor policy
+        :return: None
+        """
+        view = WorldView(self)
+        view.apply(self.sensor_loc, self.sensor_policy(view))
+        self.distance_cache.invalidate("sensor")
+
+    def updateLethalLocations(self):
+        """
+        Moves every lethal robot in all trials with one call of the lethal policy
+        :return: None
+        """
+        view = WorldView(self)
+        view.apply(self.lethal_loc, self.lethal_policy(view))
+        self.distance_cache.invalidate("lethal")
+
+    def walkToGoals(self, locs, goals, alive):
+        """
+        Living agents take one step of an 8-connected walk toward their goal, the agents that are within 4 of theirs
+        get a new goal first. As in Simulator a new goal is drawn for every agent, used or not.
+        :return: None
+        """
+        new_goals = self.activeRows(self.drawLocations((self.n_trials,) + goals.shape[1:]))
+        reached = alive & (np.linalg.norm(locs - goals, 2, axis=-1) < 4)
+        goals[reached] = new_goals[reached]
+        locs[alive] += np.sign(goals[alive] - locs[alive])
+
+    def updateHumanLocations(self):
+        """
+        Updates the locations of all human (non-controllable) warfighters, see Simulator.updateHumanLocations
+        :return: None
+        """
+        self.walkToGoals(self.human_loc, self.human_goal, self.human_alive)
+        self.distance_cache.invalidate("human")
+
+    def updateUnknownLocations(self):
+        """
+        Updates the locations of combatants and civilians, see Simulator.updateUnknownLocations. Combatants step
+        toward their closest living warfighter (the lowest index on ties), civilians walk to their goals.
+        :return: None
+        """
+        distances = self.distance_cache.get("unknown", "human")
+        distances = np.where(self.human_alive[:, None, :], distances, np.inf)
+        closest = np.argmin(distances, axis=2)
+        hunting = self.unknown_alive & self.unknown_is_combatant & np.any(self.human_alive, axis=1)[:, None]
+
+        self.walkToGoals(self.unknown_loc, self.unknown_goal, self.unknown_alive & ~self.unknown_is_combatant)
+        target = self.human_loc[self._trials[:, None], closest]
+        self.unknown_loc[hunting] += np.sign(target[hunting] - self.unknown_loc[hunting])
+        self.distance_cache.invalidate("unknown")
+
+    def updateCombatantEstimate(self):
+        """
+        Batched Simulator.updateCombatantEstimate, all unknowns of all trials at once
+        :return: bool mask of the unknowns that got a reading
+        """
+        # one sensor noise draw per unknown, used or not
+        draws = self.activeRows(self.drawUniform((self.n_trials, self.num_unknown)))
+        # Uses the shortest distance (most confident reading)
+        closest = np.min(self.distance_cache.get("sensor", "unknown"), axis=1)
+        return updateEstimates(self.unknown_estimates, closest, self.unknown_alive, self.unknown_is_combatant, draws,
+                               self.tau, self.sensor_range)
+
+    def updateLethalActions(self):
+        """
+        Combatants disable warfighters within the lethal radius, then lethal robots disable unknowns believed to be
+        combatants, see Simulator.updateLethalActions
+        :return: None
+        """
+        # no policy reads these distances, the pairs in range come from a neighbour list instead of the full matrix
+        armed = self.unknown_is_combatant & self.unknown_alive
+        (trials, wf_ids, unk_ids), _ = self.distance_cache.within("human", "unknown", self.lethal_radius)
+        hits = armed[trials, unk_ids]
+        self.human_alive[trials[hits], wf_ids[hits]] = False
+        self.distance_cache.aliveChanged("human")
+
+        distances = self.distance_cache.get("lethal", "unknown")
+        estimates = self.unknown_estimates
+        if self.scene == 3:
+            confident = estimates > self.tau
+        else:
+            confident = (estimates > self.tau) & ((estimates - estimates*0.01) > self.tau)
+        self.unknown_alive &= ~np.any((distances <= self.lethal_radius) & confident[:, None, :], axis=1)
+        self.distance_cache.aliveChanged("unknown")
+
+
+if __name__ == '__main__':
+    # A batch of one trial has to match Simulator with the same seed exactly, and the batched averages should agree
+    # with separate Simulator objects for each scenario
+    from .simulator import Simulator
+
+    trials = 200
+    for s in (1, 2, 3):
+        for greedy in (True, False):
+            single = np.array([Simulator(s, 0.5, greedy=greedy, seed=seed).run() for seed in range(trials)])
+            matches = sum(np.array_equal(BatchSimulator(s, 0.5, 1, greedy=greedy, seed=seed).run()[0], single[seed])
+                          for seed in range(trials))
+            batch = BatchSimulator(s, 0.5, trials, greedy=greedy, seed=0).run()
+            print("Scenario {}, greedy={}: {}/{} single trial batches match Simulator".format(s, greedy, matches,
+                                                                                          trials))
+            print("\tbatch:     {}".format(np.round(np.average(batch, axis=0), 2)))
+            print("\tSimulator: {}".format(np.round(np.average(single, axis=0), 2)))
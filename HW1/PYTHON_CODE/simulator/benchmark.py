@@ -0,0 +1,228 @@
+"""
+Benchmark of Simulator.run() with the time broken down by phase of the tick loop.
+
+Every combination of scenario, greedy and agent-count scale runs a number of seeded episodes. The phase methods of
+each simulation are wrapped with timers, so the tick loop in run() itself is what gets measured. Reported per
+combination: episodes per second, p50/p99 tick latency, the total time and share of every phase, and peak memory
+from one extra episode under tracemalloc (tracemalloc slows everything down, so it is not on during the timed ones).
+
+    python -m simulator.benchmark --scale 1 4 16 --episodes 50 --output bench.json
+    python -m simulator.benchmark --output new.json --compare bench.json
+
+With --compare, combinations whose episodes per second dropped by more than --tolerance against an earlier JSON file
+are listed and the exit status is 1.
+
+The report also has the cold start time of `from simulator import Simulator` in fresh interpreters, which every
+worker process of a pool pays. Plotting is imported only once something is rendered, so the import must not pull in
+matplotlib or PIL either; with --cold-start-budget the exit status is 1 if it does or if the median import takes longer
+than the budget:
+
+    python -m simulator.benchmark --episodes 5 --cold-start-budget 0.3
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+from .metrics import PHASES
+from .simulator import Simulator
+from .recording import FrameRingBuffer
+from .scenario import scenarioSpec
+
+# modules that only the rendering path may import
+PLOTTING_MODULES = ("matplotlib", "PIL")
+
+# run in a fresh interpreter by coldStart(), prints the import time and the plotting modules that got imported
+_COLD_START = """import sys, time
+start = time.perf_counter()
+from {} import Simulator
+print(time.perf_counter() - start)
+print(" ".join(m for m in {!r} if m in sys.modules))
+"""
+
+
+class PhaseTimer:
+    def __init__(self, sim):
+        """
+        Wraps the phase methods of one simulation so every call is timed
+        :param sim: Simulator that has not run yet
+        """
+        self.times = {name: [] for name, _ in PHASES}
+        for name, method in PHASES:
+            setattr(sim, method, self._timed(getattr(sim, method), self.times[name]))
+
+    @staticmethod
+    def _timed(function, times):
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            result = function(*args, **kwargs)
+            times.append(time.perf_counter() - start)
+            return result
+        return timed
+
+    def tickTimes(self):
+        """
+        :return: (ticks,) array of the time spent in all phases of every tick
+        """
+        ticks = np.array(self.times["sensor_move"])
+        for name, _ in PHASES[1:]:
+            if self.times[name]:
+                ticks += self.times[name]
+        return ticks
+
+
+def _newSimulator(spec, greedy, seed, render):
+    return Simulator(spec, 0.9, displayOn=render, greedy=greedy, seed=seed,
+                     frame_writer=FrameRingBuffer(1) if render else None)
+
+
+def benchmark(scenario, greedy, scale, episodes, seed=0, render=False):
+    """
+    Times episodes of one configuration
+    :param scenario: scenario number 1 2 or 3, ScenarioSpec, preset name or scenario file, see scenario.py
+    :param greedy: use the greedy sensor/lethal policies
+    :param scale: agent-count multiplier, see ScenarioSpec.scaled()
+    :param episodes: number of timed episodes, episode i is seeded with seed + i
+    :param seed: seed of the first episode
+    :param render: also render every tick, into an in-memory FrameRingBuffer so no disk I/O is timed
+    :return: dict of results, see the module docstring
+    """
+    spec = scenarioSpec(scenario).scaled(scale)
+    phase_totals = {name: 0.0 for name, _ in PHASES}
+    ticks = []
+    start = time.perf_counter()
+    for i in range(episodes):
+        sim = _newSimulator(spec, greedy, seed + i, render)
+        timer = PhaseTimer(sim)
+        sim.run()
+        ticks.append(timer.tickTimes())
+        for name, times in timer.times.items():
+            phase_totals[name] += sum(times)
+    elapsed = time.perf_counter() - start
+
+    tracemalloc.start()
+    _newSimulator(spec, greedy, seed, render).run()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    ticks = np.concatenate(ticks)
+    phase_time = sum(phase_totals.values())
+    return {"scenario": scenario if isinstance(scenario, (int, str)) else scenario.name, "greedy": greedy,
+            "scale": scale, "agents": spec.num_agents, "episodes": episodes, "render": render,
+            "seconds": elapsed,
+            "episodes_per_sec": episodes / elapsed,
+            "tick_p50_ms": float(np.percentile(ticks, 50))*1e3,
+            "tick_p99_ms": float(np.percentile(ticks, 99))*1e3,
+            "phases": {name: {"seconds": total, "share": total / phase_time if phase_time else 0.0}
+                       for name, total in phase_totals.items()},
+            "peak_traced_bytes": peak}
+
+
+def coldStart(repeats=5):
+    """
+    Times `from simulator import Simulator` in fresh interpreters
+    :param repeats: number of interpreters, the median is reported
+    :return: dict: median and all import times in seconds, and the plotting modules that got imported
+    """
+    package = __package__
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, (root, os.environ.get("PYTHONPATH")))))
+    times = []
+    plotting = set()
+    for _ in range(repeats):
+        out = subprocess.run([sys.executable, "-c", _COLD_START.format(package, PLOTTING_MODULES)], env=env,
+                             capture_output=True, text=True, check=True).stdout.split("\n")
+        times.append(float(out[0]))
+        plotting.update(out[1].split())
+    return {"import_seconds": float(np.median(times)), "samples": times, "plotting_modules": sorted(plotting)}
+
+
+def _key(result):
+    return result["scenario"], result["greedy"], result["scale"], result["render"]
+
+
+def compare(old, new, tolerance=0.1):
+    """
+    :param old: earlier report, as written by main()
+    :param new: current report
+    :param tolerance: allowed relative drop in episodes per second
+    :return: list of (result key, old episodes/sec, new episodes/sec) that got slower than allowed
+    """
+    before = {_key(r): r for r in old["results"]}
+    slower = []
+    for result in new["results"]:
+        previous = before.get(_key(result))
+        if previous is not None and result["episodes_per_sec"] < previous["episodes_per_sec"]*(1 - tolerance):
+            slower.append((_key(result), previous["episodes_per_sec"], result["episodes_per_sec"]))
+    return slower
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark Simulator.run() with per-phase timing")
+    parser.add_argument("--scenario", nargs="+", default=["1", "2", "3"],
+                        help="scenario numbers, preset names or scenario files, see scenario.py")
+    parser.add_argument("--greedy", choices=("yes", "no", "both"), default="both")
+    parser.add_argument("--scale", type=int, nargs="+", default=[1])
+    parser.add_argument("--episodes", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--render", action="store_true")
+    parser.add_argument("--output", help="JSON file the report is written to")
+    parser.add_argument("--compare", help="earlier JSON report to check for regressions against")
+    parser.add_argument("--tolerance", type=float, default=0.1)
+    parser.add_argument("--cold-start-budget", type=float,
+                        help="seconds the median `from simulator import Simulator` in a fresh interpreter may take")
+    args = parser.parse_args(argv)
+
+    cold = coldStart()
+    print("Cold start: {:.1f} ms to import Simulator, plotting modules imported: {}".format(
+        cold["import_seconds"]*1e3, ", ".join(cold["plotting_modules"]) or "none"))
+
+    greedy = {"yes": [True], "no": [False], "both": [True, False]}[args.greedy]
+    results = []
+    for scenario in args.scenario:
+        for g in greedy:
+            for scale in args.scale:
+                result = benchmark(scenario, g, scale, args.episodes, args.seed, args.render)
+                results.append(result)
+                print("Scenario {}, greedy={}, scale {}: {:.1f} episodes/s, tick p50 {:.3f} ms, p99 {:.3f} ms, "
+                      "peak {:.1f} KiB".format(scenario, g, scale, result["episodes_per_sec"], result["tick_p50_ms"],
+                                               result["tick_p99_ms"], result["peak_traced_bytes"] / 1024))
+                for name, phase in result["phases"].items():
+                    if phase["seconds"]:
+                        print("\t{:16} {:8.3f} s {:6.1%}".format(name, phase["seconds"], phase["share"]))
+
+    report = {"python": platform.python_version(), "numpy": np.__version__, "platform": platform.platform(),
+              "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+              "max_rss_kib": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+              "cold_start": cold, "results": results}
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+    status = 0
+    if args.cold_start_budget is not None and (cold["import_seconds"] > args.cold_start_budget or
+                                               cold["plotting_modules"]):
+        print("cold start over budget: {:.1f} ms > {:.1f} ms or plotting modules imported".format(
+            cold["import_seconds"]*1e3, args.cold_start_budget*1e3))
+        status = 1
+
+    if args.compare:
+        with open(args.compare) as f:
+            slower = compare(json.load(f), report, args.tolerance)
+        for key, before, after in slower:
+            print("slower: scenario {}, greedy={}, scale {}, render={}: {:.1f} -> {:.1f} episodes/s".format(
+                *key, before, after))
+        if slower:
+            status = 1
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main())
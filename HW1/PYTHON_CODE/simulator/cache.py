@@ -0,0 +1,166 @@
+"""
+Persistent cache of Monte-Carlo results, so repeated experiments do not simulate the same trials again.
+
+Results are cached per chunk of runTrials(): the key is a hash of everything the chunk's result rows depend on, which
+is the scenario spec (all fields but its name), tau, the sensor and lethal policy, the chunk's seed and size, and the
+version of the simulator code. The value is the chunk's RunningStats, so folding cached chunks gives bit-for-bit the
+statistics of running them. Asking for more trials with the same seed and chunk size only simulates the chunks that
+are not cached yet:
+
+    cache = ResultCache("results.sqlite")
+    runTrials(3, 0.9, 100000, seed=1, cache=cache)     # simulates everything
+    runTrials(3, 0.9, 100000, seed=1, cache=cache)     # nothing to simulate
+    runTrials(3, 0.9, 200000, seed=1, cache=cache)     # simulates the second half only
+
+The cache is one SQLite database in WAL mode, any number of processes can read and write it at the same time. When
+its entries grow past max_bytes, the least recently used ones are dropped. The code version is a hash of the source
+files of this package, so changing any of them starts over with fresh entries (the old ones age out of the LRU).
+"""
+import hashlib
+import inspect
+import json
+import os
+import sqlite3
+import time
+from contextlib import closing
+
+import numpy as np
+
+from .policies import defaultPolicy, getPolicy
+
+DEFAULT_MAX_BYTES = 64 << 20
+
+_PACKAGE_DIR = os.path.dirname(os.path.abspath(__file__))
+_code_version = None
+
+
+def codeVersion():
+    """
+    :return: hex sha256 of the source files of the simulator package, computed once per process
+    """
+    global _code_version
+    if _code_version is None:
+        digest = hashlib.sha256()
+        for name in sorted(os.listdir(_PACKAGE_DIR)):
+            if name.endswith(".py"):
+                digest.update(name.encode())
+                with open(os.path.join(_PACKAGE_DIR, name), "rb") as f:
+                    digest.update(f.read())
+        _code_version = digest.hexdigest()
+    return _code_version
+
+
+def policyIdentity(role, policy, greedy, scene):
+    """
+    What a policy is, for cache keys. The built-in policies are covered by codeVersion(), policies registered from
+    outside the package also carry a hash of their source
+    :param role: "sensor" or "lethal"
+    :param policy: registered name or None for the default of greedy and scene, see defaultPolicy()
+    :return: str
+    """
+    name = policy or defaultPolicy(greedy, scene)
+    function = getPolicy(role, name)
+    if function.__module__.split(".")[0] == __name__.split(".")[0]:
+        return name
+    try:
+        source = inspect.getsource(function).encode()
+    except (OSError, TypeError):
+        source = function.__code__.co_code
+    return "{}:{}.{}:{}".format(name, function.__module__, function.__qualname__,
+                                hashlib.sha256(source).hexdigest()[:16])
+
+
+def chunkKey(scenario, tau, greedy, policies, seed_seq, n_trials):
+    """
+    Cache key of one chunk of runTrials()
+    :param scenario: ScenarioSpec
+    :param tau: the classification threshold
+    :param greedy: the greedy flag of the run
+    :param policies: (sensor policy, lethal policy) names, None for the defaults
+    :param seed_seq: the chunk's SeedSequence
+    :param n_trials: number of trials of the chunk
+    :return: hex sha256 str
+    """
+    spec = scenario.toDict()
+    del spec["name"]  # a preset and an equal spec from a file give the same results
+    config = {"version": codeVersion(), "scenario": spec, "tau": float(tau),
+              "sensor_policy": policyIdentity("sensor", policies[0], greedy, scenario.policy),
+              "lethal_policy": policyIdentity("lethal", policies[1], greedy, scenario.policy),
+              "entropy": str(seed_seq.entropy), "spawn_key": list(seed_seq.spawn_key),
+              "pool_size": seed_seq.pool_size, "n_trials": n_trials}
+    return hashlib.sha256(json.dumps(config, sort_keys=True).encode()).hexdigest()
+
+
+class ResultCache:
+    def __init__(self, filename, max_bytes=DEFAULT_MAX_BYTES):
+        """
+        :param filename: SQLite database file, created if it does not exist
+        :param max_bytes: size the cached entries are kept under by dropping the least recently used ones
+        """
+        if max_bytes < 1:
+            raise ValueError("max_bytes must be a positive int")
+        self.filename = filename
+        self.max_bytes = max_bytes
+        with closing(self._connect()) as db:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, value BLOB NOT NULL, "
+                       "size INTEGER NOT NULL, last_used REAL NOT NULL)")
+            db.execute("CREATE INDEX IF NOT EXISTS results_last_used ON results (last_used)")
+
+    def _connect(self):
+        # a connection per call, so one cache can be used from any thread or forked process
+        return sqlite3.connect(self.filename, timeout=60, isolation_level=None)
+
+    def get(self, key):
+        """
+        :param key: key from chunkKey()
+        :return: the cached float64 array, or None
+        """
+        with closing(self._connect()) as db:
+            row = db.execute("SELECT value FROM results WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            db.execute("UPDATE results SET last_used = ? WHERE key = ?", (time.time(), key))
+        return np.frombuffer(row[0], dtype=np.float64).copy()
+
+    def put(self, key, values):
+        """
+        Stores an entry and drops the least recently used ones while the cache is over max_bytes
+        :param key: key from chunkKey()
+        :param values: float64 array
+        :return: None
+        """
+        blob = np.asarray(values, dtype=np.float64).tobytes()
+        with closing(self._connect()) as db:
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                db.execute("INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?)",
+                           (key, blob, len(key) + len(blob), time.time()))
+                excess = db.execute("SELECT SUM(size) FROM results").fetchone()[0] - self.max_bytes
+                if excess > 0:
+                    dropped = []
+                    for old_key, size in db.execute("SELECT key, size FROM results ORDER BY last_used"):
+                        if excess <= 0:
+                            break
+                        dropped.append((old_key,))
+                        excess -= size
+                    db.executemany("DELETE FROM results WHERE key = ?", dropped)
+                db.execute("COMMIT")
+            except BaseException:
+                db.execute("ROLLBACK")
+                raise
+
+    def __len__(self):
+        with closing(self._connect()) as db:
+            return db.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+
+    def size(self):
+        """
+        :return: total bytes of the cached entries
+        """
+        with closing(self._connect()) as db:
+            return db.execute("SELECT COALESCE(SUM(size), 0) FROM results").fetchone()[0]
+
+    def clear(self):
+        with closing(self._connect()) as db:
+            db.execute("DELETE FROM results")
@@ -0,0 +1,135 @@
+"""
+Distance matrices between the agent groups of a simulation, computed with broadcasting and cached until one of the
+groups involved moves.
+
+Groups are named after the location attributes of the simulation object: "sensor", "lethal", "human" and
+"unknown" read sensor_loc, lethal_loc, human_loc and unknown_loc, and "human" and "unknown" also have an
+*_alive mask. Any leading axes of those arrays (the trial axis of BatchSimulator) are carried through, so a
+matrix between groups a and b has shape (..., num_a, num_b).
+
+The policies of a phase read the matrices before any agent of that phase moves (see policies.py), so one matrix
+serves the whole phase. The cache has to be told when a phase is done (invalidate) and when agents die
+(aliveChanged). Tests of pairs against a radius that no policy reuses the matrix of can go through within(), which
+keeps a neighbour list across ticks instead of evaluating the full matrix, see proximity.py.
+"""
+import numpy as np
+
+from .proximity import ProximityTracker
+
+# Distance given to pairs with a dead agent, so they never come out as the closest
+DEAD_DISTANCE = 1000.00
+
+
+def pairwiseDistances(a, b):
+    """
+    Euclidean distances between every point of a and every point of b
+    :param a: (..., n, 2) array of locations
+    :param b: (..., m, 2) array of locations, with the same leading axes as a
+    :return: (..., n, m) array of distances
+    """
+    diff = a[..., :, None, :] - b[..., None, :, :]
+    return np.sqrt(np.sum(diff*diff, axis=-1))
+
+
+class DistanceCache:
+    def __init__(self, world):
+        """
+        :param world: Simulator or BatchSimulator whose *_loc and *_alive attributes are read
+        """
+        self.world = world
+        self._raw = {}
+        self._masked = {}
+        self._trackers = {}
+        self._tracker_evaluations = 0
+        self._evaluations = 0
+
+    @property
+    def evaluations(self):
+        """Number of full distance matrices computed so far, including those of the neighbour lists"""
+        return self._evaluations + self._tracker_evaluations + sum(t.evaluations for t in self._trackers.values())
+
+    def get(self, a, b):
+        """
+        Plain euclidean distances from group a to group b, regardless of whether the agents are alive
+        :param a: name of the row group
+        :param b: name of the column group
+        :return: (..., num_a, num_b) array. Shared with the cache, do not modify
+        """
+        if (a, b) in self._raw:
+            return self._raw[(a, b)]
+        if (b, a) in self._raw:
+            return np.swapaxes(self._raw[(b, a)], -1, -2)
+        distances = pairwiseDistances(getattr(self.world, a + "_loc"), getattr(self.world, b + "_loc"))
+        self._evaluations += 1
+        self._raw[(a, b)] = distances
+        return distances
+
+    def getMasked(self, a, b):
+        """
+        Distances as used by the movement policies: zero distances are set to 0.1 and any pair with a dead agent in
+        it is set to 1000.0
+        :param a: name of the row group
+        :param b: name of the column group
+        :return: (..., num_a, num_b) array. Shared with the cache, do not modify
+        """
+        if (a, b) in self._masked:
+            return self._masked[(a, b)]
+        distances = self.get(a, b).copy()
+        distances[distances == 0.0] = 0.1
+        alive_a = getattr(self.world, a + "_alive", None)
+        alive_b = getattr(self.world, b + "_alive", None)
+        if alive_a is not None:
+            distances[~alive_a] = DEAD_DISTANCE
+        if alive_b is not None:
+            np.copyto(distances, DEAD_DISTANCE, where=~alive_b[..., None, :])
+        self._masked[(a, b)] = distances
+        return distances
+
+    def within(self, a, b, radius, inclusive=False):
+        """
+        The pairs of agents of groups a and b closer than radius, regardless of whether the agents are alive. Taken
+        from the full matrix if it is cached, otherwise from a neighbour list that is kept across ticks
+        :param a: name of the row group
+        :param b: name of the column group
+        :param radius: distance the pairs are tested against, compared in the dtype of the locations like the
+                       matrices of get() are
+        :param inclusive: also the pairs exactly at radius
+        :return: (index arrays, distances) like np.nonzero(get(a, b) < radius) and the distances there
+        """
+        if (a, b) in self._raw or (b, a) in self._raw:
+            distances = self.get(a, b)
+            pairs = np.nonzero(distances <= radius if inclusive else distances < radius)
+            return pairs, distances[pairs]
+        tracker = self._trackers.get((a, b, radius))
+        if tracker is None:
+            tracker = self._trackers[(a, b, radius)] = ProximityTracker(self.world, a, b, radius)
+        return tracker.within(inclusive)
+
+    def invalidate(self, *groups):
+        """
+        Drops every matrix involving one of the groups, call after they moved
+        :param groups: names of the groups that moved
+        :return: None
+        """
+        for cache in (self._raw, self._masked):
+            for key in [k for k in cache if k[0] in groups or k[1] in groups]:
+                del cache[key]
+
+    def aliveChanged(self, *groups):
+        """
+        Drops the masked matrices involving one of the groups, call after some of their agents died
+        :param groups: names of the groups with changed alive masks
+        :return: None
+        """
+        for key in [k for k in self._masked if k[0] in groups or k[1] in groups]:
+            del self._masked[key]
+
+    def clear(self):
+        """
+        Drops everything, e.g. after the world state was replaced
+        :return: None
+        """
+        self._raw.clear()
+        self._masked.clear()
+        self._tracker_evaluations += sum(t.evaluations for t in self._trackers.values())
+        self._trackers.clear()
@@ -0,0 +1,89 @@
+"""
+The sensor model and combatant estimate update of updateCombatantEstimate, as whole-array operations.
+
+Every function works element-wise on arrays of any shape, so Simulator calls them with one entry per unknown and
+BatchSimulator with a (n_trials, num_unknown) array.
+"""
+import numpy as np
+
+P_FALSE_POSITIVE = 0.0001  # Probability that a civ is identified as a combatant
+
+
+def falseNegativeRate(distance, sensor_range):
+    """
+    :param distance: distance from the unknowns to their closest sensor
+    :param sensor_range: range of the sensors
+    :return: probability that a combatant is identified as a civ at that distance
+    """
+    return 1 - np.exp(-distance / sensor_range)
+
+
+def sensorReadings(is_combatant, p_fn, p_fp, x):
+    """
+    Simulates one reading of the sensors on every unknown, see Simulator.simSensor()
+    :param is_combatant: bool ground truth of the unknowns
+    :param p_fn: false negative rates
+    :param p_fp: false positive rate(s)
+    :param x: uniform [0, 1) draws deciding the readings
+    :return: bool array, True where the reading says combatant
+    """
+    return np.where(is_combatant, x > p_fn, ~(x > p_fp))
+
+
+def updateEstimates(estimates, closest_sensor, alive, is_combatant, x, tau, sensor_range, p_fp=P_FALSE_POSITIVE):
+    """
+    One sensing step: every alive unknown with a sensor in range gets a reading, and its estimate is updated from it.
+    Unknowns that are dead or out of range keep their estimate.
+    :param estimates: probabilities that the unknowns are combatants, updated in place
+    :param closest_sensor: distance from every unknown to its closest sensor (inf when there is none)
+    :param alive: bool mask of the unknowns that are alive
+    :param is_combatant: bool ground truth of the unknowns
+    :param x: uniform [0, 1) draw per unknown deciding its reading, used or not
+    :param tau: the classification threshold
+    :param sensor_range: range of the sensors
+    :param p_fp: probability that a civ is identified as a combatant
+    :return: bool mask of the unknowns that were updated
+    """
+    dist = np.asarray(closest_sensor, dtype=float)  # the sensor model is evaluated in double precision
+    dist = np.where(dist <= 0.0, 0.01, dist)
+    update = alive & (dist < sensor_range)  # Only updates estimate if sensor is within range
+    if not np.count_nonzero(update):
+        return update
+
+    p_fn = falseNegativeRate(dist, sensor_range)
+    measurement = sensorReadings(is_combatant, p_fn, p_fp, x)
+
+    p_com = estimates
+    p_civ = 1 - p_com
+    # likelihood of the reading for a combatant and for a civ
+    lik_com = np.where(measurement, 1 - p_fn, p_fn)
+    lik_civ = np.where(measurement, p_fp, 1 - p_fp)
+    joint_com = lik_com * p_com
+    joint_civ = lik_civ * p_civ
+    # p_s0 = Prob of civ and true neg + Prob of com and false neg, p_s1 = prob of civ and false pos + prob of com and
+    # true pos. The estimate keeps the probability of what the unknown is believed to be, given the reading
+    with np.errstate(invalid='ignore', divide='ignore'):
+        posterior = np.where(p_com > tau, joint_com, joint_civ) / (joint_civ + joint_com)
+    np.copyto(estimates, posterior, where=update)
+    return update
+
+
+def outcomeDecided(unknown_alive, is_combatant, human_alive, tau, scene):
+    """
+    Whether nothing can change the kill counts of an episode any more: no combatant is left to disable a
+    warfighter (or no warfighter is left to be disabled), and no unknown is left that the lethal robots could ever
+    disable. Estimates never go above 1, so with the kill rule of scenarios 1 and 2 (estimate*0.99 > tau) no unknown
+    is ever disabled once tau >= 0.99, and in scenario 3 (estimate > tau) once tau >= 1.
+    :param unknown_alive: bool mask of the unknowns that are alive, (..., num_unknown)
+    :param is_combatant: bool ground truth of the unknowns
+    :param human_alive: bool mask of the warfighters that are alive, (..., num_humans)
+    :param tau: the classification threshold, or a (n_trials, 1) column of them
+    :param scene: scenario number of the kill rule
+    :return: bool, or a (n_trials,) bool array for batched arrays
+    """
+    armed = np.any(unknown_alive & is_combatant, axis=-1) & np.any(human_alive, axis=-1)
+    reachable = np.asarray(tau < (1.0 if scene == 3 else 0.99))
+    if reachable.ndim:
+        reachable = reachable[..., 0]
+    targets = np.any(unknown_alive, axis=-1) & reachable
+    return ~(armed | targets)
@@ -0,0 +1,262 @@
+"""
+Event-driven variant of the Simulator for long, sparse episodes on big maps, where most ticks are agents walking
+toward goals and nothing being sensed or disabled.
+
+Two kinds of work are scheduled instead of done every tick:
+
+Goals. Warfighters and civilians walk to their goal in 8-connected steps, which per axis is a straight walk until
+that axis lines up, so where a walker is at any tick follows from where its leg started. The tick a walker gets
+within 4 of its goal, the only time it needs a new goal, is predicted when the leg starts and put on a priority
+queue. The locations of all walkers are set from their legs in one array operation per tick, and a new goal is drawn
+only when one is reached.
+
+Interactions. The margins to the next sensing or kill are kept with the locations they were taken at: how much closer
+any sensor/unknown pair has to get to be in sensor range, any warfighter/combatant pair and any lethal robot/confident
+unknown pair to be in the lethal radius. As long as the agents drifted less than that since (checked from their actual
+locations), nothing can be sensed or disabled and the estimate update, the lethal actions and the sensor noise draws
+of the tick are skipped without looking at any distance. Once they drifted further, the margins are taken again, and
+the tick only runs in full if something is in range.
+
+What is not skipped: the robots and the combatants steer by the current distances to the other agents every tick,
+so they are still moved tick by tick with the same policies, and the episode still ends at end_time (or when its
+outcome is decided). The time jumps are in the walking, sensing and fighting, not in the robots.
+
+Fewer random numbers are drawn (goals only when reached, sensor noise only when something is in range), so the
+random stream differs from the one of Simulator with the same seed: the episodes are statistically equivalent, not
+identical.
+
+    sim = EventSimulator("city.yaml", 0.9, seed=0)
+    sim.run()
+"""
+import heapq
+
+import numpy as np
+
+from .simulator import Simulator
+
+# squared goal distance below which a walker gets a new goal, the norm < 4 test of Simulator
+_GOAL_REACHED = 16
+
+# float32 distances of maps up to about 10^5 are off by less than this, the margins are kept this much tighter
+_MARGIN = 0.01
+
+# the walking groups: the AgentGroup attribute and the mask of its members that walk to goals
+_WALKERS = ("humans", "unknowns")
+
+
+def goalTick(origin, goal, start, first_check):
+    """
+    Tick a walker gets within 4 of its goal
+    :param origin: integer location where its leg started
+    :param goal: integer goal location
+    :param start: tick the leg started at
+    :param first_check: first tick the goal is tested at
+    :return: the tick
+    """
+    d = np.abs(np.asarray(goal, dtype=float) - origin)
+    # before k = max(d) - 3 the longer axis alone is 4 or more away
+    k = max(first_check - start, int(d.max()) - 3, 0)
+    while np.sum(np.maximum(d - k, 0)**2) >= _GOAL_REACHED:
+        k += 1
+    return start + k
+
+
+class EventSimulator(Simulator):
+    def __init__(self, *args, **kwargs):
+        """
+        Simulator with the goals and the interactions scheduled by event, see the module docstring. Takes the
+        parameters of Simulator
+        """
+        super().__init__(*args, **kwargs)
+        self._legs = None
+        self._quiet = False
+        self.quiet_ticks = 0  # ticks the estimate update and lethal actions were skipped in
+
+    def run(self, until=None):
+        """
+        See Simulator.run()
+        """
+        if self._legs is None:
+            self._schedule()
+        return super().run(until)
+
+    def restore(self, snapshot):
+        """
+        See Simulator.restore(), the schedule is made again from the restored state
+        """
+        super().restore(snapshot)
+        self._legs = None
+
+    def _schedule(self):
+        """
+        Starts a leg for every walker at its current location, at the tick run() is at
+        """
+        self._legs = {}
+        self._events = {}
+        for group in _WALKERS:
+            agents = getattr(self, group)
+            self._legs[group] = (agents.pos.astype(float), np.full(len(agents), self.tick))
+            self._events[group] = []
+            for i in np.flatnonzero(self._walking(group)):
+                self._pushGoal(group, i, self.tick)
+        self._margins = None
+
+    def _walking(self, group):
+        agents = getattr(self, group)
+        if agents.is_combatant is None:
+            return agents.alive
+        return agents.alive & ~agents.is_combatant
+
+    def _pushGoal(self, group, i, first_check):
+        origin, start = self._legs[group]
+        tick = goalTick(origin[i], getattr(self, group).goal[i], start[i], first_check)
+        heapq.heappush(self._events[group], (tick, i))
+
+    def _walk(self, group):
+        """
+        New goals for the walkers whose goal event is due, then every walker one step along its leg
+        """
+        agents = getattr(self, group)
+        origin, start = self._legs[group]
+        events = self._events[group]
+        t = self.tick
+        while events and events[0][0] <= t:
+            _, i = heapq.heappop(events)
+            if not agents.alive[i]:
+                continue
+            agents.goal[i] = self.rng.integers(0, self.xy_size, 2)
+            origin[i] = agents.pos[i]
+            start[i] = t
+            self._pushGoal(group, i, t + 1)
+
+        walking = self._walking(group)
+        delta = agents.goal[walking] - origin[walking]
+        steps = np.minimum((t + 1 - start[walking])[:, None], np.abs(delta))
+        agents.pos[walking] = origin[walking] + np.sign(delta)*steps
+
+    def updateHumanLocations(self):
+        """
+        Warfighters walk along their legs, see the module docstring
+        :return: None
+        """
+        self._walk("humans")
+        self.distance_cache.invalidate("human")
+
+    def updateUnknownLocations(self):
+        """
+        Combatants step toward their closest living warfighter every tick as in Simulator, civilians walk along
+        their legs
+        :return: None
+        """
+        hunting = self.unknown_alive & self.unknown_is_combatant
+        if hunting.any() and self.human_alive.any():
+            closest = self.closestWarfighters()[hunting]
+            self.unknown_loc[hunting] += np.sign(self.human_loc[closest] - self.unknown_loc[hunting])
+        self._walk("unknowns")
+        self.distance_cache.invalidate("unknown")
+
+    def updateCombatantEstimate(self):
+        """
+        Skipped, with its noise draw, while no unknown can be in range of a sensor or disabled, see the module
+        docstring
+        :return: bool mask of the unknowns that got a reading
+        """
+        self._quiet = self._isQuiet()
+        if self._quiet:
+            self.quiet_ticks += 1
+            return np.zeros(self.num_unknown, dtype=bool)
+        return super().updateCombatantEstimate()
+
+    def updateLethalActions(self):
+        """
+        Skipped while nothing can be disabled, see updateCombatantEstimate()
+        :return: None
+        """
+        if not self._quiet:
+            super().updateLethalActions()
+
+    def _confident(self):
+        estimates = self.unknown_estimates
+        confident = estimates > self.tau
+        if self.scene != 3:
+            confident &= (estimates - estimates*0.01) > self.tau
+        return confident & self.unknown_alive
+
+    def _interactionMargins(self):
+        """
+        Takes the margins at the current locations, see the module docstring. Stops at the first kind of event that is
+        in range, the sensors first: their distances are the ones the estimate update then takes from the cache
+        :return: True if nothing is in range, the margins and locations are kept then
+        """
+        self._margins = None
+        pairs = (("sensor", np.ones(self.num_sensors, dtype=bool), self.unknown_alive, self.sensor_range),
+                 ("human", self.human_alive, self.unknown_alive & self.unknown_is_combatant, self.lethal_radius),
+                 ("lethal", np.ones(self.num_lethal, dtype=bool), self._confident(), self.lethal_radius))
+        margins = {}
+        for group, rows, columns, radius in pairs:
+            margins[group] = np.inf
+            if rows.any() and columns.any():
+                distances = self.distance_cache.get(group, "unknown")[rows][:, columns]
+                margins[group] = float(np.min(distances)) - radius - _MARGIN
+                if not margins[group] > 0:
+                    return False
+        self._margins = margins
+        self._reference = {group: getattr(self, group + "_loc").astype(float)
+                           for group in ("sensor", "lethal", "human", "unknown")}
+        return True
+
+    def _drift(self, group, rows):
+        if not rows.any():
+            return 0.0
+        diff = getattr(self, group + "_loc")[rows] - self._reference[group][rows]
+        return float(np.sqrt(np.max(np.sum(diff*diff, axis=-1))))
+
+    def _isQuiet(self):
+        """
+        :return: True if nothing can be sensed or disabled at the current locations
+        """
+        if self._margins is None or self._drifted():
+            # the agents moved too far to tell from the drift, the margins are taken again from where they are now
+            return self._interactionMargins()
+        return True
+
+    def _drifted(self):
+        """
+        :return: True if the agents may have come in range since the margins were taken
+        """
+        margins = self._margins
+        unknowns = self._drift("unknown", self.unknown_alive)
+        sensors = self._drift("sensor", np.ones(self.num_sensors, dtype=bool))
+        humans = self._drift("human", self.human_alive)
+        lethals = self._drift("lethal", np.ones(self.num_lethal, dtype=bool))
+        return not (sensors + unknowns < margins["sensor"] and humans + unknowns < margins["human"] and
+                    lethals + unknowns < margins["lethal"])
+
+
+if __name__ == '__main__':
+    # Same distribution of results as Simulator, not the same results: compare the means over many seeds
+    import time
+
+    from .scenario import ScenarioSpec
+
+    trials = 1000
+    for s in (1, 2, 3):
+        for greedy in (True, False):
+            fixed = np.array([Simulator(s, 0.9, greedy=greedy, seed=seed).run()[:3] for seed in range(trials)])
+            event = np.array([EventSimulator(s, 0.9, greedy=greedy, seed=trials + seed).run()[:3]
+                              for seed in range(trials)])
+            z = (fixed.mean(0) - event.mean(0)) / np.sqrt((fixed.var(0) + event.var(0)) / trials + 1e-12)
+            print("Scenario {}, greedy={}: kills per episode {} fixed, {} event-driven, z {}".format(
+                s, greedy, fixed.mean(0).round(3), event.mean(0).round(3), z.round(2)))
+
+    sparse = ScenarioSpec(name="sparse", policy=2, combatant_ratio=0.1, xy_size=1000, end_time=1000, num_sensors=2,
+                          num_lethal=2, num_humans=50, num_unknown=100)
+    for greedy in (True, False):
+        start = time.perf_counter()
+        Simulator(sparse, 0.9, greedy=greedy, seed=0).run()
+        middle = time.perf_counter()
+        sim = EventSimulator(sparse, 0.9, greedy=greedy, seed=0)
+        sim.run()
+        end = time.perf_counter()
+        print("Sparse 1000 map, 1000 ticks, greedy={}: fixed {:.2f} s, event-driven {:.2f} s, {} quiet ticks".format(
+            greedy, middle - start, end - middle, sim.quiet_ticks))
@@ -0,0 +1,500 @@
+"""
+Compiled tick kernel: BatchSimulator with every phase of a tick written as plain loops over the trials and agents,
+compiled with numba when it is installed.
+
+The first-match policies of the scenarios (see policies.py) are loops with a break, which NumPy can only express
+with masks over every agent; here they are written as loops and compiled to machine code. A tick is one call of
+_move(), which moves the robots with the built-in policies (greedy, scenario1/2/3) and walks the humans and
+unknowns of every trial, and one of _act(), which updates the estimates and applies the lethal actions. In between,
+the false negative rates of the sensor model are computed with NumPy, whose exp can differ from the compiled one in
+the last bit. The random draws are still made with the batch's generator, in the same order and shapes as
+BatchSimulator, so a KernelSimulator gives bit-for-bit the trials of a BatchSimulator or Simulator with the same seed.
+
+    KernelSimulator(3, 0.9, 2000, greedy=False, seed=0).run()
+    python -m simulator.runner --scenario 3 --trials 100000 --backend kernel
+
+Without numba the same functions run as Python, which gives the same results, only slowly, so runTrials() runs
+BatchSimulator instead and warns. Policies registered from outside policies.py have no kernel version and raise a
+ValueError.
+"""
+import numpy as np
+
+from .batch import BatchSimulator
+from .estimation import P_FALSE_POSITIVE, falseNegativeRate
+from .policies import (sensorGreedy, sensorScenario12, sensorScenario3, lethalGreedy, lethalScenario12,
+                       lethalScenario3)
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+HAVE_NUMBA = numba is not None
+
+
+def _jit(function):
+    if numba is None:
+        return function
+    # error_model="numpy": divisions by zero give inf/nan like they do in the NumPy version
+    return numba.njit(cache=True, error_model="numpy")(function)
+
+
+# policy kinds of the kernel
+GREEDY, SCENARIO12, SCENARIO3 = 0, 1, 3
+_KINDS = {sensorGreedy: GREEDY, sensorScenario12: SCENARIO12, sensorScenario3: SCENARIO3,
+          lethalGreedy: GREEDY, lethalScenario12: SCENARIO12, lethalScenario3: SCENARIO3}
+
+_DEAD = np.float32(1000.0)
+_CLOSE = np.float32(0.1)
+_ZERO_GREEDY = np.float32(0.5)
+_FAR = np.float32(np.inf)
+
+
+@_jit
+def _distance(a, b):
+    # one entry of distances.pairwiseDistances(), in float32
+    dx = a[0] - b[0]
+    dy = a[1] - b[1]
+    return np.sqrt(dx*dx + dy*dy)
+
+
+@_jit
+def _masked(a, b, alive):
+    # one entry of DistanceCache.getMasked(), alive is False when either agent is dead
+    if not alive:
+        return _DEAD
+    distance = _distance(a, b)
+    return _CLOSE if distance == 0.0 else distance
+
+
+@_jit
+def _argmin(values):
+    # first minimum like np.argmin
+    best = 0
+    for k in range(len(values)):
+        if values[k] < values[best]:
+            best = k
+    return best
+
+
+@_jit
+def _closest(origin, locs, alive):
+    """
+    :return: index of the closest agent of locs by masked distance, first on ties like np.argmin, and that distance
+    """
+    best = 0
+    best_distance = _DEAD
+    for k in range(locs.shape[0]):
+        distance = _masked(origin, locs[k], alive[k])
+        if k == 0 or distance < best_distance:
+            best = k
+            best_distance = distance
+    return best, best_distance
+
+
+@_jit
+def _humanDistances(out, unknown, unknown_alive, human, human_alive):
+    # masked distance from every unknown to its closest warfighter, the row minima the scenario policies use
+    for u in range(unknown.shape[0]):
+        for h in range(human.shape[0]):
+            distance = _masked(unknown[u], human[h], unknown_alive[u] and human_alive[h])
+            if h == 0 or distance < out[u]:
+                out[u] = distance
+
+
+@_jit
+def _step(displacement, j, origin, target, distance, step):
+    # step along (target - origin) / distance, as policies._step()
+    displacement[j, 0] = ((target[0] - origin[j, 0]) / distance)*step
+    displacement[j, 1] = ((target[1] - origin[j, 1]) / distance)*step
+
+
+@_jit
+def _toClosest(displacement, j, origin, locs, alive, step):
+    k, distance = _closest(origin[j], locs, alive)
+    if distance < 1000.0:
+        _step(displacement, j, origin, locs[k], distance, step)
+
+
+@_jit
+def _greedy(displacement, origin, unknown, unknown_alive, estimates, tau, sensing, step, agents):
+    """
+    policies._greedy() for the first agents agents: sensors go for unknowns at or below tau, lethals above
+    """
+    for j in range(agents):
+        best = 0
+        best_distance = _DEAD
+        for u in range(unknown.shape[0]):
+            distance = _DEAD
+            if unknown_alive[u] and ((estimates[u] <= tau) if sensing else (estimates[u] > tau)):
+                distance = _distance(origin[j], unknown[u])
+                if distance == 0.0:
+                    distance = _ZERO_GREEDY
+            if u == 0 or distance < best_distance:
+                best = u
+                best_distance = distance
+        if best_distance < 1000.0:
+            _step(displacement, j, origin, unknown[best], best_distance, step)
+
+
+@_jit
+def _sensorMove(kind, displacement, sensor, human, human_alive, unknown, unknown_alive, estimates, tau, row_min,
+                step):
+    """
+    Sets the (num_sensors, 2) displacement of the sensor policy of kind, see policies.py
+    """
+    displacement[:] = 0.0
+    if kind == GREEDY:
+        _greedy(displacement, sensor, unknown, unknown_alive, estimates, tau, True, step, sensor.shape[0])
+        return
+
+    if kind == SCENARIO12:
+        absolute_min = row_min[_argmin(row_min)]
+        acted_0 = False
+        unk_0 = 0
+        for u in range(len(row_min)):
+            if row_min[u] == absolute_min and row_min[u] < 6.0:
+                acted_0 = True
+                unk_0 = u
+                break
+        acted_n = False
+        unk_n = 0
+        for u in range(len(estimates)):
+            if estimates[u] > tau and unknown_alive[u]:
+                acted_n = True
+                unk_n = u
+                break
+        for j in range(sensor.shape[0]):
+            if j == 0 and acted_0:
+                _step(displacement, j, sensor, unknown[unk_0], row_min[unk_0], step)
+            elif j > 0 and acted_n:
+                _step(displacement, j, sensor, unknown[unk_n], _masked(sensor[j], unknown[unk_n], unknown_alive[unk_n]),
+                      step)
+            else:
+                _toClosest(displacement, j, sensor, human, human_alive, step)
+        return
+
+    for j in range(1, sensor.shape[0]):
+        acted = False
+        unk_id = 0
+        for u in range(len(estimates)):
+            if row_min[u] < 10.0 or (estimates[u] < tau and unknown_alive[u] and
+                                     _masked(sensor[j], unknown[u], True) > 10.0):
+                acted = True
+                unk_id = u
+                break
+        if acted and row_min[unk_id] < 10.0:
+            _step(displacement, j, sensor, unknown[unk_id], row_min[unk_id], step)
+        elif acted:
+            _step(displacement, j, sensor, unknown[unk_id], _masked(sensor[j], unknown[unk_id], unknown_alive[unk_id]),
+                  step)
+        else:
+            _toClosest(displacement, j, sensor, human, human_alive, step)
+    # sensor 0 moves greedily
+    _greedy(displacement, sensor, unknown, unknown_alive, estimates, tau, True, step, 1)
+
+
+@_jit
+def _lethalMove(kind, displacement, lethal, sensor, sensors_alive, human, human_alive, unknown, unknown_alive,
+                estimates, tau, row_min, step):
+    """
+    Sets the (num_lethal, 2) displacement of the lethal policy of kind, see policies.py
+    """
+    displacement[:] = 0.0
+    if kind == GREEDY:
+        _greedy(displacement, lethal, unknown, unknown_alive, estimates, tau, False, step, lethal.shape[0])
+        return
+
+    acted = False
+    unk_id = 0
+    for u in range(len(estimates)):
+        if (kind == SCENARIO3 and row_min[u] < 10.0) or (estimates[u] > tau and unknown_alive[u]):
+            acted = True
+            unk_id = u
+            break
+    chase = kind == SCENARIO3 and acted and row_min[unk_id] < 10.0
+    for j in range(lethal.shape[0]):
+        if chase:
+            _step(displacement, j, lethal, unknown[unk_id], row_min[unk_id], step)
+        elif acted:
+            _step(displacement, j, lethal, unknown[unk_id], _masked(lethal[j], unknown[unk_id], unknown_alive[unk_id]),
+                  step)
+        elif kind == SCENARIO12:
+            # Follow closest warfighter
+            _toClosest(displacement, j, lethal, human, human_alive, step)
+        else:
+            # idle lethal 0 goes to its closest unknown, lethal 1 to its closest warfighter, the others to their
+            # closest sensor, and so do lethal 0 and 1 when there is no unknown or warfighter left
+            moved = False
+            if j == 0:
+                k, distance = _closest(lethal[j], unknown, unknown_alive)
+                if distance < 1000.0:
+                    _step(displacement, j, lethal, unknown[k], distance, step)
+                    moved = True
+            elif j == 1:
+                k, distance = _closest(lethal[j], human, human_alive)
+                if distance < 1000.0:
+                    _step(displacement, j, lethal, human[k], distance, step)
+                    moved = True
+            if not moved:
+                k, distance = _closest(lethal[j], sensor, sensors_alive)
+                _step(displacement, j, lethal, sensor[k], distance, step)
+
+
+@_jit
+def _clamp(locs, xy_size):
+    # WorldView.apply(): the robots stay on the map
+    for k in range(locs.shape[0]):
+        for axis in range(2):
+            locs[k, axis] = min(max(locs[k, axis], 0.0), xy_size)
+
+
+@_jit
+def _walk(locs, goals, walking, draws):
+    # BatchSimulator.walkToGoals() for one trial
+    for k in range(locs.shape[0]):
+        if not walking[k]:
+            continue
+        if _distance(locs[k], goals[k]) < 4.0:
+            goals[k, 0] = draws[k, 0]
+            goals[k, 1] = draws[k, 1]
+        locs[k, 0] += np.sign(goals[k, 0] - locs[k, 0])
+        locs[k, 1] += np.sign(goals[k, 1] - locs[k, 1])
+
+
+@_jit
+def _moveUnknowns(unknown, unknown_goal, unknown_alive, is_combatant, human, human_alive, draws):
+    # BatchSimulator.updateUnknownLocations() for one trial
+    any_human = False
+    for h in range(len(human_alive)):
+        any_human = any_human or human_alive[h]
+    for u in range(unknown.shape[0]):
+        walking = unknown_alive[u] and not is_combatant[u]
+        if walking and _distance(unknown[u], unknown_goal[u]) < 4.0:
+            unknown_goal[u, 0] = draws[u, 0]
+            unknown_goal[u, 1] = draws[u, 1]
+        if walking:
+            target = unknown_goal[u]
+        elif unknown_alive[u] and any_human:
+            # combatants step toward their closest living warfighter, the lowest index on ties
+            closest = 0
+            closest_distance = _FAR
+            for h in range(human.shape[0]):
+                distance = _distance(unknown[u], human[h]) if human_alive[h] else _FAR
+                if h == 0 or distance < closest_distance:
+                    closest = h
+                    closest_distance = distance
+            target = human[closest]
+        else:
+            continue
+        unknown[u, 0] += np.sign(target[0] - unknown[u, 0])
+        unknown[u, 1] += np.sign(target[1] - unknown[u, 1])
+
+
+@_jit
+def _closestSensors(closest, sensor, unknown):
+    # distance from every unknown to its closest sensor
+    for u in range(unknown.shape[0]):
+        for s in range(sensor.shape[0]):
+            distance = _distance(sensor[s], unknown[u])
+            if s == 0 or distance < closest[u]:
+                closest[u] = distance
+
+
+@_jit
+def _updateEstimates(estimates, closest, p_fn, unknown_alive, is_combatant, noise, tau, sensor_range, p_fp):
+    # estimation.updateEstimates() for one trial, with the false negative rates computed by NumPy
+    for u in range(len(estimates)):
+        if not (unknown_alive[u] and closest[u] < sensor_range):
+            continue
+        if is_combatant[u]:
+            measurement = noise[u] > p_fn[u]
+        else:
+            measurement = not (noise[u] > p_fp)
+        p_com = estimates[u]
+        p_civ = 1 - p_com
+        lik_com = 1 - p_fn[u] if measurement else p_fn[u]
+        lik_civ = p_fp if measurement else 1 - p_fp
+        joint_com = lik_com*p_com
+        joint_civ = lik_civ*p_civ
+        believed = joint_com if p_com > tau else joint_civ
+        estimates[u] = believed / (joint_civ + joint_com)
+
+
+@_jit
+def _lethalActions(human, human_alive, unknown, unknown_alive, is_combatant, lethal, estimates, tau, lethal_radius,
+                   scene):
+    # BatchSimulator.updateLethalActions() for one trial, armed is decided before any warfighter is disabled
+    for h in range(human.shape[0]):
+        for u in range(unknown.shape[0]):
+            if is_combatant[u] and unknown_alive[u] and _distance(human[h], unknown[u]) < lethal_radius:
+                human_alive[h] = False
+    for u in range(unknown.shape[0]):
+        confident = estimates[u] > tau
+        if scene != 3:
+            confident = confident and (estimates[u] - estimates[u]*0.01) > tau
+        if not confident:
+            continue
+        for k in range(lethal.shape[0]):
+            if _distance(lethal[k], unknown[u]) <= lethal_radius:
+                unknown_alive[u] = False
+
+
+@_jit
+def _decide(t, unknown_alive, is_combatant, human_alive, tau, scene, done, termination_tick):
+    """
+    estimation.outcomeDecided() for every trial that is still running, the decided ones are marked done
+    :return: number of trials still running
+    """
+    running = 0
+    reachable_below = 1.0 if scene == 3 else 0.99
+    for i in range(len(done)):
+        if done[i]:
+            continue
+        combatant = False
+        unknown = False
+        for u in range(unknown_alive.shape[1]):
+            unknown = unknown or unknown_alive[i, u]
+            combatant = combatant or (unknown_alive[i, u] and is_combatant[i, u])
+        human = False
+        for h in range(human_alive.shape[1]):
+            human = human or human_alive[i, h]
+        if not ((combatant and human) or (unknown and tau[i] < reachable_below)):
+            done[i] = True
+            termination_tick[i] = t
+        else:
+            running += 1
+    return running
+
+
+@_jit
+def _move(sensor_kind, lethal_kind, sensor, lethal, human, human_alive, human_goal, unknown, unknown_alive,
+          unknown_goal, is_combatant, estimates, tau, sensor_step, lethal_step, xy_size, human_draws, unknown_draws,
+          done, closest):
+    """
+    The movement phases of a tick, for every trial that is not done
+    :param closest: (n_trials, num_unknown) array that gets the distance from every unknown to its closest sensor
+    """
+    sensor_displacement = np.zeros_like(sensor[0])
+    lethal_displacement = np.zeros_like(lethal[0])
+    sensors_alive = np.ones(sensor.shape[1], dtype=np.bool_)
+    row_min = np.zeros(unknown.shape[1], dtype=np.float32)
+    for i in range(sensor.shape[0]):
+        if done[i]:
+            continue
+        if sensor_kind != GREEDY or lethal_kind != GREEDY:
+            # only the sensors move before the lethals, so both see the same unknowns and warfighters
+            _humanDistances(row_min, unknown[i], unknown_alive[i], human[i], human_alive[i])
+        _sensorMove(sensor_kind, sensor_displacement, sensor[i], human[i], human_alive[i], unknown[i],
+                    unknown_alive[i], estimates[i], tau[i], row_min, sensor_step)
+        sensor[i] += sensor_displacement
+        _clamp(sensor[i], xy_size)
+        _lethalMove(lethal_kind, lethal_displacement, lethal[i], sensor[i], sensors_alive, human[i], human_alive[i],
+                    unknown[i], unknown_alive[i], estimates[i], tau[i], row_min, lethal_step)
+        lethal[i] += lethal_displacement
+        _clamp(lethal[i], xy_size)
+        _walk(human[i], human_goal[i], human_alive[i], human_draws[i])
+        _moveUnknowns(unknown[i], unknown_goal[i], unknown_alive[i], is_combatant[i], human[i], human_alive[i],
+                      unknown_draws[i])
+        _closestSensors(closest[i], sensor[i], unknown[i])
+
+
+@_jit
+def _act(scene, lethal, human, human_alive, unknown, unknown_alive, is_combatant, estimates, tau, sensor_range,
+         lethal_radius, p_fp, closest, p_fn, noise, done):
+    """
+    The estimate update and lethal actions of a tick, for every trial that is not done
+    """
+    for i in range(lethal.shape[0]):
+        if done[i]:
+            continue
+        _updateEstimates(estimates[i], closest[i], p_fn[i], unknown_alive[i], is_combatant[i], noise[i], tau[i],
+                         sensor_range, p_fp)
+        _lethalActions(human[i], human_alive[i], unknown[i], unknown_alive[i], is_combatant[i], lethal[i],
+                       estimates[i], tau[i], lethal_radius, scene)
+
+
+class KernelSimulator(BatchSimulator):
+    def __init__(self, scenario, tau, n_trials, greedy=True, seed=None, rng=None, trajectory=None,
+                 sensor_policy=None, lethal_policy=None, early_stop=True):
+        """
+        BatchSimulator whose ticks run in the compiled kernel, see BatchSimulator for the parameters
+        :raises: ValueError for policies that have no kernel version
+        """
+        super().__init__(scenario, tau, n_trials, greedy=greedy, seed=seed, rng=rng, trajectory=trajectory,
+                         sensor_policy=sensor_policy, lethal_policy=lethal_policy, early_stop=early_stop)
+        for role, policy in (("sensor", self.sensor_policy), ("lethal", self.lethal_policy)):
+            if policy not in _KINDS:
+                raise ValueError("the {} policy {} has no kernel version, use BatchSimulator".format(
+                    role, getattr(policy, "__name__", policy)))
+
+    def run(self):
+        """
+        Executes every trial, see BatchSimulator.run(). Finished trials are skipped by the kernel instead of taken
+        out of the arrays
+        :return: (n_trials, 6) int array
+        """
+        if self.trajectory is not None:
+            self.trajectory.start(self)
+        n = self.n_trials
+        self.termination_tick = np.full(n, self.endTime)
+        done = np.zeros(n, dtype=bool)
+        tau = np.ascontiguousarray(np.broadcast_to(np.ravel(np.asarray(self.tau, dtype=float)), n))
+        sensor_kind, lethal_kind = _KINDS[self.sensor_policy], _KINDS[self.lethal_policy]
+        sensor_step = np.float32(self.sensor_max_step_size)
+        lethal_step = np.float32(self.lethal_max_step_size)
+        xy_size = np.float32(self.xy_size)
+        lethal_radius = np.float32(self.lethal_radius)  # compared with float32 distances, as NumPy does
+        closest = np.zeros((n, self.num_unknown), dtype=np.float32)
+        for t in range(self.endTime):
+            if self.early_stop and not _decide(t, self.unknown_alive, self.unknown_is_combatant, self.human_alive,
+                                               tau, self.scene, done, self.termination_tick):
+                break
+            # the draws of BatchSimulator, in its order: human goals, unknown goals, sensor noise
+            human_draws = self.drawLocations((n, self.num_humans, 2))
+            unknown_draws = self.drawLocations((n, self.num_unknown, 2))
+            noise = self.drawUniform((n, self.num_unknown))
+            _move(sensor_kind, lethal_kind, self.sensor_loc, self.lethal_loc, self.human_loc, self.human_alive,
+                  self.human_goal, self.unknown_loc, self.unknown_alive, self.unknown_goal,
+                  self.unknown_is_combatant, self.unknown_estimates, tau, sensor_step, lethal_step, xy_size,
+                  human_draws, unknown_draws, done, closest)
+            # np.exp and the exp numba compiles to can differ in the last bit, the sensor model stays in NumPy
+            closest_64 = closest.astype(float)
+            closest_64[closest_64 <= 0.0] = 0.01
+            p_fn = falseNegativeRate(closest_64, self.sensor_range)
+            _act(self.scene, self.lethal_loc, self.human_loc, self.human_alive, self.unknown_loc,
+                 self.unknown_alive, self.unknown_is_combatant, self.unknown_estimates, tau,
+                 float(self.sensor_range), lethal_radius, P_FALSE_POSITIVE, closest_64, p_fn, noise, done)
+            if self.trajectory is not None:
+                self.trajectory.record(self, t)
+        self.distance_cache.clear()
+        if self.trajectory is not None:
+            self.trajectory.close()
+        return self.results()
+
+
+if __name__ == '__main__':
+    # The kernel has to give exactly the results of Simulator with the same seed, for every scenario and policy
+    import time
+
+    from .simulator import Simulator
+
+    print("numba {}".format(numba.__version__ if HAVE_NUMBA else "not installed, running the kernel as Python"))
+    trials = 200
+    for s in (1, 2, 3):
+        for greedy in (True, False):
+            for tau in (0.5, 0.9):
+                single = np.array([Simulator(s, tau, greedy=greedy, seed=seed).run() for seed in range(trials)])
+                matches = sum(np.array_equal(KernelSimulator(s, tau, 1, greedy=greedy, seed=seed).run()[0],
+                                             single[seed]) for seed in range(trials))
+                print("Scenario {}, greedy={}, tau {}: {}/{} single trial kernels match Simulator".format(
+                    s, greedy, tau, matches, trials))
+    for s in (1, 2, 3):
+        for greedy in (True, False):
+            start = time.perf_counter()
+            batch = BatchSimulator(s, 0.9, 2000, greedy=greedy, seed=0).run()
+            middle = time.perf_counter()
+            kernel = KernelSimulator(s, 0.9, 2000, greedy=greedy, seed=0).run()
+            end = time.perf_counter()
+            print("Scenario {}, greedy={}, 2000 trials: batch {:.3f} s, kernel {:.3f} s, identical: {}".format(
+                s, greedy, middle - start, end - middle, np.array_equal(batch, kernel)))
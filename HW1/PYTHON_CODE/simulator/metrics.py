@@ -0,0 +1,259 @@
+"""
+Instrumentation of the tick loop: wall time per phase and counters of what the phases did, collected by the
+simulation itself so no profiler has to be attached to the worker processes of a sweep.
+
+Pass a SimulationMetrics as metrics= to Simulator or BatchSimulator (or to runTrials(), which collects it in the
+workers and adds it up). Without one, run() calls the same phases untimed, see runPhase():
+
+    metrics = SimulationMetrics(post_tick=lambda sim, t: print(t, sim.unknown_estimates.max()))
+    Simulator(3, 0.9, metrics=metrics).run()
+    metrics.phase_seconds["estimate_update"] / metrics.counters["ticks"]
+    metrics.write("metrics.prom", scenario="3", tau="0.9")     # Prometheus text, or JSON for a .json file
+
+Counters, summed over the trials of a batch:
+    ticks                   ticks of the tick loop
+    trial_ticks             ticks times the trials that were still running in them
+    measurements            sensor readings taken, one per alive unknown with a sensor in range
+    posterior_updates       estimates the readings changed
+    warfighters_killed, combatants_killed, civilians_killed
+                            kill events of the lethal actions
+    distance_evaluations    distance matrices computed by the DistanceCache. The queries of Simulator with
+                            spatial_index do not go through it and are not counted
+
+Hooks are called with the simulation and the tick number, pre_tick before the first phase and post_tick after the
+last one (after the trajectory record and the frame). They stay with the object they were given to and are not sent
+to worker processes.
+"""
+import json
+import os
+import time
+
+import numpy as np
+
+# (name in the metrics, Simulator method) in tick order
+PHASES = (("sensor_move", "updateSensorLocations"),
+          ("lethal_move", "updateLethalLocations"),
+          ("human_move", "updateHumanLocations"),
+          ("unknown_move", "updateUnknownLocations"),
+          ("estimate_update", "updateCombatantEstimate"),
+          ("lethal_actions", "updateLethalActions"),
+          ("render", "render_world"))
+
+COUNTERS = ("ticks", "trial_ticks", "measurements", "posterior_updates", "warfighters_killed", "combatants_killed",
+            "civilians_killed", "distance_evaluations")
+
+_HELP = {"ticks": "Ticks of the tick loop",
+         "trial_ticks": "Ticks times the trials still running in them",
+         "measurements": "Sensor readings taken",
+         "posterior_updates": "Combatant estimates changed by a reading",
+         "warfighters_killed": "Warfighters disabled by combatants",
+         "combatants_killed": "Combatants disabled by lethal robots",
+         "civilians_killed": "Civilians disabled by lethal robots",
+         "distance_evaluations": "Distance matrices computed"}
+
+
+class SimulationMetrics:
+    def __init__(self, pre_tick=None, post_tick=None, keep_ticks=False):
+        """
+        :param pre_tick: function(sim, t) or list of them, called before every tick
+        :param post_tick: function(sim, t) or list of them, called after every tick
+        :param keep_ticks: also keep the seconds of every phase of every tick in tick_seconds, not only the totals
+        """
+        self.pre_tick = _hookList(pre_tick)
+        self.post_tick = _hookList(post_tick)
+        self.phase_seconds = {name: 0.0 for name, _ in PHASES}
+        self.phase_max_seconds = {name: 0.0 for name, _ in PHASES}
+        self.counters = {name: 0 for name in COUNTERS}
+        self.tick_seconds = [] if keep_ticks else None  # one (len(PHASES),) array per tick
+        self._tick = None
+        self._evaluations = 0  # of the distance cache when the tick started
+
+    def __getstate__(self):
+        # hooks are often lambdas or closures, only the numbers go to and from worker processes
+        state = self.__dict__.copy()
+        state["pre_tick"], state["post_tick"] = [], []
+        return state
+
+    def addHook(self, when, function):
+        """
+        :param when: "pre_tick" or "post_tick"
+        :param function: function(sim, t)
+        :return: None
+        """
+        if when not in ("pre_tick", "post_tick"):
+            raise ValueError("hooks are pre_tick or post_tick")
+        getattr(self, when).append(function)
+
+    def timed(self, phase, function, *args):
+        """
+        Calls function and adds its wall time to a phase
+        :param phase: name of the phase, see PHASES
+        :return: what function returned
+        """
+        start = time.perf_counter()
+        result = function(*args)
+        seconds = time.perf_counter() - start
+        self.phase_seconds[phase] += seconds
+        if seconds > self.phase_max_seconds[phase]:
+            self.phase_max_seconds[phase] = seconds
+        if self._tick is not None:
+            self._tick[_PHASE_INDEX[phase]] += seconds
+        return result
+
+    def startTick(self, sim, t):
+        """
+        Starts a tick of a Simulator or BatchSimulator, run() calls this before the first phase when metrics are on,
+        then phase() for every phase and endTick() once the tick is recorded. Calls the pre_tick hooks
+        :param sim: Simulator or BatchSimulator
+        :param t: the tick
+        :return: None
+        """
+        for hook in self.pre_tick:
+            hook(sim, t)
+        if self.tick_seconds is not None:
+            self._tick = np.zeros(len(PHASES))
+        self._evaluations = sim.distance_cache.evaluations
+
+    def phase(self, sim, name, function, *args):
+        """
+        Runs one phase of a tick, timed, and counts what the estimate update and the lethal actions did
+        :param sim: Simulator or BatchSimulator
+        :param name: name of the phase, see PHASES
+        :param function: the phase, called with args
+        :return: what function returned
+        """
+        counters = self.counters
+        if name == "estimate_update":
+            estimates = sim.unknown_estimates.copy()
+            measured = self.timed(name, function, *args)
+            counters["measurements"] += int(np.count_nonzero(measured))
+            counters["posterior_updates"] += int(np.count_nonzero(measured & (sim.unknown_estimates != estimates)))
+            return measured
+        if name == "lethal_actions":
+            human_alive = sim.human_alive.copy()
+            unknown_alive = sim.unknown_alive.copy()
+            result = self.timed(name, function, *args)
+            killed = unknown_alive & ~sim.unknown_alive
+            counters["warfighters_killed"] += int(np.count_nonzero(human_alive & ~sim.human_alive))
+            counters["combatants_killed"] += int(np.count_nonzero(killed & sim.unknown_is_combatant))
+            counters["civilians_killed"] += int(np.count_nonzero(killed & ~sim.unknown_is_combatant))
+            counters["distance_evaluations"] += sim.distance_cache.evaluations - self._evaluations
+            return result
+        return self.timed(name, function, *args)
+
+    def endTick(self, sim, t):
+        """
+        Finishes a tick started with startTick(), after its trajectory record and frame, and calls the post_tick hooks
+        :return: None
+        """
+        counters = self.counters
+        counters["ticks"] += 1
+        counters["trial_ticks"] += len(sim.unknown_alive) if sim.unknown_alive.ndim > 1 else 1
+        if self._tick is not None:
+            self.tick_seconds.append(self._tick)
+            self._tick = None
+        for hook in self.post_tick:
+            hook(sim, t)
+
+    def merge(self, other):
+        """
+        Adds the numbers of another SimulationMetrics to these, e.g. of another chunk of trials
+        :param other: SimulationMetrics
+        :return: None
+        """
+        for name, _ in PHASES:
+            self.phase_seconds[name] += other.phase_seconds[name]
+            self.phase_max_seconds[name] = max(self.phase_max_seconds[name], other.phase_max_seconds[name])
+        for name in COUNTERS:
+            self.counters[name] += other.counters[name]
+        if self.tick_seconds is not None and other.tick_seconds is not None:
+            self.tick_seconds.extend(other.tick_seconds)
+
+    def perTick(self):
+        """
+        :return: dict of phase name -> mean seconds per tick
+        """
+        ticks = max(self.counters["ticks"], 1)
+        return {name: seconds / ticks for name, seconds in self.phase_seconds.items()}
+
+    def toDict(self):
+        """
+        :return: JSON-ready dict of the totals
+        """
+        return {"phase_seconds": dict(self.phase_seconds), "phase_max_seconds": dict(self.phase_max_seconds),
+                "phase_seconds_per_tick": self.perTick(), "counters": dict(self.counters)}
+
+    def write(self, filename, **labels):
+        """
+        Writes the metrics to a file, see writeMetrics()
+        :param labels: labels of the metrics, e.g. scenario="3"
+        :return: None
+        """
+        writeMetrics(filename, [(labels, self)])
+
+
+_PHASE_INDEX = {name: i for i, (name, _) in enumerate(PHASES)}
+
+
+def runPhase(sim, name, function, *args):
+    """
+    SimulationMetrics.phase() without the timing and counting, what run() calls the phases with when metrics are off
+    :return: what function returned
+    """
+    return function(*args)
+
+
+def _hookList(hooks):
+    if hooks is None:
+        return []
+    if callable(hooks):
+        return [hooks]
+    return list(hooks)
+
+
+def _labelText(labels):
+    return ",".join('{}="{}"'.format(key, str(value).replace("\\", "\\\\").replace('"', '\\"'))
+                    for key, value in labels.items())
+
+
+def prometheusText(entries):
+    """
+    :param entries: (labels dict, SimulationMetrics) pairs, e.g. one per configuration of a sweep
+    :return: str in the Prometheus text exposition format
+    """
+    lines = []
+
+    def family(name, kind, help_text, samples):
+        lines.append("# HELP simulator_{} {}".format(name, help_text))
+        lines.append("# TYPE simulator_{} {}".format(name, kind))
+        for labels, value in samples:
+            lines.append("simulator_{}{{{}}} {}".format(name, _labelText(labels), repr(float(value))))
+
+    family("phase_seconds_total", "counter", "Wall time spent in each phase of the tick loop",
+           [(dict(labels, phase=name), metrics.phase_seconds[name])
+            for labels, metrics in entries for name, _ in PHASES])
+    family("phase_max_seconds", "gauge", "Longest single call of each phase of the tick loop",
+           [(dict(labels, phase=name), metrics.phase_max_seconds[name])
+            for labels, metrics in entries for name, _ in PHASES])
+    for counter in COUNTERS:
+        family(counter + "_total", "counter", _HELP[counter],
+               [(labels, metrics.counters[counter]) for labels, metrics in entries])
+    return "\n".join(lines) + "\n"
+
+
+def writeMetrics(filename, entries):
+    """
+    Writes metrics as JSON for a .json file name and in the Prometheus text format otherwise, e.g. for the textfile
+    collector of a node exporter. The file is replaced in one step, so a collector never reads half of it
+    :param filename: file to write
+    :param entries: (labels dict, SimulationMetrics) pairs
+    :return: None
+    """
+    if filename.endswith(".json"):
+        text = json.dumps([dict(labels=labels, **metrics.toDict()) for labels, metrics in entries], indent=2)
+    else:
+        text = prometheusText(entries)
+    partial = filename + ".tmp"
+    with open(partial, "w") as f:
+        f.write(text)
+    os.replace(partial, filename)
@@ -0,0 +1,360 @@
+"""
+Movement policies of the sensor and lethal robots.
+
+A policy is a function policy(view) -> displacement. It gets a WorldView of a Simulator or BatchSimulator and
+returns the step of every agent of its role at once, as a (n_trials, num_agents, 2) array (a Simulator is viewed as
+a batch of one trial). The simulators add the displacement to the locations, so agents that stay put get a zero row.
+All agents of a role decide from the state at the start of their phase, which is what the original per-agent code
+did as well: every agent only ever looked at its own distances and at groups that do not move in that phase.
+
+Policies are registered by role and name:
+
+    @registerPolicy("sensor", "spread_out")
+    def spreadOut(view):
+        ...
+
+and picked by name with Simulator(..., sensor_policy="spread_out"). The reference policies are "greedy" and
+"scenario1" to "scenario3" for both roles, vectorized versions of the policies of the original assignment.
+"""
+import numpy as np
+
+from .distances import DEAD_DISTANCE
+
+ROLES = ("sensor", "lethal")
+
+_POLICIES = {role: {} for role in ROLES}
+
+
+def registerPolicy(role, name):
+    """
+    Decorator registering a policy function under a name
+    :param role: "sensor" or "lethal"
+    :param name: name the policy is picked by
+    :return: decorator returning the function unchanged
+    """
+    if role not in ROLES:
+        raise ValueError("role must be one of {}".format(", ".join(ROLES)))
+
+    def register(policy):
+        _POLICIES[role][name] = policy
+        return policy
+    return register
+
+
+def policyNames(role):
+    """
+    :param role: "sensor" or "lethal"
+    :return: sorted names of the registered policies of a role
+    """
+    return sorted(_POLICIES[role])
+
+
+def getPolicy(role, policy):
+    """
+    :param role: "sensor" or "lethal"
+    :param policy: registered name, or a policy function which is returned as is
+    :return: policy function
+    :raises: ValueError for unknown names
+    """
+    if callable(policy):
+        return policy
+    try:
+        return _POLICIES[role][policy]
+    except KeyError:
+        raise ValueError("unknown {} policy {!r}, registered: {}".format(role, policy, ", ".join(policyNames(role))))
+
+
+def defaultPolicy(greedy, scene):
+    """
+    :return: name of the policy the greedy flag and scenario number of the simulators stand for
+    """
+    return "greedy" if greedy else "scenario{}".format(scene)
+
+
+class WorldView:
+    def __init__(self, world):
+        """
+        What a policy gets to see: the state of a Simulator or BatchSimulator with a leading trial axis, and its
+        shared distance matrices
+        :param world: Simulator or BatchSimulator
+        """
+        self.batched = world.sensor_loc.ndim == 3
+        self._world = world
+        self.tau = world.tau
+        self.xy_size = world.xy_size
+        self.sensor_max_step_size = world.sensor_max_step_size
+        self.lethal_max_step_size = world.lethal_max_step_size
+        self.sensor_range = world.sensor_range
+        self.lethal_radius = world.lethal_radius
+        for name in ("sensor_loc", "lethal_loc", "human_loc", "human_alive", "unknown_loc", "unknown_alive",
+                     "unknown_estimates"):
+            setattr(self, name, self._expand(getattr(world, name)))
+
+    def _expand(self, array):
+        return array if self.batched else array[None]
+
+    def distances(self, a, b):
+        """
+        :return: (n_trials, num_a, num_b) plain distances between two groups, see DistanceCache.get(). Do not modify
+        """
+        return self._expand(self._world.distance_cache.get(a, b))
+
+    def masked(self, a, b):
+        """
+        :return: (n_trials, num_a, num_b) distances with dead agents at 1000.0 and zeros at 0.1, see
+                 DistanceCache.getMasked(). Do not modify
+        """
+        return self._expand(self._world.distance_cache.getMasked(a, b))
+
+    def apply(self, locs, displacement):
+        """
+        Adds a displacement returned by a policy to the locations of the world, the robots stay on the map
+        :param locs: the (unexpanded) location array of the world to update in place
+        :param displacement: (n_trials, n, 2) array
+        :return: None
+        """
+        locs += displacement if self.batched else displacement[0]
+        np.clip(locs, 0, self.xy_size, out=locs)
+
+
+def _firstMatch(cond):
+    """
+    Vectorized version of the 'for unk_id in range(...): if cond: ...; break' pattern of the original policies
+    :param cond: (..., n) bool
+    :return: (...) bool whether any entry matched, (...) index of the first match
+    """
+    return cond.any(axis=-1), np.argmax(cond, axis=-1)
+
+
+def _gather(locs, ids):
+    """
+    :param locs: (n_trials, n, 2) locations
+    :param ids: (n_trials, k) indices into n, or (n_trials, 1) for the same agent for all k
+    :return: (n_trials, k, 2) locations of those agents
+    """
+    return locs[np.arange(len(locs))[:, None], ids]
+
+
+def _pick(values, ids):
+    """
+    :param values: (n_trials, k, n) array
+    :param ids: (n_trials, k) indices into n, or (n_trials, 1) for the same index in every row
+    :return: (n_trials, k) values at those indices
+    """
+    return values[np.arange(values.shape[0])[:, None], np.arange(values.shape[1]), ids]
+
+
+def _step(displacement, origin, target, distance, step, mask):
+    """
+    Sets the displacement of the agents selected by mask to step along (target - origin) / distance
+    :param displacement: (n_trials, k, 2) array, replaced where mask is set
+    :param origin: (n_trials, k, 2) locations of the agents
+    :param target: (n_trials, k, 2) locations they step toward
+    :param distance: (n_trials, k) distances the step is normalized by
+    :param step: maximum step size
+    :param mask: (n_trials, k) bool
+    :return: the updated displacement
+    """
+    if not mask.any():
+        return displacement
+    return np.where(mask[..., None], ((target - origin) / distance[..., None])*step, displacement)
+
+
+def _toClosest(displacement, origin, locs, distances, step, mask):
+    """
+    Step toward the closest agent of another group, if it is closer than 1000.0 (alive)
+    :param locs: (n_trials, n, 2) locations of the other group
+    :param distances: (n_trials, k, n) masked distances to the other group
+    :return: the updated displacement
+    """
+    if not mask.any():
+        return displacement
+    closest = np.argmin(distances, axis=2)
+    closest_dist = _pick(distances, closest)
+    return _step(displacement, origin, _gather(locs, closest), closest_dist, step, mask & (closest_dist < 1000.00))
+
+
+def _greedy(view, role, targets, step):
+    """
+    Every agent moves toward its closest alive unknown selected by targets
+    :param targets: (n_trials, num_unknown) bool
+    :return: (n_trials, num_agents, 2) displacement
+    """
+    origin = getattr(view, role + "_loc")
+    distances = view.distances(role, "unknown")
+    distances = np.where(distances == 0.0, np.float32(0.5), distances)
+    distances = np.where(targets[:, None, :], distances, np.float32(DEAD_DISTANCE))
+
+    targ_id = np.argmin(distances, axis=2)
+    targ_dist = _pick(distances, targ_id)
+    return _step(np.zeros_like(origin), origin, _gather(view.unknown_loc, targ_id), targ_dist, step,
+                 targ_dist < 1000.0)
+
+
+@registerPolicy("sensor", "greedy")
+def sensorGreedy(view):
+    """
+    Sensor platforms move greedily towards the closest target with uncertainty below threshold
+    """
+    return _greedy(view, "sensor", view.unknown_alive & (view.unknown_estimates <= view.tau),
+                   view.sensor_max_step_size)
+
+
+@registerPolicy("lethal", "greedy")
+def lethalGreedy(view):
+    """
+    Lethal platforms move greedily towards the closest target with uncertainty above threshold
+    """
+    return _greedy(view, "lethal", view.unknown_alive & (view.unknown_estimates > view.tau),
+                   view.lethal_max_step_size)
+
+
+@registerPolicy("sensor", "scenario1")
+@registerPolicy("sensor", "scenario2")
+def sensorScenario12(view):
+    """
+    Sensor 0 moves towards the unknown which is closest to a warfighter, if that is within 6. The other sensors move
+    towards the first unknown suspected of being a combatant. Sensors that did neither follow their closest
+    warfighter.
+    """
+    origin = view.sensor_loc
+    step = view.sensor_max_step_size
+    unk_distances = view.masked("sensor", "unknown")
+    unk_wf_distances = view.masked("unknown", "human")
+    trials = np.arange(len(origin))
+
+    # sensor 0: unknown which is closest to a warfighter. As in the original, the step is normalized by that
+    # unknown's distance to the warfighter
+    absolute_min = np.min(unk_wf_distances, axis=(1, 2))
+    row_min = np.min(unk_wf_distances, axis=2)
+    acted_0, unk_0 = _firstMatch((row_min == absolute_min[:, None]) & (row_min < 6.0))
+
+    # other sensors: unknown currently suspected of being a combatant
+    acted_n, unk_n = _firstMatch((view.unknown_estimates > view.tau) & view.unknown_alive)
+
+    first = np.arange(origin.shape[1]) == 0
+    acted = np.where(first, acted_0[:, None], acted_n[:, None])
+    unk_id = np.where(first, unk_0[:, None], unk_n[:, None])
+    distance = np.where(first, row_min[trials, unk_0][:, None], _pick(unk_distances, unk_id))
+
+    displacement = _step(np.zeros_like(origin), origin, _gather(view.unknown_loc, unk_id), distance, step, acted)
+    # Move towards closest warfighter
+    return _toClosest(displacement, origin, view.human_loc, view.masked("sensor", "human"), step, ~acted)
+
+
+@registerPolicy("sensor", "scenario3")
+def sensorScenario3(view):
+    """
+    Sensor 0 moves greedily. The other sensors move towards the first unknown that is within 10 of a warfighter, or
+    else below threshold and out of their range, and otherwise follow their closest warfighter.
+    """
+    origin = view.sensor_loc
+    step = view.sensor_max_step_size
+    unk_distances = view.masked("sensor", "unknown")
+    unk_wf_distances = view.masked("unknown", "human")
+
+    row_min = np.min(unk_wf_distances, axis=2)
+    near_wf = row_min < 10.0
+    unchecked = ((view.unknown_estimates < view.tau) & view.unknown_alive)[:, None, :] & (unk_distances > 10.0)
+    acted, unk_id = _firstMatch(near_wf[:, None, :] | unchecked)
+    trials = np.arange(len(origin))[:, None]
+    chase = acted & near_wf[trials, unk_id]
+    target = _gather(view.unknown_loc, unk_id)
+
+    displacement = np.zeros_like(origin)
+    # Move towards unknown if it is too close to a warfighter
+    displacement = _step(displacement, origin, target, row_min[trials, unk_id], step, chase)
+    # Otherwise towards an unknown below threshold that is out of range
+    displacement = _step(displacement, origin, target, _pick(unk_distances, unk_id), step, acted & ~chase)
+    displacement = _toClosest(displacement, origin, view.human_loc, view.masked("sensor", "human"), step, ~acted)
+
+    displacement[:, 0] = sensorGreedy(view)[:, 0]
+    return displacement
+
+
+@registerPolicy("lethal", "scenario1")
+@registerPolicy("lethal", "scenario2")
+def lethalScenario12(view):
+    """
+    Lethals move towards the first identified combatant, or else follow their closest warfighter
+    """
+    origin = view.lethal_loc
+    step = view.lethal_max_step_size
+    unk_distances = view.masked("lethal", "unknown")
+
+    # the same target for every lethal
+    acted, targ_id = _firstMatch((view.unknown_estimates > view.tau) & view.unknown_alive)
+    acted, targ_id = acted[:, None], targ_id[:, None]
+    displacement = _step(np.zeros_like(origin), origin, _gather(view.unknown_loc, targ_id),
+                         _pick(unk_distances, targ_id), step, acted)
+    # Follow closest warfighter
+    return _toClosest(displacement, origin, view.human_loc, view.masked("lethal", "human"), step, ~acted)
+
+
+@registerPolicy("lethal", "scenario3")
+def lethalScenario3(view):
+    """
+    Lethals move towards the first unknown that is within 10 of a warfighter or is an identified combatant. Idle
+    lethal 0 moves to its closest unknown, idle lethal 1 to its closest warfighter, and any other idle lethal to its
+    closest sensor.
+    """
+    origin = view.lethal_loc
+    step = view.lethal_max_step_size
+    unk_distances = view.masked("lethal", "unknown")
+    wf_distances = view.masked("lethal", "human")
+    unk_wf_distances = view.masked("unknown", "human")
+    trials = np.arange(len(origin))
+
+    # the same unknown for every lethal
+    row_min = np.min(unk_wf_distances, axis=2)
+    near_wf = row_min < 10.0
+    suspected = (view.unknown_estimates > view.tau) & view.unknown_alive
+    acted, unk_id = _firstMatch(near_wf | suspected)
+    chase = acted & near_wf[trials, unk_id]
+    chase_dist = row_min[trials, unk_id]
+    acted, chase, unk_id, chase_dist = acted[:, None], chase[:, None], unk_id[:, None], chase_dist[:, None]
+    target = _gather(view.unknown_loc, unk_id)
+
+    displacement = np.zeros_like(origin)
+    # Move towards unknown if it is too close to a warfighter
+    displacement = _step(displacement, origin, target, chase_dist, step, chase)
+    # Move towards identified combatant
+    displacement = _step(displacement, origin, target, _pick(unk_distances, unk_id), step, acted & ~chase)
+
+    idle = ~acted
+    agent = np.arange(origin.shape[1])
+    # Lethal 1 move to closest unknown
+    min_unk_dist = np.min(unk_distances, axis=2)
+    to_unknown = idle & (agent == 0) & (min_unk_dist < 1000.00)
+    displacement = _toClosest(displacement, origin, view.unknown_loc, unk_distances, step, to_unknown)
+    # Lethal 2 move to closest warfighter
+    min_wf_dist = np.min(wf_distances, axis=2)
+    to_wf = idle & (agent == 1) & (min_wf_dist < 1000.00)
+    displacement = _toClosest(displacement, origin, view.human_loc, wf_distances, step, to_wf)
+    idle = idle & ~to_unknown & ~to_wf
+
+    # Move to closest sensor
+    sensor_distances = view.masked("lethal", "sensor")
+    closest = np.argmin(sensor_distances, axis=2)
+    return _step(displacement, origin, _gather(view.sensor_loc, closest), _pick(sensor_distances, closest), step,
+                 idle)
+
+
+if __name__ == '__main__':
+    from .batch import BatchSimulator
+    from .simulator import Simulator
+    from . import policies  # the registry the simulators use, python -m runs a second copy of this module
+
+    @policies.registerPolicy("lethal", "hold")
+    def hold(view):
+        """Lethals stay where they are"""
+        return np.zeros_like(view.lethal_loc)
+
+    for s in (1, 2, 3):
+        for sensor in ("greedy", "scenario{}".format(s)):
+            single = np.array([Simulator(s, 0.5, seed=seed, sensor_policy=sensor, lethal_policy="hold").run()
+                               for seed in range(20)])
+            batch = BatchSimulator(s, 0.5, 20, seed=0, sensor_policy=sensor, lethal_policy="hold").run()
+            print("Scenario {}, sensors {}, lethals hold: {:.2f} / {:.2f} combatants killed, batch {:.2f}".format(
+                s, sensor, single[:, 0].mean(), single[:, 3].mean(), batch[:, 0].mean()))
+    print("registered:", policies.policyNames("sensor"), policies.policyNames("lethal"))
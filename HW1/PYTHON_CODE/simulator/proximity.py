@@ -0,0 +1,115 @@
+"""
+Incremental answers to "which pairs of agents of two groups are within a radius", for the threshold tests of the
+lethal actions, see DistanceCache.within().
+
+Agents move by bounded steps: the warfighters and unknowns by at most 1 per axis (sqrt(2)) per tick, the robots by
+about their max step size. A ProximityTracker keeps a neighbour list (a Verlet list): the pairs that were within
+radius + skin at the last full evaluation, and the locations at that time. By the triangle inequality, a pair can
+only have come within the radius since then if the two agents together moved more than skin away from those
+locations, so as long as the largest drift of group a plus the largest drift of group b stays below the skin, only
+the listed pairs need their distances computed. Once it does not (after about REBUILD_TICKS ticks, or right away
+after a robot took a long step), the full matrix is evaluated once more and the list is rebuilt.
+
+The distances of the listed pairs are computed with the same float32 operations as distances.pairwiseDistances(),
+so the pairs and distances are exactly those a full evaluation gives. When most pairs are on the list anyway (small
+maps, like the 50x50 map of the original scenarios) the tracker just evaluates the full matrix every time.
+"""
+import math
+
+import numpy as np
+
+from . import distances as _distances  # the module, it imports this one
+
+# ticks of maximum steps the skin is sized for
+REBUILD_TICKS = 4
+
+# above this fraction of all pairs on the list, the full matrix is evaluated every time instead
+DENSE_FRACTION = 0.25
+
+# float32 distances of maps up to about 10^5 are off by less than this, the skin is kept this much tighter
+_MARGIN = 0.01
+
+# step bound of the agents that walk with np.sign steps
+_WALK_STEP = math.sqrt(2)
+
+
+def maxStep(world, group):
+    """
+    :param world: Simulator or BatchSimulator
+    :param group: "sensor", "lethal", "human" or "unknown"
+    :return: how far an agent of the group moves in one tick, at most
+    """
+    return getattr(world, group + "_max_step_size", _WALK_STEP)
+
+
+class ProximityTracker:
+    def __init__(self, world, a, b, radius, skin=None):
+        """
+        :param world: Simulator or BatchSimulator whose *_loc attributes are read
+        :param a: name of the row group, see distances.py
+        :param b: name of the column group
+        :param radius: the radius the pairs are tested against
+        :param skin: extra distance of the neighbour list, defaults to REBUILD_TICKS maximum steps of both groups
+        """
+        self.world = world
+        self.a = a
+        self.b = b
+        self.radius = radius
+        self.skin = skin if skin is not None else REBUILD_TICKS*(maxStep(world, a) + maxStep(world, b))
+        self.evaluations = 0  # full matrices evaluated so far
+        self._pairs = None  # index arrays of the listed pairs, None while dense
+        self._dense_calls = 0  # calls since the list was found to be dense, it is looked at again every few
+        self._ref_a = None
+        self._ref_b = None
+
+    def within(self, inclusive=False):
+        """
+        :param inclusive: also the pairs exactly at the radius
+        :return: (index arrays, distances) of the pairs closer than the radius, as np.nonzero() and the matrix of
+                 distances give them: (a indices, b indices), with the trial indices in front for batches
+        """
+        loc_a = getattr(self.world, self.a + "_loc")
+        loc_b = getattr(self.world, self.b + "_loc")
+        if self._dense_calls:
+            self._dense_calls = (self._dense_calls + 1) % REBUILD_TICKS
+            return self._full(loc_a, loc_b, inclusive, rebuild=False)
+        if self._pairs is None or not self._listValid(loc_a, loc_b):
+            return self._full(loc_a, loc_b, inclusive)
+
+        pairs = self._pairs
+        diff = loc_a[pairs[:-1]] - loc_b[pairs[:-2] + pairs[-1:]]
+        distances = np.sqrt(np.sum(diff*diff, axis=-1))
+        close = distances <= self.radius if inclusive else distances < self.radius
+        return tuple(index[close] for index in pairs), distances[close]
+
+    def _listValid(self, loc_a, loc_b):
+        if loc_a.shape != self._ref_a.shape or loc_b.shape != self._ref_b.shape:
+            return False
+        drift = _maxDrift(loc_a, self._ref_a) + _maxDrift(loc_b, self._ref_b)
+        return drift <= self.skin - _MARGIN
+
+    def _full(self, loc_a, loc_b, inclusive, rebuild=True):
+        distances = _distances.pairwiseDistances(loc_a, loc_b)
+        self.evaluations += 1
+        if rebuild:
+            near = distances <= self.radius + self.skin
+            if np.count_nonzero(near) > DENSE_FRACTION*near.size:
+                self._pairs = None
+                self._dense_calls = 1
+            else:
+                self._pairs = np.nonzero(near)
+                self._ref_a = loc_a.copy()
+                self._ref_b = loc_b.copy()
+        close = distances <= self.radius if inclusive else distances < self.radius
+        pairs = np.nonzero(close)
+        return pairs, distances[pairs]
+
+
+def _maxDrift(loc, ref):
+    """
+    :return: the largest distance an agent moved from its reference location
+    """
+    if loc.size == 0:
+        return 0.0
+    diff = loc.astype(float) - ref
+    return float(np.sqrt(np.max(np.sum(diff*diff, axis=-1))))
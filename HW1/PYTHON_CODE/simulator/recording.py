@@ -0,0 +1,214 @@
+"""
+Frame writers for the Renderer. A writer receives every rendered frame through write(t, frame) and is closed once
+the episode is over.
+
+    PNGWriter:       one frame_XXX.png file per timestep
+    FFmpegWriter:    pipes raw RGB frames into a local ffmpeg process that encodes a video file
+    GIFWriter:       one animated GIF for the whole episode
+    FrameRingBuffer: keeps the last few frames in memory and writes them out on demand with dump()
+
+The file writers encode on a background thread, so the simulation only waits for them when their queue is full.
+"""
+import queue
+import shutil
+import subprocess
+import threading
+from os import path
+
+import numpy as np
+from matplotlib.image import imsave
+from PIL import Image
+
+
+class BackgroundWriter:
+    def __init__(self, max_pending=64):
+        """
+        Base class of the writers that encode frames on a background thread. Subclasses implement encode() and
+        optionally finish(), both run on that thread.
+        :param max_pending: frames that can wait to be encoded before write() blocks, this bounds the memory used
+                            when the encoder can not keep up
+        """
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._error = None
+        self._thread = threading.Thread(target=self._work, name=type(self).__name__, daemon=True)
+        self._thread.start()
+
+    def _work(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            if self._error is None:
+                try:
+                    self.encode(*item)
+                except Exception as e:  # handed to the simulation thread by close()
+                    self._error = e
+        try:
+            self.finish()
+        except Exception as e:
+            if self._error is None:
+                self._error = e
+
+    def encode(self, t, frame):
+        raise NotImplementedError
+
+    def finish(self):
+        pass
+
+    def write(self, t, frame):
+        """
+        Queues a frame
+        :param t: timestep of the frame
+        :param frame: (height, width, 4) uint8 RGBA array, must not be modified afterwards
+        :return: None
+        """
+        self._queue.put((t, frame))
+
+    def close(self):
+        """
+        Waits until every queued frame is encoded and the output is complete
+        :raises: whatever exception encoding a frame raised
+        :return: None
+        """
+        self._queue.put(None)
+        self._thread.join()
+        if self._error is not None:
+            raise self._error
+
+
+class PNGWriter(BackgroundWriter):
+    def __init__(self, output_dir, n_frames=None, max_pending=64):
+        """
+        Saves every frame as output_dir/frame_XXX.png
+        :param output_dir: directory the files are written to
+        :param n_frames: number of frames that are going to be written, the frame number is zero padded to at least
+                         3 digits and to as many as the last frame needs, so the files always sort in order
+        :param max_pending: see BackgroundWriter
+        """
+        self.output_dir = output_dir
+        digits = max(3, len(str(n_frames - 1))) if n_frames else 3
+        self._name = "frame_{:0%d}.png" % digits
+        super().__init__(max_pending)
+
+    def encode(self, t, frame):
+        imsave(path.join(self.output_dir, self._name.format(t)), frame)
+
+
+class FFmpegWriter(BackgroundWriter):
+    def __init__(self, filename, fps=10, ffmpeg="ffmpeg", codec_args=("-vcodec", "libx264", "-pix_fmt", "yuv420p"),
+                 max_pending=64):
+        """
+        Encodes the frames into a video file with a local ffmpeg process, frames are sent as raw RGB over its stdin
+        :param filename: video file to write, the container follows from the extension (e.g. .mp4)
+        :param fps: frames per second of the video
+        :param ffmpeg: ffmpeg executable
+        :param codec_args: output options passed to ffmpeg
+        :param max_pending: see BackgroundWriter
+        :raises: FileNotFoundError if ffmpeg can not be found
+        """
+        if shutil.which(ffmpeg) is None:
+            raise FileNotFoundError("ffmpeg executable '{}' not found".format(ffmpeg))
+        self.filename = filename
+        self.fps = fps
+        self.ffmpeg = ffmpeg
+        self.codec_args = list(codec_args)
+        self._process = None
+        super().__init__(max_pending)
+
+    def _start(self, height, width):
+        # yuv420p needs even dimensions, pad by a pixel where needed
+        command = [self.ffmpeg, "-y", "-loglevel", "error",
+                   "-f", "rawvideo", "-pix_fmt", "rgb24", "-s", "{}x{}".format(width, height),
+                   "-r", str(self.fps), "-i", "-",
+                   "-vf", "pad=ceil(iw/2)*2:ceil(ih/2)*2"] + self.codec_args + [self.filename]
+        self._process = subprocess.Popen(command, stdin=subprocess.PIPE, stderr=subprocess.PIPE)
+
+    def encode(self, t, frame):
+        if self._process is None:
+            self._start(*frame.shape[:2])
+        self._process.stdin.write(np.ascontiguousarray(frame[..., :3]).tobytes())
+
+    def finish(self):
+        if self._process is None:
+            return
+        self._process.stdin.close()
+        errors = self._process.stderr.read()
+        if self._process.wait() != 0:
+            raise RuntimeError("ffmpeg failed: " + errors.decode(errors="replace").strip())
+
+
+class GIFWriter(BackgroundWriter):
+    def __init__(self, filename, fps=10, loop=0, max_pending=64):
+        """
+        Writes all frames as one animated GIF when closed. Frames are reduced to 256 colour palette images as they
+        come in, which keeps them at a quarter of the size of the RGBA frames until then.
+        :param filename: GIF file to write
+        :param fps: frames per second of the animation
+        :param loop: number of times the animation loops, 0 is forever
+        :param max_pending: see BackgroundWriter
+        """
+        self.filename = filename
+        self.fps = fps
+        self.loop = loop
+        self._frames = []
+        super().__init__(max_pending)
+
+    def encode(self, t, frame):
+        self._frames.append(Image.fromarray(frame[..., :3]).convert("P", palette=Image.ADAPTIVE))
+
+    def finish(self):
+        if self._frames:
+            self._frames[0].save(self.filename, save_all=True, append_images=self._frames[1:],
+                                 duration=int(1000 / self.fps), loop=self.loop)
+        self._frames = []
+
+
+class FrameRingBuffer:
+    def __init__(self, capacity):
+        """
+        Keeps the last capacity frames as RGB in one preallocated array
+        :param capacity: number of frames to keep
+        """
+        if capacity < 1:
+            raise ValueError("capacity must be a positive int")
+        self.capacity = capacity
+        self._frames = None
+        self._times = np.zeros(capacity, dtype=int)
+        self._count = 0  # frames written so far
+
+    def write(self, t, frame):
+        """
+        Stores a frame, replacing the oldest one once the buffer is full
+        :param t: timestep of the frame
+        :param frame: (height, width, 3 or 4) uint8 array
+        :return: None
+        """
+        if self._frames is None:
+            self._frames = np.zeros((self.capacity,) + frame.shape[:2] + (3,), dtype=np.uint8)
+        slot = self._count % self.capacity
+        self._frames[slot] = frame[..., :3]
+        self._times[slot] = t
+        self._count += 1
+
+    def close(self):
+        pass
+
+    def __len__(self):
+        return min(self._count, self.capacity)
+
+    def frames(self):
+        """
+        :return: list of (t, frame) of the buffered frames, oldest first. The frames are views into the buffer
+        """
+        first = self._count - len(self)
+        return [(self._times[i % self.capacity], self._frames[i % self.capacity]) for i in range(first, self._count)]
+
+    def dump(self, writer):
+        """
+        Writes the buffered frames, oldest first, to another writer and closes it
+        :param writer: e.g. a GIFWriter or PNGWriter
+        :return: None
+        """
+        for t, frame in self.frames():
+            writer.write(t, frame.copy())
+        writer.close()
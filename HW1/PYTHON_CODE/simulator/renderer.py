@@ -0,0 +1,93 @@
+"""
+Renders the state of a simulation into image frames.
+
+The figure, axes, legend and one scatter artist per kind of agent are created once, and everything but the agents
+is drawn once into a cached background. Every frame only moves the scatter offsets, restores the background and draws
+the agents on top of it (blitting). The finished frames are handed to a writer from recording.py, which stores or
+encodes them.
+
+The figure is drawn with the Agg canvas directly instead of through pyplot, so no GUI backend or global figure state
+is involved and rendering works the same in headless workers.
+"""
+import numpy as np
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.lines import Line2D
+
+# (color, marker) of every kind of agent
+ENEMY = ("red", "X")
+SENSOR = ("green", '^')
+LETHAL = ("purple", "v")
+HUMAN = ("blue", 'o')
+UNKNOWN = ("black", 'D')
+
+_NO_POINTS = np.zeros((0, 2))
+
+
+class Renderer:
+    def __init__(self, xy_size, tau, writer):
+        """
+        :param xy_size: size of the world, used for the axis limits
+        :param tau: the classification threshold, unknowns above it are drawn as enemy combatants
+        :param writer: receives every frame through write(t, frame) and is closed by close(), see recording.py
+        """
+        self.tau = tau
+        self.writer = writer
+
+        self.fig = Figure()
+        self.canvas = FigureCanvasAgg(self.fig)
+        # leave room above the axes for the legend
+        self.fig.subplots_adjust(top=0.8)
+        ax = self.fig.add_subplot()
+        ax.set_xlim([0, xy_size])
+        ax.set_ylim([0, xy_size])
+
+        # animated artists are left out of canvas.draw(), they are drawn on top of the background every frame
+        self.ax = ax
+        self.sensors = ax.scatter([], [], color=SENSOR[0], marker=SENSOR[1], label="Sensor", animated=True)
+        self.lethals = ax.scatter([], [], color=LETHAL[0], marker=LETHAL[1], label="Lethal", animated=True)
+        self.humans = ax.scatter([], [], color=HUMAN[0], marker=HUMAN[1], label='Human Warfighter', animated=True)
+        self.enemies = ax.scatter([], [], color=ENEMY[0], marker=ENEMY[1], label="Enemy Combatant", animated=True)
+        self.unknowns = ax.scatter([], [], color=UNKNOWN[0], marker=UNKNOWN[1], label="Unknown", animated=True)
+        self._agents = (self.sensors, self.lethals, self.humans, self.enemies, self.unknowns)
+
+        # below is some crazy code to make the legend nice
+        legend_elements = [Line2D([0], [0], color='w', markerfacecolor=color, marker=marker, markersize=10,
+                                  label=label)
+                           for (color, marker), label in ((ENEMY, 'Enemy Combatant'), (SENSOR, 'Sensors'),
+                                                          (LETHAL, 'Lethals'), (HUMAN, 'Warfighters'),
+                                                          (UNKNOWN, 'Unknowns'))]
+        ax.legend(handles=legend_elements, loc='upper center', bbox_to_anchor=(0.5, 1.3), ncol=3)
+
+        self.canvas.draw()
+        self._background = self.canvas.copy_from_bbox(self.fig.bbox)
+
+    @staticmethod
+    def _offsets(locations):
+        return locations if len(locations) else _NO_POINTS
+
+    def draw(self, sim, t):
+        """
+        Draws the current state of a simulation and passes the frame to the writer
+        :param sim: Simulator to draw
+        :param t: timestep of the frame
+        :return: None
+        """
+        self.sensors.set_offsets(self._offsets(sim.sensor_loc))
+        self.lethals.set_offsets(self._offsets(sim.lethal_loc))
+        self.humans.set_offsets(self._offsets(sim.human_loc[sim.human_alive]))
+        enemy = sim.unknown_estimates > self.tau
+        self.enemies.set_offsets(self._offsets(sim.unknown_loc[sim.unknown_alive & enemy]))
+        self.unknowns.set_offsets(self._offsets(sim.unknown_loc[sim.unknown_alive & ~enemy]))
+
+        self.canvas.restore_region(self._background)
+        for artist in self._agents:
+            self.ax.draw_artist(artist)
+        self.writer.write(t, np.array(self.canvas.buffer_rgba()))
+
+    def close(self):
+        """
+        Flushes the writer
+        :return: None
+        """
+        self.writer.close()
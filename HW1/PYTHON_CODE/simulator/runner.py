@@ -0,0 +1,354 @@
+"""
+Monte-Carlo runner: splits a number of trials into chunks, runs the chunks as BatchSimulator batches on a pool of
+worker processes and folds the results into running means and variances as they come back.
+
+Every chunk gets its own child of one SeedSequence, so a run is reproducible from its seed no matter how many
+workers it was spread over. Chunks are folded in chunk order, which makes the statistics bit-for-bit identical
+between runs with the same seed and chunk size, and only a small window of chunks is ever in flight or waiting.
+
+Command line use, e.g. for a sweep over scenarios and thresholds:
+    python -m simulator.runner --scenario 1 2 3 --tau 0.5 0.9 --trials 100000 --workers 8 --no-greedy
+    python -m simulator.runner --scenario war_zone_large city.yaml --tau 0.9 --trials 1000
+    python -m simulator.runner --scenario 3 --tau 0.9 --trials 100000 --seed 1 --cache results.sqlite
+    python -m simulator.runner --scenario 1 2 3 --tau 0.9 --trials 10000 --metrics metrics.prom
+"""
+import argparse
+import os
+import warnings
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+import numpy as np
+
+from .batch import BatchSimulator
+from .cache import ResultCache, chunkKey
+from .metrics import SimulationMetrics, writeMetrics
+from .policies import ROLES, getPolicy
+from .scenario import scenarioSpec
+from .sharedmem import SharedArray
+
+# columns of the result rows of Simulator.run() and BatchSimulator.run()
+RESULT_COLUMNS = ("combatants_killed", "warfighters_killed", "civilians_killed",
+                  "combatants", "warfighters", "civilians")
+
+DEFAULT_CHUNK_SIZE = 2000
+
+
+class RunningStats:
+    def __init__(self, width=len(RESULT_COLUMNS)):
+        """
+        Running mean, variance and covariance of the rows of result chunks, merged chunk by chunk (Chan et al.)
+        :param width: number of columns of the rows
+        """
+        self.count = 0
+        self.mean = np.zeros(width)
+        self._m2 = np.zeros(width)
+        self._comoment = np.zeros((width, width))  # sums of products of deviations, for ratios of columns
+        self.seed = None  # entropy of the SeedSequence the trials were drawn from, set by runTrials
+
+    def update(self, data):
+        """
+        Folds a chunk of rows into the statistics
+        :param data: (n, width) array
+        :return: None
+        """
+        data = np.asarray(data, dtype=float)
+        if len(data) == 0:
+            return
+        chunk = RunningStats(data.shape[1])
+        chunk.count = len(data)
+        chunk.mean = np.mean(data, axis=0)
+        deviations = data - chunk.mean
+        chunk._m2 = np.sum(deviations**2, axis=0)
+        chunk._comoment = deviations.T @ deviations
+        self.merge(chunk)
+
+    def merge(self, other):
+        """
+        Folds the statistics of another set of rows into these
+        :param other: RunningStats
+        :return: None
+        """
+        n = other.count
+        if n == 0:
+            return
+        total = self.count + n
+        delta = other.mean - self.mean
+        self.mean = self.mean + delta*(n / total)
+        self._m2 = self._m2 + other._m2 + delta**2*(self.count*n / total)
+        self._comoment = self._comoment + other._comoment + np.outer(delta, delta)*(self.count*n / total)
+        self.count = total
+
+    def toArray(self):
+        """
+        :return: float64 array of count, means, sums of squared deviations and the co-moments, (width + 1)**2 long,
+                 see fromArray()
+        """
+        return np.concatenate(([self.count], self.mean, self._m2, self._comoment.ravel()))
+
+    @classmethod
+    def fromArray(cls, values):
+        """
+        :param values: array from toArray()
+        :return: RunningStats
+        """
+        width = int(round(np.sqrt(len(values)))) - 1
+        stats = cls(width)
+        stats.count = int(values[0])
+        stats.mean = np.array(values[1:width + 1])
+        stats._m2 = np.array(values[width + 1:2*width + 1])
+        stats._comoment = np.array(values[2*width + 1:]).reshape(width, width)
+        return stats
+
+    @property
+    def variance(self):
+        """Sample variance of every column"""
+        if self.count < 2:
+            return np.full(len(self.mean), np.nan)
+        return self._m2 / (self.count - 1)
+
+    @property
+    def std_error(self):
+        """Standard error of every column mean"""
+        return np.sqrt(self.variance / self.count)
+
+    @property
+    def covariance(self):
+        """Sample covariance matrix of the columns"""
+        if self.count < 2:
+            return np.full(self._comoment.shape, np.nan)
+        return self._comoment / (self.count - 1)
+
+
+def _simulatorClass(backend, warn=False):
+    """
+    :param backend: "numpy" for BatchSimulator, "kernel" for the compiled KernelSimulator, see kernel.py
+    :param warn: warn when the kernel backend falls back to BatchSimulator
+    :return: the class
+    """
+    if backend == "numpy":
+        return BatchSimulator
+    if backend == "kernel":
+        from .kernel import KernelSimulator, HAVE_NUMBA  # numba takes a while to import, only when asked for
+
+        if HAVE_NUMBA:
+            return KernelSimulator
+        # uncompiled, the kernel is 20-30x slower than BatchSimulator, which gives the same trials
+        if warn:
+            warnings.warn("numba is not installed, the kernel backend runs BatchSimulator instead", RuntimeWarning,
+                          stacklevel=3)
+        return BatchSimulator
+    raise ValueError("backend must be numpy or kernel")
+
+
+def _runChunk(scenario, tau, n_trials, greedy, seed_seq, policies=(None, None), backend="numpy",
+              collect_metrics=False):
+    """
+    Runs one chunk of trials, this is what the worker processes execute
+    :return: (n_trials, 6) result array, or (result array, SimulationMetrics) with collect_metrics
+    """
+    if collect_metrics:
+        metrics = SimulationMetrics()
+        data = BatchSimulator(scenario, tau, n_trials, greedy=greedy, seed=seed_seq, sensor_policy=policies[0],
+                              lethal_policy=policies[1], metrics=metrics).run()
+        return data, metrics
+    return _simulatorClass(backend)(scenario, tau, n_trials, greedy=greedy, seed=seed_seq, sensor_policy=policies[0],
+                                    lethal_policy=policies[1]).run()
+
+
+def _runChunkInto(out, slot, *args):
+    """
+    Runs a chunk like _runChunk() and writes its result rows into out.array[slot] instead of sending them back
+    :param out: SharedArray of (slots, chunk_size, 6) result rows
+    :param slot: which slot of out the chunk gets
+    :param args: arguments of _runChunk()
+    :return: None, or the SimulationMetrics of the chunk with collect_metrics
+    """
+    data = _runChunk(*args)
+    metrics = None
+    if isinstance(data, tuple):
+        data, metrics = data
+    out.array[slot, :len(data)] = data
+    return metrics
+
+
+def _chunkSizes(n, chunk_size):
+    sizes = [chunk_size]*(n // chunk_size)
+    if n % chunk_size:
+        sizes.append(n % chunk_size)
+    return sizes
+
+
+def runTrials(scenario, tau, n, workers=None, greedy=True, seed=None, chunk_size=DEFAULT_CHUNK_SIZE,
+              executor=None, callback=None, sensor_policy=None, lethal_policy=None, cache=None, backend="numpy",
+              metrics=None, shared_memory=True):
+    """
+    Runs n trials of a scenario spread over worker processes
+    :param scenario: scenario number 1 2 or 3, ScenarioSpec, preset name or scenario file, see scenario.py
+    :param tau: the classification threshold
+    :param n: number of trials
+    :param workers: number of worker processes, defaults to the number of cpus. 1 runs everything in this process
+    :param greedy: use the greedy sensor/lethal policies instead of the per-scenario ones
+    :param seed: seed for the SeedSequence every chunk's seed is spawned from, None for fresh entropy
+    :param chunk_size: number of trials each worker runs as one batch
+    :param executor: an already running executor to submit the chunks to, e.g. to share one pool over a sweep
+    :param callback: called with the RunningStats after every chunk that was folded in. If it returns True, the run
+                     stops there and the chunks after it are dropped, see adaptive.py
+    :param sensor_policy: name of a registered sensor policy, see policies.py. Names rather than functions, so they
+                          can be sent to the workers
+    :param lethal_policy: the same for the lethal robots
+    :param cache: ResultCache or the file name of one, chunks found in it are not run again and the others are
+                  added to it, see cache.py
+    :param backend: "numpy" runs the chunks as BatchSimulator, "kernel" as the compiled KernelSimulator, which only
+                    has the built-in policies. Both give the same results, so they share cache entries
+    :param metrics: SimulationMetrics the workers' phase times and counters are added to, see metrics.py. Only the
+                    chunks that are simulated count, not the ones found in the cache. Needs the numpy backend
+    :param shared_memory: the workers write their result rows into slots of a shared memory block that the chunks are
+                          folded from in place, instead of pickling them back through the pool, see sharedmem.py
+    :return: RunningStats over the result rows, see RESULT_COLUMNS
+    """
+    if n < 1:
+        raise ValueError("n must be a positive int")
+    if chunk_size < 1:
+        raise ValueError("chunk_size must be a positive int")
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    scenario = scenarioSpec(scenario)  # checked here, and files are read once instead of in every worker
+    policies = (sensor_policy, lethal_policy)
+    for role, policy in zip(ROLES, policies):
+        if policy is not None:
+            getPolicy(role, policy)  # unknown names fail here instead of in every worker
+    _simulatorClass(backend, warn=True)
+    if metrics is not None and backend != "numpy":
+        raise ValueError("metrics are only collected by the numpy backend")
+    collect_metrics = metrics is not None
+    seed_seq = np.random.SeedSequence(seed)
+    sizes = _chunkSizes(n, chunk_size)
+    seeds = seed_seq.spawn(len(sizes))
+    stats = RunningStats()
+    stats.seed = seed_seq.entropy
+
+    keys = None
+    cached = {}  # chunk number -> RunningStats of the chunks found in the cache
+    if cache is not None:
+        if isinstance(cache, (str, os.PathLike)):
+            cache = ResultCache(cache)
+        keys = [chunkKey(scenario, tau, greedy, policies, chunk_seed, size) for size, chunk_seed in zip(sizes, seeds)]
+        for i, key in enumerate(keys):
+            values = cache.get(key)
+            if values is not None:
+                cached[i] = RunningStats.fromArray(values)
+
+    def fold(i, data):
+        chunk = cached.pop(i, None)
+        if chunk is None:
+            if collect_metrics:
+                data, chunk_metrics = data
+                metrics.merge(chunk_metrics)
+            chunk = RunningStats()
+            chunk.update(data)
+            if cache is not None:
+                cache.put(keys[i], chunk.toArray())
+        stats.merge(chunk)
+        return callback is not None and callback(stats) is True
+
+    todo = [i for i in range(len(sizes)) if i not in cached]
+    if (workers == 1 and executor is None) or not todo:
+        for i, (size, chunk_seed) in enumerate(zip(sizes, seeds)):
+            if fold(i, None if i in cached else _runChunk(scenario, tau, size, greedy, chunk_seed, policies, backend,
+                                                                 collect_metrics)):
+                break
+        return stats
+
+    pool = executor if executor is not None else ProcessPoolExecutor(max_workers=workers)
+    window = 2*workers
+    # one slot of result rows for every chunk that can be in flight or waiting to be folded
+    slots = SharedArray((window, chunk_size, len(RESULT_COLUMNS)), np.int64) if shared_memory else None
+    free = list(range(window))
+    pending = {}
+    try:
+        finished = {}
+        next_fold = 0
+        stop = False
+        while next_fold < len(sizes) and not stop:
+            while todo and len(pending) + len(finished) < window:
+                i = todo.pop(0)
+                args = (scenario, tau, sizes[i], greedy, seeds[i], policies, backend, collect_metrics)
+                if slots is None:
+                    pending[pool.submit(_runChunk, *args)] = (i, None)
+                else:
+                    slot = free.pop()
+                    pending[pool.submit(_runChunkInto, slots, slot, *args)] = (i, slot)
+            if pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    i, slot = pending.pop(future)
+                    finished[i] = (slot, future.result())
+            # fold in chunk order so the statistics do not depend on scheduling
+            while not stop and (next_fold in finished or next_fold in cached):
+                slot, data = finished.pop(next_fold, (None, None))
+                if slot is not None:
+                    rows = slots.array[slot, :sizes[next_fold]]  # read in place
+                    data = (rows, data) if collect_metrics else rows
+                stop = fold(next_fold, data)
+                if slot is not None:
+                    free.append(slot)
+                next_fold += 1
+    finally:
+        for future in pending:
+            future.cancel()
+        if executor is None:
+            pool.shutdown(cancel_futures=True)  # waits for the chunks that already run
+        elif slots is not None:
+            # chunks that already run on a shared executor can not be cancelled and write into the block until they
+            # finish, it is only unlinked after them
+            wait(pending)
+        if slots is not None:
+            slots.unlink()
+    return stats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run Monte-Carlo trials of the simulator on a process pool")
+    parser.add_argument("--scenario", nargs="+", default=["1"],
+                        help="scenario numbers, preset names or scenario files, see scenario.py")
+    parser.add_argument("--tau", type=float, nargs="+", default=[0.9])
+    parser.add_argument("--trials", type=int, default=100)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--greedy", action=argparse.BooleanOptionalAction, default=True)
+    parser.add_argument("--sensor-policy", help="registered sensor policy, overrides --greedy for the sensors")
+    parser.add_argument("--lethal-policy", help="registered lethal policy, overrides --greedy for the lethals")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE)
+    parser.add_argument("--cache", help="SQLite file of cached results, see cache.py")
+    parser.add_argument("--backend", choices=("numpy", "kernel"), default="numpy",
+                        help="kernel runs the ticks compiled with numba, see kernel.py")
+    parser.add_argument("--metrics", help="file the phase times and counters of every run are written to, JSON for "
+                                          "a .json file and Prometheus text otherwise, see metrics.py")
+    args = parser.parse_args(argv)
+
+    entries = []
+
+    workers = args.workers or os.cpu_count() or 1
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for scenario in args.scenario:
+            for tau in args.tau:
+                metrics = SimulationMetrics() if args.metrics else None
+                stats = runTrials(scenario, tau, args.trials, workers=workers, greedy=args.greedy, seed=args.seed,
+                                  chunk_size=args.chunk_size, executor=pool,
+                                  sensor_policy=args.sensor_policy, lethal_policy=args.lethal_policy,
+                                  cache=args.cache, backend=args.backend, metrics=metrics)
+                print("Scenario {}, tau {}, greedy={}, {} trials (seed entropy {}):".format(
+                    scenario, tau, args.greedy, stats.count, stats.seed))
+                mean, err = stats.mean, stats.std_error
+                print("\tAverage combatants killed:  {:.4f} +- {:.4f} / {:.4f}".format(mean[0], err[0], mean[3]))
+                print("\tAverage warfighters killed: {:.4f} +- {:.4f} / {:.4f}".format(mean[1], err[1], mean[4]))
+                print("\tAverage civ killed:         {:.4f} +- {:.4f} / {:.4f}".format(mean[2], err[2], mean[5]))
+                if metrics is not None:
+                    entries.append(({"scenario": scenario, "tau": tau, "greedy": args.greedy}, metrics))
+    if entries:
+        writeMetrics(args.metrics, entries)
+
+
+if __name__ == '__main__':
+    main()
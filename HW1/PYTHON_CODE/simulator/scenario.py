@@ -0,0 +1,184 @@
+"""
+Scenario definitions: world size, agent counts, agent parameters and the combatant ratio of a simulation.
+
+A ScenarioSpec is validated when it is made, so a bad file fails when it is loaded instead of in the middle of a
+run. Specs come from the presets below, from a dict, or from a JSON, TOML or YAML file with the same keys:
+
+    # city.yaml
+    name: city
+    policy: 2                 # which per-scenario policies the robots use, and which kill rule applies
+    combatant_ratio: 0.3
+    xy_size: 500
+    num_sensors: 50
+    num_unknown: 2000
+
+Keys that are left out take the defaults of the original assignment (a 50x50 map, 2 sensors, 2 lethals,
+4 warfighters and 4 unknowns, 50 timesteps). Simulator, BatchSimulator and the command line tools accept a spec, a
+preset name, a scenario number (1, 2, 3 are the original three scenarios) or a file name, see scenarioSpec().
+"""
+import json
+from os import path
+
+# defaults of every field, the values of the original assignment
+DEFAULTS = {
+    "name": None,
+    "policy": 1,
+    "combatant_ratio": 0.1,
+    "xy_size": 50,
+    "end_time": 50,
+    "lethal_radius": 10,
+    "sensor_range": 10.0,
+    "sensor_max_step_size": 2.0,
+    "lethal_max_step_size": 2.0,
+    "num_sensors": 2,
+    "num_lethal": 2,
+    "num_humans": 4,
+    "num_unknown": 4,
+    "prior": 0.5,
+}
+
+_COUNTS = ("num_sensors", "num_lethal", "num_humans", "num_unknown")
+
+PRESETS = {
+    # the three scenarios of the assignment
+    "peacekeeping": {"policy": 1, "combatant_ratio": 0.1},
+    "guerrilla": {"policy": 2, "combatant_ratio": 0.3},
+    "war_zone": {"policy": 3, "combatant_ratio": 0.8},
+}
+# larger versions of each: about 10^3 agents on a 300 map and 10^4 agents on a 1000 map
+for _name, _base in list(PRESETS.items()):
+    PRESETS[_name + "_medium"] = dict(_base, xy_size=300, num_sensors=60, num_lethal=60, num_humans=160,
+                                      num_unknown=720)
+    PRESETS[_name + "_large"] = dict(_base, xy_size=1000, num_sensors=600, num_lethal=600, num_humans=1600,
+                                     num_unknown=7200)
+
+# the scenario numbers of the assignment
+SCENARIO_NUMBERS = {1: "peacekeeping", 2: "guerrilla", 3: "war_zone"}
+
+
+class ScenarioSpec:
+    def __init__(self, **fields):
+        """
+        :param fields: any of the keys of DEFAULTS, the rest take their default
+        :raises: ValueError for unknown keys and invalid values
+        """
+        unknown = set(fields) - set(DEFAULTS)
+        if unknown:
+            raise ValueError("unknown scenario keys: {}".format(", ".join(sorted(unknown))))
+        values = dict(DEFAULTS, **fields)
+
+        if values["policy"] not in (1, 2, 3):
+            raise ValueError("policy must be 1, 2 or 3")
+        for key in ("xy_size", "end_time") + _COUNTS:
+            if not isinstance(values[key], int) or isinstance(values[key], bool):
+                raise ValueError("{} must be an int".format(key))
+        for key in ("xy_size",) + _COUNTS:
+            if values[key] < 1:
+                raise ValueError("{} must be at least 1".format(key))
+        if values["end_time"] < 0:
+            raise ValueError("end_time can not be negative")
+        for key in ("lethal_radius", "sensor_range", "sensor_max_step_size", "lethal_max_step_size"):
+            if not isinstance(values[key], (int, float)) or not values[key] > 0:
+                raise ValueError("{} must be a positive number".format(key))
+        for key in ("combatant_ratio", "prior"):
+            if not isinstance(values[key], (int, float)) or not (0 <= values[key] <= 1):
+                raise ValueError("{} must be a number in [0, 1]".format(key))
+
+        self.__dict__.update(values)
+
+    def __repr__(self):
+        return "ScenarioSpec({})".format(", ".join("{}={!r}".format(k, v) for k, v in self.toDict().items()))
+
+    def __eq__(self, other):
+        return isinstance(other, ScenarioSpec) and self.toDict() == other.toDict()
+
+    @property
+    def num_agents(self):
+        """Total number of agents of all kinds"""
+        return sum(getattr(self, key) for key in _COUNTS)
+
+    def toDict(self):
+        """
+        :return: dict of every field, can be passed back to ScenarioSpec(**d) or written to a file
+        """
+        return {key: getattr(self, key) for key in DEFAULTS}
+
+    def replace(self, **fields):
+        """
+        :return: a new spec with some fields changed
+        """
+        return ScenarioSpec(**dict(self.toDict(), **fields))
+
+    def scaled(self, factor):
+        """
+        The same scenario with factor times as many agents of every kind, on a map with factor times the area so the
+        agent density stays the same
+        :param factor: positive int
+        :return: ScenarioSpec
+        """
+        fields = {key: getattr(self, key)*factor for key in _COUNTS}
+        fields["xy_size"] = max(int(round(self.xy_size*factor**0.5)), 1)
+        if self.name is not None:
+            fields["name"] = "{}_x{}".format(self.name, factor)
+        return self.replace(**fields)
+
+
+def preset(name):
+    """
+    :param name: name from PRESETS, or a scenario number 1, 2 or 3
+    :return: ScenarioSpec
+    :raises: ValueError if there is no such preset
+    """
+    name = SCENARIO_NUMBERS.get(name, name)
+    if not isinstance(name, str) or name not in PRESETS:
+        raise ValueError("Scenario number not recognized" if isinstance(name, int) else
+                         "unknown scenario preset {!r}".format(name))
+    return ScenarioSpec(name=name, **PRESETS[name])
+
+
+def loadScenario(filename):
+    """
+    Reads a spec from a .json, .toml, .yaml or .yml file
+    :param filename: path of the file
+    :return: ScenarioSpec
+    :raises: ValueError for unsupported file types or invalid contents, ImportError when the parser for the file
+             type is not installed (PyYAML for YAML, tomli for TOML before Python 3.11)
+    """
+    extension = path.splitext(filename)[1].lower()
+    if extension == ".json":
+        with open(filename) as f:
+            data = json.load(f)
+    elif extension == ".toml":
+        try:
+            import tomllib
+        except ImportError:
+            import tomli as tomllib
+        with open(filename, "rb") as f:
+            data = tomllib.load(f)
+    elif extension in (".yaml", ".yml"):
+        import yaml
+        with open(filename) as f:
+            data = yaml.safe_load(f)
+    else:
+        raise ValueError("unsupported scenario file type {!r}".format(extension))
+
+    if not isinstance(data, dict):
+        raise ValueError("{} does not hold a mapping of scenario keys".format(filename))
+    data.setdefault("name", path.splitext(path.basename(filename))[0])
+    return ScenarioSpec(**data)
+
+
+def scenarioSpec(scenario):
+    """
+    Turns anything the simulators accept as a scenario into a ScenarioSpec
+    :param scenario: ScenarioSpec, scenario number, preset name, name of a spec file, or a string of a number
+    :return: ScenarioSpec
+    """
+    if isinstance(scenario, ScenarioSpec):
+        return scenario
+    if isinstance(scenario, str):
+        if scenario.isdigit():
+            return preset(int(scenario))
+        if scenario not in PRESETS and path.splitext(scenario)[1]:
+            return loadScenario(scenario)
+    return preset(scenario)
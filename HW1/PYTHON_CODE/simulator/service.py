@@ -0,0 +1,457 @@
+"""
+Local simulation service: one long-lived process that takes experiment jobs over HTTP/JSON, runs them on a shared
+pool of worker processes and streams progress back as server-sent events. Nothing but the standard library and the
+simulator is needed, and the workers stay warm between jobs.
+
+    python -m simulator.service --port 8599 --workers 8
+
+    POST   /jobs              {"scenario": 3, "taus": [0.5, 0.9], "greedy": false, "trials": 100000, "seed": 1}
+                              -> 202 and the job, with its "id"
+    GET    /jobs              -> every job and its state
+    GET    /jobs/<id>         -> one job, with the aggregates so far
+    GET    /jobs/<id>/events  -> text/event-stream of "progress" events, ending with one "done", "cancelled" or
+                                 "failed" event. Events from before the connection are replayed first
+    DELETE /jobs/<id>         -> cancels a queued or running job
+
+    curl -N localhost:8599/jobs/1/events
+
+A job may also give "chunk_size", "sensor_policy" and "lethal_policy" (see runner.py and policies.py), and "scenario"
+takes anything scenarioSpec() does. Jobs run one after the other by default (--max-jobs) and every job keeps all
+workers busy. Trials are seeded the way runTrials() seeds them, so the result of a job for a tau is the same as
+runTrials(scenario, tau, trials, seed=seed, chunk_size=chunk_size) with the seed the job reports. With --cache, the
+chunks of a job that an earlier job or runTrials() already ran are taken from the cache instead of the workers.
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import signal
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from .cache import ResultCache, chunkKey
+from .policies import ROLES, getPolicy
+from .runner import DEFAULT_CHUNK_SIZE, RESULT_COLUMNS, RunningStats, _chunkSizes, _runChunk
+from .scenario import scenarioSpec
+
+MAX_BODY = 1 << 20
+
+FINAL_STATES = ("done", "cancelled", "failed")
+
+_REASONS = {200: "OK", 202: "Accepted", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+            413: "Payload Too Large", 500: "Internal Server Error"}
+
+
+def parseJob(data):
+    """
+    Checks a job submitted as JSON and fills in the defaults
+    :param data: dict decoded from the request body
+    :return: dict with scenario (ScenarioSpec), taus, greedy, trials, seed, chunk_size, sensor_policy, lethal_policy
+    :raises: ValueError for anything that is missing or invalid
+    """
+    if not isinstance(data, dict):
+        raise ValueError("a job is a JSON object")
+    unknown = set(data) - {"scenario", "tau", "taus", "greedy", "trials", "seed", "chunk_size", "sensor_policy",
+                           "lethal_policy"}
+    if unknown:
+        raise ValueError("unknown job keys: {}".format(", ".join(sorted(unknown))))
+
+    try:
+        scenario = scenarioSpec(data.get("scenario", 1))
+    except (ValueError, TypeError, OSError) as e:
+        raise ValueError("scenario: {}".format(e))
+    taus = data.get("taus", data.get("tau", 0.9))
+    taus = taus if isinstance(taus, list) else [taus]
+    if not taus or not all(isinstance(t, (int, float)) and not isinstance(t, bool) and 0 <= t <= 1 for t in taus):
+        raise ValueError("taus must be a non-empty list of numbers in [0, 1]")
+    job = {"scenario": scenario, "taus": [float(t) for t in taus], "greedy": data.get("greedy", True),
+           "trials": data.get("trials", 100), "seed": data.get("seed"),
+           "chunk_size": data.get("chunk_size", DEFAULT_CHUNK_SIZE),
+           "sensor_policy": data.get("sensor_policy"), "lethal_policy": data.get("lethal_policy")}
+    if not isinstance(job["greedy"], bool):
+        raise ValueError("greedy must be true or false")
+    for key in ("trials", "chunk_size"):
+        if not isinstance(job[key], int) or isinstance(job[key], bool) or job[key] < 1:
+            raise ValueError("{} must be a positive int".format(key))
+    seed = job["seed"]
+    if seed is not None and (not isinstance(seed, int) or isinstance(seed, bool) or seed < 0):
+        raise ValueError("seed must be a non-negative int")
+    for role in ROLES:
+        if job[role + "_policy"] is not None:
+            getPolicy(role, job[role + "_policy"])  # ValueError for unknown names
+    return job
+
+
+def _number(value):
+    value = float(value)
+    return None if np.isnan(value) else value  # NaN is not valid JSON
+
+
+def aggregates(tau, stats):
+    """
+    :return: JSON-ready summary of the RunningStats of one tau
+    """
+    mean = stats.mean if stats.count else np.full(len(RESULT_COLUMNS), np.nan)
+    return {"tau": tau, "trials": stats.count,
+            "mean": dict(zip(RESULT_COLUMNS, map(_number, mean))),
+            "std_error": dict(zip(RESULT_COLUMNS, map(_number, stats.std_error)))}
+
+
+class Job:
+    def __init__(self, job_id, spec):
+        """
+        A submitted experiment, its progress and the events streamed about it
+        :param job_id: id string
+        :param spec: dict from parseJob()
+        """
+        self.id = job_id
+        self.spec = spec
+        self.state = "queued"
+        self.error = None
+        self.seed = np.random.SeedSequence(spec["seed"]).entropy  # reported, so a job without seed can be repeated
+        self.stats = [RunningStats() for _ in spec["taus"]]
+        self.events = []
+        self.task = None
+        self._listeners = set()
+
+    @property
+    def total_trials(self):
+        return self.spec["trials"]*len(self.spec["taus"])
+
+    def summary(self):
+        """
+        :return: JSON-ready description of the job and its results so far
+        """
+        spec = self.spec
+        return {"id": self.id, "state": self.state, "error": self.error,
+                "scenario": spec["scenario"].toDict(), "taus": spec["taus"], "greedy": spec["greedy"],
+                "trials": spec["trials"], "seed": self.seed, "chunk_size": spec["chunk_size"],
+                "sensor_policy": spec["sensor_policy"], "lethal_policy": spec["lethal_policy"],
+                "completed_trials": sum(s.count for s in self.stats), "total_trials": self.total_trials,
+                "results": [aggregates(tau, s) for tau, s in zip(spec["taus"], self.stats)]}
+
+    def publish(self, event):
+        """
+        Records an event and hands it to every open event stream
+        :param event: event name, the data is the current summary()
+        :return: None
+        """
+        message = (event, self.summary())
+        self.events.append(message)
+        for listener in self._listeners:
+            listener.put_nowait(message)
+
+    def listen(self):
+        """
+        :return: asyncio.Queue that gets every event published from now on
+        """
+        queue = asyncio.Queue()
+        self._listeners.add(queue)
+        return queue
+
+    def unlisten(self, queue):
+        self._listeners.discard(queue)
+
+
+class SimulationService:
+    def __init__(self, workers=None, max_jobs=1, cache=None):
+        """
+        :param workers: number of worker processes shared by all jobs, defaults to the number of cpus
+        :param max_jobs: number of jobs that run at the same time, the others wait in a queue
+        :param cache: ResultCache or the file name of one, to take the chunks of jobs from, see cache.py
+        """
+        self.workers = workers or os.cpu_count() or 1
+        self.max_jobs = max_jobs
+        self.cache = ResultCache(cache) if isinstance(cache, (str, os.PathLike)) else cache
+        self.jobs = {}
+        self.pool = None
+        self.queue = None
+        self._next_id = 1
+        self._schedulers = []
+
+    async def start(self, host="127.0.0.1", port=8599):
+        """
+        Starts the worker processes, the job schedulers and the HTTP server
+        :return: asyncio.Server
+        """
+        # workers forked from this process would inherit the listening socket and keep the port after it exits
+        method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+        self.pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context(method))
+        self.queue = asyncio.Queue()
+        self._schedulers = [asyncio.create_task(self._schedule()) for _ in range(self.max_jobs)]
+        return await asyncio.start_server(self.handle, host, port)
+
+    def close(self):
+        """
+        Cancels every job and lets the workers exit once their current chunk is done
+        :return: None
+        """
+        for scheduler in self._schedulers:
+            scheduler.cancel()
+        for job in self.jobs.values():
+            if job.task is not None:
+                job.task.cancel()
+        if self.pool is not None:
+            self.pool.shutdown(wait=False, cancel_futures=True)
+
+    def submit(self, data):
+        """
+        :param data: job as decoded from JSON
+        :return: the queued Job
+        :raises: ValueError for invalid jobs
+        """
+        job = Job(str(self._next_id), parseJob(data))
+        self._next_id += 1
+        self.jobs[job.id] = job
+        self.queue.put_nowait(job)
+        job.publish("queued")
+        return job
+
+    async def cancel(self, job):
+        """
+        Cancels a job. Chunks that a worker already started still finish, but their results are dropped
+        :return: None
+        """
+        if job.state in FINAL_STATES:
+            return
+        if job.task is not None:
+            task = job.task
+            task.cancel()
+            await asyncio.wait({task})
+        if job.state not in FINAL_STATES:
+            # queued, or its task was cancelled before runJob() got to run at all
+            job.state = "cancelled"
+            job.publish("cancelled")
+
+    async def _schedule(self):
+        while True:
+            job = await self.queue.get()
+            if job.state != "queued":
+                continue
+            job.task = asyncio.create_task(self.runJob(job))
+            try:
+                await asyncio.wait({job.task})
+            finally:
+                job.task = None
+
+    async def runJob(self, job):
+        """
+        Runs the chunks of all taus of a job on the pool, at most two per worker in flight, and folds every tau's
+        chunks in chunk order like runTrials() does
+        :return: None
+        """
+        loop = asyncio.get_running_loop()
+        pending = {}
+        try:
+            spec = job.spec
+            policies = (spec["sensor_policy"], spec["lethal_policy"])
+            sizes = _chunkSizes(spec["trials"], spec["chunk_size"])
+            chunks = []
+            cached = {}  # (tau id, chunk id) -> RunningStats of the chunks found in the cache
+            for tau_id, tau in enumerate(spec["taus"]):
+                seeds = np.random.SeedSequence(job.seed).spawn(len(sizes))
+                for chunk_id, (size, seed) in enumerate(zip(sizes, seeds)):
+                    key = None
+                    if self.cache is not None:
+                        key = chunkKey(spec["scenario"], tau, spec["greedy"], policies, seed, size)
+                        # SQLite calls go to a thread, a slow disk would hold up every connection of the loop
+                        values = await loop.run_in_executor(None, self.cache.get, key)
+                        if values is not None:
+                            cached[tau_id, chunk_id] = RunningStats.fromArray(values)
+                            continue
+                    chunks.append((tau_id, chunk_id, tau, size, seed, key))
+
+            job.state = "running"
+            job.publish("running")
+            finished = {}
+            next_fold = [0]*len(spec["taus"])
+            while True:
+                folded = False
+                for tau_id in range(len(spec["taus"])):
+                    while (tau_id, next_fold[tau_id]) in finished or (tau_id, next_fold[tau_id]) in cached:
+                        chunk_id = (tau_id, next_fold[tau_id])
+                        job.stats[tau_id].merge(finished.pop(chunk_id) if chunk_id in finished
+                                                else cached.pop(chunk_id))
+                        next_fold[tau_id] += 1
+                        folded = True
+                if folded:
+                    job.publish("progress")
+                if not chunks and not pending:
+                    break
+                while chunks and len(pending) + len(finished) < 2*self.workers:
+                    tau_id, chunk_id, tau, size, seed, key = chunks.pop(0)
+                    future = loop.run_in_executor(self.pool, _runChunk, spec["scenario"], tau, size, spec["greedy"],
+                                                  seed, policies)
+                    pending[future] = (tau_id, chunk_id, key)
+                done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for future in done:
+                    tau_id, chunk_id, key = pending.pop(future)
+                    chunk = RunningStats()
+                    chunk.update(future.result())
+                    if key is not None:
+                        await loop.run_in_executor(None, self.cache.put, key, chunk.toArray())
+                    finished[tau_id, chunk_id] = chunk
+        except asyncio.CancelledError:
+            for future in pending:
+                future.cancel()
+            job.state = "cancelled"
+            job.publish("cancelled")
+            return
+        except Exception as e:
+            for future in pending:
+                future.cancel()
+            job.state = "failed"
+            job.error = "{}: {}".format(type(e).__name__, e)
+            job.publish("failed")
+            return
+        job.state = "done"
+        job.publish("done")
+
+    async def handle(self, reader, writer):
+        """
+        Serves one HTTP request, the connection is closed afterwards
+        """
+        try:
+            try:
+                request = await self._readRequest(reader)
+            except ValueError as e:
+                return await _respond(writer, 400, {"error": str(e)})
+            if request is None:
+                return
+            method, path, body = request
+            await self._route(method, path, body, writer)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    @staticmethod
+    async def _readRequest(reader):
+        """
+        :return: (method, path, body), body None if it is too large, or None if the client sent nothing
+        :raises: ValueError for a malformed request line or Content-Length
+        """
+        line = await reader.readline()
+        if not line:
+            return None
+        tokens = line.decode("latin-1").split()
+        if len(tokens) < 2:
+            raise ValueError("malformed request line")
+        method, target = tokens[:2]
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+        path = target.split("?")[0].rstrip("/") or "/"
+        try:
+            length = int(headers.get("content-length", 0))
+        except ValueError:
+            raise ValueError("Content-Length must be an int") from None
+        if length < 0:
+            raise ValueError("Content-Length can not be negative")
+        if length > MAX_BODY:
+            return method, path, None
+        body = await reader.readexactly(length) if length else b""
+        return method, path, body
+
+    async def _route(self, method, path, body, writer):
+        parts = path.strip("/").split("/")
+        if parts[0] != "jobs" or len(parts) > 3 or (len(parts) == 3 and parts[2] != "events"):
+            return await _respond(writer, 404, {"error": "no such resource"})
+
+        if len(parts) == 1:
+            if method == "GET":
+                return await _respond(writer, 200, [job.summary() for job in self.jobs.values()])
+            if method != "POST":
+                return await _respond(writer, 405, {"error": "use GET or POST"})
+            if body is None:
+                return await _respond(writer, 413, {"error": "request body too large"})
+            try:
+                job = self.submit(json.loads(body or b"{}"))
+            except ValueError as e:
+                return await _respond(writer, 400, {"error": str(e)})
+            return await _respond(writer, 202, job.summary())
+
+        job = self.jobs.get(parts[1])
+        if job is None:
+            return await _respond(writer, 404, {"error": "no such job"})
+        if len(parts) == 3:
+            if method != "GET":
+                return await _respond(writer, 405, {"error": "use GET"})
+            return await self._stream(job, writer)
+        if method == "GET":
+            return await _respond(writer, 200, job.summary())
+        if method == "DELETE":
+            await self.cancel(job)
+            return await _respond(writer, 200, job.summary())
+        return await _respond(writer, 405, {"error": "use GET or DELETE"})
+
+    @staticmethod
+    async def _stream(job, writer):
+        """
+        Server-sent events of a job until it reaches a final state
+        """
+        queue = job.listen()
+        try:
+            writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\nCache-Control: no-cache\r\n"
+                         b"Connection: close\r\n\r\n")
+            history = list(job.events)
+            for event, data in history:
+                await _sendEvent(writer, event, data)
+            event = history[-1][0] if history else None
+            while event not in FINAL_STATES:
+                event, data = await queue.get()
+                await _sendEvent(writer, event, data)
+        finally:
+            job.unlisten(queue)
+
+
+async def _sendEvent(writer, event, data):
+    writer.write("event: {}\ndata: {}\n\n".format(event, json.dumps(data)).encode())
+    await writer.drain()
+
+
+async def _respond(writer, status, data):
+    body = json.dumps(data).encode()
+    writer.write("HTTP/1.1 {} {}\r\nContent-Type: application/json\r\nContent-Length: {}\r\nConnection: close\r\n\r\n"
+                 .format(status, _REASONS[status], len(body)).encode() + body)
+    await writer.drain()
+
+
+async def serve(host, port, workers=None, max_jobs=1, cache=None):
+    """
+    Runs the service until cancelled
+    :return: None
+    """
+    service = SimulationService(workers, max_jobs, cache)
+    server = await service.start(host, port)
+    asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel)
+    print("Simulation service on http://{}:{} with {} workers".format(host, port, service.workers), flush=True)
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        service.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve simulation jobs over HTTP, see the module docstring")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8599)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--max-jobs", type=int, default=1, help="number of jobs that run at the same time")
+    parser.add_argument("--cache", help="SQLite file of cached results, see cache.py")
+    args = parser.parse_args(argv)
+    try:
+        asyncio.run(serve(args.host, args.port, args.workers, args.max_jobs, args.cache))
+    except (KeyboardInterrupt, asyncio.CancelledError):
+        pass
+
+
+if __name__ == '__main__':
+    main()
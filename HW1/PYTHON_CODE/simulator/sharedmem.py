@@ -0,0 +1,95 @@
+"""
+numpy arrays in multiprocessing.shared_memory blocks, so worker processes can write their results where the parent
+reads them instead of sending them back through the pool's pipes.
+
+A SharedArray pickles as the name of its block, so passing one to pool.submit() only sends a few bytes, and the
+worker attaches to the same memory (once per process, the attachments are kept). The process that created the block
+owns it and has to unlink() it when done:
+
+    out = SharedArray((n_chunks, chunk_size, 6), np.int64)
+    pool.submit(work, out, i)       # the worker writes out.array[i]
+    ...                             # the parent reads out.array[i] in place
+    out.unlink()
+"""
+import sys
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+
+# Python 3.13 can attach to a block without registering it with the resource tracker
+_TRACK_ARGUMENT = sys.version_info >= (3, 13)
+
+# blocks attached to in this process, by name, so workers attach once and not for every task. Only the latest few
+# are kept, the blocks of finished runs are closed again
+_attached = {}
+MAX_ATTACHED = 4
+
+
+class SharedArray:
+    def __init__(self, shape, dtype, name=None, tracker=None):
+        """
+        :param shape: shape of the array
+        :param dtype: numpy dtype of the array
+        :param name: name of an existing block to attach to, None creates a new zeroed block owned by this object
+        :param tracker: pid of the resource tracker of the process that created the block, when attaching
+        """
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        size = max(int(np.prod(self.shape))*self.dtype.itemsize, 1)
+        self.owner = name is None
+        if self.owner:
+            self._block = shared_memory.SharedMemory(create=True, size=size)
+        elif name in _attached:
+            self._block = _attached[name]
+        else:
+            self._block = _attached[name] = _attach(name, tracker)
+            while len(_attached) > MAX_ATTACHED:
+                _attached.pop(next(iter(_attached))).close()
+        self.name = self._block.name
+        self.tracker = _trackerPid() if self.owner else tracker
+        self.array = np.ndarray(self.shape, dtype=self.dtype, buffer=self._block.buf)
+
+    def __reduce__(self):
+        return SharedArray, (self.shape, self.dtype.str, self.name, self.tracker)
+
+    def unlink(self):
+        """
+        Frees the block, call once in the process that created it when no one uses it any more. The array must not
+        be used afterwards
+        :return: None
+        """
+        if not self.owner:
+            raise ValueError("only the process that created a shared array can unlink it")
+        self.array = None
+        self._block.close()
+        self._block.unlink()
+
+
+def _attach(name, tracker):
+    """
+    Attaches to an existing block. Before Python 3.13 attaching registers the block with the resource tracker of this
+    process, which unlinks it when the process exits. Workers started after the creating process started its tracker
+    share that one (forked ones know its pid, spawned ones none), but workers of a pool that was running before launch
+    their own, and the block is taken off it again
+    :param name: name of the block
+    :param tracker: pid of the resource tracker of the process that created it
+    :return: SharedMemory
+    """
+    if _TRACK_ARGUMENT:
+        return shared_memory.SharedMemory(name=name, track=False)
+    block = shared_memory.SharedMemory(name=name)
+    own_tracker = _trackerPid()
+    if own_tracker is not None and own_tracker != tracker:
+        resource_tracker.unregister(block._name, "shared_memory")
+    return block
+
+
+def _trackerPid():
+    """
+    :return: pid of the resource tracker of this process, None if it has none or from Python 3.13 on, where it is not
+             needed. Before 3.13 there is no public way to get it, a different layout of the private one also gives
+             None, and the block then stays registered like it does in spawned workers
+    """
+    if _TRACK_ARGUMENT:
+        return None
+    return getattr(getattr(resource_tracker, "_resource_tracker", None), "_pid", None)
@@ -20,713 +20,344 @@ Display parameters:
     c_human: default blue, human warfighter
     c_unknown: default black, unknown (civialian or enemy)
 """
+import copy
 import numpy as np
-from random import random
-import matplotlib.pyplot as plt
-from matplotlib.lines import Line2D
-from os import path
 import math
 
+from .agents import AgentGroup, FIELDS, groupAttribute
+from .distances import DistanceCache
+from .estimation import updateEstimates, outcomeDecided
+from .metrics import runPhase
+from .policies import WorldView, defaultPolicy, getPolicy
+from .spatial import UniformGrid
+from .scenario import scenarioSpec
+from .snapshot import packState, unpackState, rngState, rngFromState
+
+# the agent groups of a simulation, the state snapshot() saves besides the estimates and the random generator
+GROUPS = ("sensors", "lethals", "humans", "unknowns")
+
+
 class Simulator:
-    def __init__(self, scenario, tau, displayOn=False, output_img_dir="", greedy=True):
+    # the agent state lives in AgentGroups, these are the names the policies and tools use for it
+    sensor_loc = groupAttribute("sensors", "pos")
+    lethal_loc = groupAttribute("lethals", "pos")
+    human_loc = groupAttribute("humans", "pos")
+    human_alive = groupAttribute("humans", "alive")
+    human_goal = groupAttribute("humans", "goal")
+    unknown_loc = groupAttribute("unknowns", "pos")
+    unknown_alive = groupAttribute("unknowns", "alive")
+    unknown_goal = groupAttribute("unknowns", "goal")
+    unknown_is_combatant = groupAttribute("unknowns", "is_combatant")
+
+    def __init__(self, scenario, tau, displayOn=False, output_img_dir="", greedy=True, spatial_index=False, seed=None,
+                 rng=None, frame_writer=None, trajectory=None, sensor_policy=None, lethal_policy=None,
+                 early_stop=True, metrics=None):
         """
         Simulation class used for this assignment. The main method to call is .run(), which executes all the functions
         in the correct order. This assignment has you place code in four different functions, boldly noted with an
         all-caps TODO YOUR CODE HERE
 
-        :param scenario: int, should be 1 2 or 3. Will throw a ValueError if not one of those values
+        :param scenario: int, should be 1 2 or 3. Will throw a ValueError if not one of those values. Can also be a
+                         ScenarioSpec, a preset name or a scenario file, see scenario.py
         :param tau: the classification threshold for
-        :param displayOn: whether or not to render the images and save them to disk. (SLOW)
+        :param displayOn: whether or not to render the images and save them to disk
         :param output_img_dir: to save images in an optional folder, to make the displaying easier and less messy
-        """
+        :param greedy: use the greedy sensor/lethal policies instead of the per-scenario ones
+        :param spatial_index: answer the range and closest-agent queries of the update functions with a uniform grid
+                              instead of scanning all pairs. Same results, scales better with many agents
+        :param seed: seed for the random generator of this simulation, anything np.random.default_rng() accepts
+        :param rng: a numpy.random.Generator to draw from instead, can not be combined with seed
+        :param frame_writer: where the rendered frames go when displayOn is set, e.g. a FFmpegWriter, GIFWriter or
+                             FrameRingBuffer from recording.py. Defaults to one PNG file per timestep in output_img_dir
+        :param trajectory: a TrajectoryRecorder that run() records every tick into
+        :param sensor_policy: name of a registered sensor policy or a policy function, see policies.py. Defaults to
+                              the one greedy and the scenario stand for
+        :param lethal_policy: the same for the lethal robots
+        :param early_stop: end the episode as soon as nothing can change the kill counts any more, see
+                           estimation.outcomeDecided(). The statistics are the same, there are just fewer ticks (and
+                           frames). termination_tick tells how many ran
+        :param metrics: a SimulationMetrics that run() times the phases of every tick into and counts measurements,
+                        updates and kills in, with optional pre/post-tick hooks, see metrics.py
+        """
+        spec = scenarioSpec(scenario)
         if not (0 <= tau <= 1):
             raise ValueError("tau must be a float in [0, 1]")
+        if rng is not None and seed is not None:
+            raise ValueError("pass either seed or rng, not both")
+        # every random draw of the simulation comes from this generator
+        self.rng = rng if rng is not None else np.random.default_rng(seed)
+        self.spec = spec
         self.tau = tau
-        self.endTime = 50
+        self.endTime = spec.end_time
         self.displayOn = displayOn
         self.output_img_dir = output_img_dir
+        self.frame_writer = frame_writer
+        self.trajectory = trajectory
+        self.early_stop = early_stop
+        self.metrics = metrics
+        # the next tick run() executes, episodes can be run in parts, see run(until)
+        self.tick = 0
+        # number of ticks run() executed, set by run() once the episode is over
+        self.termination_tick = None
 
         # world parameters
-        self.xy_size = 50
-        self.lethal_radius = 10
-        self.scene = scenario
+        self.xy_size = spec.xy_size
+        self.lethal_radius = spec.lethal_radius
+        self.scene = spec.policy
 
         # agent counts in each category
-        self.num_sensors = 2
-        self.num_lethal = 2
-        self.num_humans = 4
-        self.num_unknown = 4
+        self.num_sensors = spec.num_sensors
+        self.num_lethal = spec.num_lethal
+        self.num_humans = spec.num_humans
+        self.num_unknown = spec.num_unknown
 
         # User defined agent parameters:
-        self.sensor_max_step_size = 2.0
-        self.lethal_max_step_size = 2.0
+        self.sensor_max_step_size = spec.sensor_max_step_size
+        self.lethal_max_step_size = spec.lethal_max_step_size
         self.use_greedy = greedy
-        self.sensor_range = 10.0
+        self.sensor_policy = getPolicy("sensor", sensor_policy or defaultPolicy(greedy, self.scene))
+        self.lethal_policy = getPolicy("lethal", lethal_policy or defaultPolicy(greedy, self.scene))
+        self.sensor_range = spec.sensor_range
+        self.spatial_index = spatial_index
 
         # starting locations
-        self.sensor_loc = np.random.randint(0, self.xy_size, [self.num_sensors, 2])
-        self.lethal_loc = np.random.randint(0, self.xy_size, [self.num_lethal, 2])
-        self.human_loc = np.random.randint(0, self.xy_size, [self.num_humans, 2])
-        self.unknown_loc = np.random.randint(0, self.xy_size, [self.num_unknown, 2])
-
-        # is each warfighter alive (bool)
-        self.human_alive = np.full(self.num_humans, True)
+        sensor_loc = self.rng.integers(0, self.xy_size, [self.num_sensors, 2])
+        lethal_loc = self.rng.integers(0, self.xy_size, [self.num_lethal, 2])
+        human_loc = self.rng.integers(0, self.xy_size, [self.num_humans, 2])
+        unknown_loc = self.rng.integers(0, self.xy_size, [self.num_unknown, 2])
 
         # create random goal locations for each human to reach
-        self.human_goal = np.random.randint(0, self.xy_size, [self.num_humans, 2])
-
-        # create the initial maximally uninformed prior for each certainty of combatant
-        # could change this based on the scenario if you wanted to
-        if scenario == 1:
-            self.unknown_estimates = np.full(self.num_unknown, 0.5)
-        elif scenario == 2:
-            self.unknown_estimates = np.full(self.num_unknown, 0.5)
-        else:
-            self.unknown_estimates = np.full(self.num_unknown, 0.5)
-
-        # Set the ground truth for each scenario
-        self.unknown_ground_truth = [None]*self.num_unknown
-        # Peacekeeping, 10% combatants
-        if scenario == 1:
-            for i in range(self.num_unknown):
-                if random() > 0.1:
-                    self.unknown_ground_truth[i] = "civilian"
-                else:
-                    self.unknown_ground_truth[i] = "combatant"
+        human_goal = self.rng.integers(0, self.xy_size, [self.num_humans, 2])
 
-        # Guerrilla forces, 30% combatants
-        elif scenario == 2:
-            for i in range(self.num_unknown):
-                if random() > 0.3:
-                    self.unknown_ground_truth[i] = "civilian"
-                else:
-                    self.unknown_ground_truth[i] = "combatant"
+        # create the initial prior for each certainty of combatant, maximally uninformed (0.5) unless the scenario
+        # says otherwise
+        self.unknown_estimates = np.full(self.num_unknown, float(spec.prior))
 
-        # Active war zone, 80% combatants
-        elif scenario == 3:
-            for i in range(self.num_unknown):
-                if random() > 0.8:
-                    self.unknown_ground_truth[i] = "civilian"
-                else:
-                    self.unknown_ground_truth[i] = "combatant"
+        # Set the ground truth: 10%, 30% and 80% combatants for peacekeeping, guerrilla forces and active war zone
+        draws = self.rng.random(self.num_unknown)
+        combatant_ratio = spec.combatant_ratio
 
-        else:
-            raise(ValueError("Scenario number not recognized"))
+        # lastly, the location goals of the unknowns
+        unknown_goal = self.rng.integers(0, self.xy_size, [self.num_unknown, 2])
+
+        # every agent starts alive
+        self.sensors = AgentGroup(sensor_loc)
+        self.lethals = AgentGroup(lethal_loc)
+        self.humans = AgentGroup(human_loc, goals=human_goal)
+        self.unknowns = AgentGroup(unknown_loc, goals=unknown_goal, is_combatant=~(draws > combatant_ratio))
+
+        # distance matrices between the agent groups, shared by all policies and updates of a tick
+        self.distance_cache = DistanceCache(self)
+
+        # created by the first render_world() call
+        self.renderer = None
 
-        # lastly, set the alive markers for unknowns and their location goals
-        self.unknown_alive = np.full(self.num_unknown, True)
-        self.unknown_goal = np.random.randint(0, self.xy_size, [self.num_unknown, 2])
+    @property
+    def unknown_ground_truth(self):
+        """
+        The ground truth as a list of "combatant" / "civilian" labels, made from unknown_is_combatant
+        """
+        return ["combatant" if c else "civilian" for c in self.unknown_is_combatant]
 
-    def run(self):
+    def run(self, until=None):
         """
-        Main function to call. Executes the simulation for the specified number of timesteps and returns statistics
-        on the number of each category killed and how many of each agent type there was.
+        Main function to call. Executes the simulation for the specified number of timesteps, or until the outcome is
+        decided with early_stop, and returns statistics on the number of each category killed and how many of each
+        agent type there was. The number of ticks that ran is left in termination_tick.
+        :param until: stop before this tick instead, e.g. to snapshot() or fork() the episode there. The next call
+                      continues from it, a call after the episode is over only returns the statistics
         :return: 6-tuple of ints:
                  num_combatants_killed, num_warfighters_killed, num_civilians_killed
                  num_combatants, num_warfighters, num_civilians
-        :raises: ValueError if it somehow finds an unknown label of 'combatant' or 'civilian' in the unknown list.
         """
-        for t in range(self.endTime):
-            pass
-            # update agent locations
+        if self.trajectory is not None and self.tick == 0:
+            self.trajectory.start(self)
+        end = self.endTime if until is None else min(until, self.endTime)
+        metrics = self.metrics
+        phase = runPhase if metrics is None else metrics.phase  # times and counts the phases when metrics are on
+        while self.tick < end and self.termination_tick is None:
+            t = self.tick
+            if self.early_stop and self.outcomeDecided():
+                self.termination_tick = t
+                break
 
-            self.updateSensorLocations()
-            self.updateLethalLocations()
-            self.updateHumanLocations()
-            self.updateUnknownLocations()
+            if metrics is not None:
+                metrics.startTick(self, t)
+            # update agent locations
+            phase(self, "sensor_move", self.updateSensorLocations)
+            phase(self, "lethal_move", self.updateLethalLocations)
+            phase(self, "human_move", self.updateHumanLocations)
+            phase(self, "unknown_move", self.updateUnknownLocations)
 
             # update estimates of combatant versus noncombatant
-            self.updateCombatantEstimate()
+            phase(self, "estimate_update", self.updateCombatantEstimate)
 
             # update lethal actions (combatants against humans and lethal robots against combatants)
-            self.updateLethalActions()
+            phase(self, "lethal_actions", self.updateLethalActions)
+
+            if self.trajectory is not None:
+                self.trajectory.record(self, t)
 
             # draw world if display is on
             if self.displayOn:
-                self.render_world(t, self.output_img_dir)
+                phase(self, "render", self.render_world, t, self.output_img_dir)
+
+            if metrics is not None:
+                metrics.endTick(self, t)
+            self.tick = t + 1
+
+        if self.tick == self.endTime:
+            self.termination_tick = self.endTime
+        if self.trajectory is not None:
+            self.trajectory.close()
+        if self.renderer is not None:
+            # wait for the last frames to be written
+            self.renderer.close()
+            self.renderer = None
 
         # print(self.unknown_estimates)
         # print(self.unknown_ground_truth)
 
         # Calculate final statistics for the simulation
-        num_combatants_killed = 0
-        num_civilians_killed = 0
-        num_combatants = 0
-        num_civilians = 0
-        for u in range(self.num_unknown):
-            if self.unknown_ground_truth[u] == "combatant":
-                num_combatants += 1
-                if not self.unknown_alive[u]:
-                    num_combatants_killed += 1
-            elif self.unknown_ground_truth[u] == "civilian":
-                num_civilians += 1
-                if not self.unknown_alive[u]:
-                    num_civilians_killed += 1
-            else:
-                raise ValueError("A value other than 'combatant' or 'civilian' made its way into self.unknown_ground_truth.")
-        num_warfighters_killed = 0
-        for w in range(self.num_humans):
-            if not self.human_alive[w]:
-                num_warfighters_killed += 1
+        combatant = self.unknown_is_combatant
+        dead = ~self.unknown_alive
+        num_combatants = int(np.count_nonzero(combatant))
+        num_civilians = self.num_unknown - num_combatants
+        num_combatants_killed = int(np.count_nonzero(combatant & dead))
+        num_civilians_killed = int(np.count_nonzero(~combatant & dead))
+        num_warfighters_killed = int(np.count_nonzero(~self.human_alive))
 
         return num_combatants_killed, num_warfighters_killed, num_civilians_killed, \
                num_combatants, self.num_humans, num_civilians
 
+    def snapshot(self):
+        """
+        The state of the episode: the locations, goals, alive masks and ground truth of the agents, the estimates, the
+        tick and the random generator, see snapshot.py. The scenario, tau and policies are not part of it
+        :return: bytes for restore() and fork()
+        """
+        arrays = {}
+        for group in GROUPS:
+            agents = getattr(self, group)
+            for field in FIELDS:
+                if getattr(agents, field) is not None:
+                    arrays[group + "." + field] = getattr(agents, field)
+        arrays["unknown_estimates"] = self.unknown_estimates
+        meta = {"tick": self.tick, "termination_tick": self.termination_tick, "rng": rngState(self.rng)}
+        return packState(meta, arrays)
+
+    def restore(self, snapshot):
+        """
+        Puts the episode back into the state of a snapshot, run() then continues from its tick with the random
+        stream the snapshot had. The arrays are copied, the snapshot can be restored any number of times
+        :param snapshot: bytes from snapshot() of a simulation of the same scenario
+        :raises: ValueError if the snapshot does not fit this simulation
+        """
+        meta, record = unpackState(snapshot)
+        names = set(record.dtype.names)
+        groups = {}
+        for group in GROUPS:
+            agents = AgentGroup.__new__(AgentGroup)
+            for field in FIELDS:
+                name = group + "." + field
+                current = getattr(getattr(self, group), field)
+                if (name in names) != (current is not None) or (current is not None and
+                                                                 record[name].shape != current.shape):
+                    raise ValueError("the snapshot is of a simulation with other agents")
+                setattr(agents, field, None if current is None else record[name].copy())
+            groups[group] = agents
+        if record["unknown_estimates"].shape != self.unknown_estimates.shape:
+            raise ValueError("the snapshot is of a simulation with other agents")
+
+        for group, agents in groups.items():
+            setattr(self, group, agents)
+        self.unknown_estimates = record["unknown_estimates"].copy()
+        self.tick = meta["tick"]
+        self.termination_tick = meta["termination_tick"]
+        # a new generator, so one that was passed in as rng= is left alone
+        self.rng = rngFromState(meta["rng"])
+        self.distance_cache.clear()
+
+    def fork(self, n, seed=None, sensor_policy=None, lethal_policy=None):
+        """
+        Clones the episode in its current state into n branches that continue with their own random streams, e.g.
+        to run a shared prefix once and then compare policies over many continuations. The branches do not render,
+        record trajectories or collect metrics, those can be set on them. This simulation is not changed
+        :param n: number of branches
+        :param seed: seed for the SeedSequence the branches' streams are spawned from, None for fresh entropy
+        :param sensor_policy: name of a registered sensor policy or a policy function for the branches, see
+                              policies.py. Defaults to the one of this simulation
+        :param lethal_policy: the same for the lethal robots
+        :return: list of n Simulator
+        """
+        if n < 1:
+            raise ValueError("n must be a positive int")
+        state = self.snapshot()
+        branches = []
+        for seed_seq in np.random.SeedSequence(seed).spawn(n):
+            branch = copy.copy(self)
+            branch.distance_cache = DistanceCache(branch)
+            branch.restore(state)
+            branch.rng = np.random.default_rng(seed_seq)
+            branch.displayOn = False
+            branch.renderer = None
+            branch.frame_writer = None
+            branch.trajectory = None
+            branch.metrics = None
+            if sensor_policy is not None:
+                branch.sensor_policy = getPolicy("sensor", sensor_policy)
+            if lethal_policy is not None:
+                branch.lethal_policy = getPolicy("lethal", lethal_policy)
+            branches.append(branch)
+        return branches
+
+    def outcomeDecided(self):
+        """
+        :return: True once no kill can happen any more, see estimation.outcomeDecided()
+        """
+        return bool(outcomeDecided(self.unknown_alive, self.unknown_is_combatant, self.human_alive, self.tau,
+                                   self.scene))
+
     def render_world(self, t, output_dir):
         """
-        Creates an image using matplotlib of the current state of the world, which is saved to disk.
+        Creates an image using matplotlib of the current state of the world and hands it to the frame writer, which
+        saves PNG files to disk unless another one was given. The figure is kept between calls and the writer works in
+        the background, run() waits for it at the end of the simulation.
 
         :param t: Which timestep is being recorded, to differentiate the filenames for each frame.
         :param ouput_dir: joined with the filename to create the full path to save images.
         :return: None
         """
-        enemy = ("red", "X")
-        sensor = ("green", '^')
-        lethal = ("purple", "v")
-        human = ("blue", 'o')
-        unknown = ("black", 'D')
-        fig = plt.figure()
-        ax = fig.gca()
-        ax.set_xlim([0, self.xy_size])
-        ax.set_ylim([0, self.xy_size])
-
-        ax.scatter(self.sensor_loc[:, 0], self.sensor_loc[:, 1], color=sensor[0], marker=sensor[1], label="Sensor")
-        ax.scatter(self.lethal_loc[:, 0], self.lethal_loc[:, 1], color=lethal[0], marker=lethal[1], label="Lethal")
-        for h in range(self.num_humans):
-            if self.human_alive[h]:
-                ax.scatter(self.human_loc[h, 0], self.human_loc[h, 1], color=human[0], marker=human[1], label='Human Warfighter')
-        for u in range(self.num_unknown):
-            if self.unknown_alive[u]:
-                if self.unknown_estimates[u] > self.tau:
-                    ax.scatter(self.unknown_loc[u, 0], self.unknown_loc[u, 1], color=enemy[0], marker=enemy[1], label="Enemy Combatant")
-                else:
-                    ax.scatter(self.unknown_loc[u, 0], self.unknown_loc[u, 1], color=unknown[0], marker=unknown[1], label="Unknown")
-        # below is some crazy code to make the legend nice
-        legend_elements = [Line2D([0], [0], color='w', markerfacecolor=enemy[0], marker=enemy[1], markersize=10,
-                                  label='Enemy Combatant'),
-                           Line2D([0], [0], color='w', markerfacecolor=sensor[0], marker=sensor[1], markersize=10,
-                                  label='Sensors'),
-                           Line2D([0], [0], color='w', markerfacecolor=lethal[0], marker=lethal[1], markersize=10,
-                                  label='Lethals'),
-                           Line2D([0], [0], color='w', markerfacecolor=human[0], marker=human[1], markersize=10,
-                                  label='Warfighters'),
-                           Line2D([0], [0], color='w', markerfacecolor=unknown[0], marker=unknown[1], markersize=10,
-                                  label='Unknowns')
-                           ]
-        legend = ax.legend(handles=legend_elements, loc='upper center', bbox_to_anchor=(0.5, 1.15), ncol=3)
-        plt.savefig(fname=path.join(output_dir, "frame_{:03}.png".format(t)), bbox='tight', bbox_extra_artists=[legend])
-        plt.close(fig)
-
-
-    def getDistancesForSensors(self, sense_id):
-        """
-        Calculates distances between all objects and sensors for use in policies
-        :param sense_id:
-        :return:
-        """
-        unk_distances = np.zeros(self.num_unknown)  # Unknown to sensor
-        wf_distances = np.zeros(self.num_humans)  # Human to sensor
-        leth_distances = np.zeros(self.num_lethal)  # Lethal to sensor
-        unk_wf_distances = np.zeros((self.num_unknown, self.num_humans))  # Unknown to Human
-
-        x_sense = self.sensor_loc[sense_id, 0]
-        y_sense = self.sensor_loc[sense_id, 1]
-
-        # Distance between unknown and sensor as well as unknowns and warfighters
-        for unk_id in range(self.num_unknown):
-            if self.unknown_alive[unk_id]:
-                x_targ = self.unknown_loc[unk_id, 0]
-                y_targ = self.unknown_loc[unk_id, 1]
-                x_dist = x_targ - x_sense
-                y_dist = y_targ - y_sense
-                unk_distances[unk_id] = math.sqrt((x_dist*x_dist) + (y_dist*y_dist))
-                if unk_distances[unk_id] == 0.0:
-                    unk_distances[unk_id] = 0.1
-
-                for wf_id in range(self.num_humans):
-                    if self.human_alive[wf_id]:
-                        x_hum = self.human_loc[wf_id, 0]
-                        y_hum = self.human_loc[wf_id, 1]
-                        x_dist = x_hum - x_targ
-                        y_dist = y_hum - y_targ
-                        unk_wf_distances[unk_id, wf_id] = math.sqrt((x_dist*x_dist) + (y_dist*y_dist))
-                        if unk_wf_distances[unk_id, wf_id] == 0.0:
-                            unk_wf_distances[unk_id, wf_id] = 0.1
-                    else:
-                        unk_wf_distances[unk_id, wf_id] = 1000.00  # Human is dead
-            else:  # Unknwon is dead
-                unk_distances[unk_id] = 1000.00
-                for wf_id in range(self.num_humans):
-                    unk_wf_distances[unk_id, wf_id] = 1000.00
-
-        # Distance between warfighters and sensor
-        for wf_id in range(self.num_humans):
-            if self.human_alive[wf_id]:
-                x_wf = self.human_loc[wf_id, 0]
-                y_wf = self.human_loc[wf_id, 1]
-                x_dist = x_wf - x_sense
-                y_dist = y_wf - y_sense
-                wf_distances[wf_id] = math.sqrt((x_dist*x_dist) + (y_dist*y_dist))
-                if wf_distances[wf_id] == 0.0:
-                    wf_distances[wf_id] = 0.1
-            else:  # Human is dead
-                wf_distances[wf_id] = 1000.00
-
-        # Distance between lethal robots and sensor
-        for leth_id in range(self.num_sensors):
-            x_leth = self.lethal_loc[leth_id, 0]
-            y_leth = self.lethal_loc[leth_id, 1]
-            x_dist = x_leth - x_sense
-            y_dist = y_leth - y_sense
-            leth_distances[leth_id] = math.sqrt((x_dist*x_dist) + (y_dist*y_dist))
-            if leth_distances[leth_id] == 0.0:
-                leth_distances[leth_id] = 0.1
-
-        return unk_distances, wf_distances, leth_distances, unk_wf_distances
-
-    def sensorGreedyMove(self, sense_id):
-        """
-        Sensor platforms move greedily towards the closest target with uncertainty below threshold
-        :return:
-        """
-        distances = np.zeros(self.num_unknown)
-        x_sens = self.sensor_loc[sense_id, 0]
-        y_sens = self.sensor_loc[sense_id, 1]
-
-        for unk_id in range(self.num_unknown):
-            if self.unknown_alive[unk_id] and self.unknown_estimates[unk_id] <= self.tau:
-                x_unk = self.unknown_loc[unk_id, 0]
-                y_unk = self.unknown_loc[unk_id, 1]
-                x_dist = x_unk - x_sens
-                y_dist = y_unk - y_sens
-                distances[unk_id] = math.sqrt((x_dist*x_dist) + (y_dist*y_dist))
-                if distances[unk_id] == 0.0:
-                    distances[unk_id] = 0.5
-            else:
-                distances[unk_id] = 1000.00
-
-        targ_id = np.argmin(distances)
-        if distances[targ_id] < 1000.0:
-            x_targ = self.unknown_loc[targ_id, 0]
-            y_targ = self.unknown_loc[targ_id, 1]
-            dx = ((x_targ - x_sens) / distances[targ_id])*self.sensor_max_step_size
-            dy = ((y_targ - y_sens) / distances[targ_id])*self.sensor_max_step_size
-            self.sensor_loc[sense_id, 0] += dx
-            self.sensor_loc[sense_id, 1] += dy
+        if self.renderer is None:
+            # matplotlib is only imported once something is rendered, headless runs start without it
+            from .renderer import Renderer
+            from .recording import PNGWriter
 
-    def sensorPolicyS1(self, sense_id):
-        """
-        Sensor platforms move according to policy
-        :return:
-        """
-
-        x_sense = self.sensor_loc[sense_id, 0]
-        y_sense = self.sensor_loc[sense_id, 1]
-        unk_distances, wf_distances, leth_distances, unk_wf_distances = self.getDistancesForSensors(sense_id)
-
-        if sense_id == 0:
-            action_count = 0
-            # Move towards unknown which is closest to a warfighter
-            for unk_id in range(self.num_unknown):
-                absolute_min = np.min(unk_wf_distances)
-                min_dist = np.min(unk_wf_distances[unk_id, :])
-                if min_dist == absolute_min and min_dist < 6.0:  # Move towards unknown if it is close to a warfighter
-                    targ_id = np.argmin(unk_wf_distances[unk_id, :])
-                    x_targ = self.unknown_loc[targ_id, 0]
-                    y_targ = self.unknown_loc[targ_id, 1]
-                    dx = ((x_targ - x_sense) / min_dist) * self.sensor_max_step_size
-                    dy = ((y_targ - y_sense) / min_dist) * self.sensor_max_step_size
-                    self.sensor_loc[sense_id, 0] += dx
-                    self.sensor_loc[sense_id, 1] += dy
-                    action_count += 1
-                    break
-
-            # Move towards closest warfighter
-            min_wf_id = np.argmin(wf_distances)
-            if wf_distances[min_wf_id] < 1000.00 and action_count == 0:
-                x_targ = self.human_loc[min_wf_id, 0]
-                y_targ = self.human_loc[min_wf_id, 1]
-                dx = ((x_targ - x_sense) / wf_distances[min_wf_id]) * self.sensor_max_step_size
-                dy = ((y_targ - y_sense) / wf_distances[min_wf_id]) * self.sensor_max_step_size
-                self.sensor_loc[sense_id, 0] += dx
-                self.sensor_loc[sense_id, 1] += dy
-        else:
-            action_count = 0
-            # Move towards unknown currently suspected of being a combatant
-            for unk_id in range(self.num_unknown):
-                if self.unknown_estimates[unk_id] > self.tau and self.unknown_alive[unk_id]:
-                    x_targ = self.unknown_loc[unk_id, 0]
-                    y_targ = self.unknown_loc[unk_id, 1]
-                    dx = ((x_targ - x_sense) / unk_distances[unk_id]) * self.sensor_max_step_size
-                    dy = ((y_targ - y_sense) / unk_distances[unk_id]) * self.sensor_max_step_size
-                    self.sensor_loc[sense_id, 0] += dx
-                    self.sensor_loc[sense_id, 1] += dy
-                    action_count += 1
-                    break
-
-            # Move towards closest warfighter
-            min_wf_id = np.argmin(wf_distances)
-            if wf_distances[min_wf_id] < 1000.00 and action_count == 0:
-                x_targ = self.human_loc[min_wf_id, 0]
-                y_targ = self.human_loc[min_wf_id, 1]
-                dx = ((x_targ - x_sense) / wf_distances[min_wf_id]) * self.sensor_max_step_size
-                dy = ((y_targ - y_sense) / wf_distances[min_wf_id]) * self.sensor_max_step_size
-                self.sensor_loc[sense_id, 0] += dx
-                self.sensor_loc[sense_id, 1] += dy
-
-    def sensorPolicyS2(self, sense_id):
-        x_sense = self.sensor_loc[sense_id, 0]
-        y_sense = self.sensor_loc[sense_id, 1]
-        unk_distances, wf_distances, leth_distances, unk_wf_distances = self.getDistancesForSensors(sense_id)
-
-        if sense_id == 0:
-            action_count = 0
-            # Move towards unknown which is closest to a warfighter
-            for unk_id in range(self.num_unknown):
-                absolute_min = np.min(unk_wf_distances)
-                min_dist = np.min(unk_wf_distances[unk_id, :])
-                if min_dist == absolute_min and min_dist < 6.0:  # Move towards unknown if it is close to a warfighter
-                    targ_id = np.argmin(unk_wf_distances[unk_id, :])
-                    x_targ = self.unknown_loc[targ_id, 0]
-                    y_targ = self.unknown_loc[targ_id, 1]
-                    dx = ((x_targ - x_sense) / min_dist) * self.sensor_max_step_size
-                    dy = ((y_targ - y_sense) / min_dist) * self.sensor_max_step_size
-                    self.sensor_loc[sense_id, 0] += dx
-                    self.sensor_loc[sense_id, 1] += dy
-                    action_count += 1
-                    break
-
-            # Move towards closest warfighter
-            min_wf_id = np.argmin(wf_distances)
-            if wf_distances[min_wf_id] < 1000.00 and action_count == 0:
-                x_targ = self.human_loc[min_wf_id, 0]
-                y_targ = self.human_loc[min_wf_id, 1]
-                dx = ((x_targ - x_sense) / wf_distances[min_wf_id]) * self.sensor_max_step_size
-                dy = ((y_targ - y_sense) / wf_distances[min_wf_id]) * self.sensor_max_step_size
-                self.sensor_loc[sense_id, 0] += dx
-                self.sensor_loc[sense_id, 1] += dy
-        else:
-            action_count = 0
-            # Move towards unknown currently suspected of being a combatant
-            for unk_id in range(self.num_unknown):
-                if self.unknown_estimates[unk_id] > self.tau and self.unknown_alive[unk_id]:
-                    x_targ = self.unknown_loc[unk_id, 0]
-                    y_targ = self.unknown_loc[unk_id, 1]
-                    dx = ((x_targ - x_sense) / unk_distances[unk_id]) * self.sensor_max_step_size
-                    dy = ((y_targ - y_sense) / unk_distances[unk_id]) * self.sensor_max_step_size
-                    self.sensor_loc[sense_id, 0] += dx
-                    self.sensor_loc[sense_id, 1] += dy
-                    action_count += 1
-                    break
-
-            # Move towards closest warfighter
-            min_wf_id = np.argmin(wf_distances)
-            if wf_distances[min_wf_id] < 1000.00 and action_count == 0:
-                x_targ = self.human_loc[min_wf_id, 0]
-                y_targ = self.human_loc[min_wf_id, 1]
-                dx = ((x_targ - x_sense) / wf_distances[min_wf_id]) * self.sensor_max_step_size
-                dy = ((y_targ - y_sense) / wf_distances[min_wf_id]) * self.sensor_max_step_size
-                self.sensor_loc[sense_id, 0] += dx
-                self.sensor_loc[sense_id, 1] += dy
-
-    def sensorPolicyS3(self, sense_id):
-
-        if sense_id == 0:
-            self.sensorGreedyMove(sense_id)
-        else:
-            x_sense = self.sensor_loc[sense_id, 0]
-            y_sense = self.sensor_loc[sense_id, 1]
-            unk_distances, wf_distances, leth_distances, unk_wf_distances = self.getDistancesForSensors(sense_id)
-
-            action_count = 0
-            for unk_id in range(self.num_unknown):
-                min_unk_wf_dist = np.min(unk_wf_distances[unk_id, :])
-                if min_unk_wf_dist < 10.0:  # Move towards unknown if it is too close to a warfighter
-                    targ_id = np.argmin(unk_wf_distances[unk_id, :])
-                    x_targ = self.unknown_loc[targ_id, 0]
-                    y_targ = self.unknown_loc[targ_id, 1]
-                    dx = ((x_targ - x_sense) / min_unk_wf_dist) * self.sensor_max_step_size
-                    dy = ((y_targ - y_sense) / min_unk_wf_dist) * self.sensor_max_step_size
-                    self.sensor_loc[sense_id, 0] += dx
-                    self.sensor_loc[sense_id, 1] += dy
-                    action_count += 1
-                    break
-                if self.unknown_estimates[unk_id] < self.tau and self.unknown_alive[unk_id] and unk_distances[unk_id] > 10.0:
-                    assert (action_count == 0)
-                    x_targ = self.unknown_loc[unk_id, 0]
-                    y_targ = self.unknown_loc[unk_id, 1]
-                    dx = ((x_targ - x_sense) / unk_distances[unk_id]) * self.sensor_max_step_size
-                    dy = ((y_targ - y_sense) / unk_distances[unk_id]) * self.sensor_max_step_size
-                    self.sensor_loc[sense_id, 0] += dx
-                    self.sensor_loc[sense_id, 1] += dy
-                    action_count += 1
-                    break
-
-            min_wf_id = np.argmin(wf_distances)
-            if wf_distances[min_wf_id] < 1000.00 and action_count == 0:
-                x_targ = self.human_loc[min_wf_id, 0]
-                y_targ = self.human_loc[min_wf_id, 1]
-                dx = ((x_targ - x_sense) / wf_distances[min_wf_id]) * self.sensor_max_step_size
-                dy = ((y_targ - y_sense) / wf_distances[min_wf_id]) * self.sensor_max_step_size
-                self.sensor_loc[sense_id, 0] += dx
-                self.sensor_loc[sense_id, 1] += dy
+            writer = self.frame_writer
+            if writer is None:
+                writer = PNGWriter(output_dir, n_frames=self.endTime)
+            self.renderer = Renderer(self.xy_size, self.tau, writer)
+        self.renderer.draw(self, t)
 
     def updateSensorLocations(self):
         """
         Fill in with algorithm from problem 3c or 3d
-        This function controls how sensor robots move
+        This function controls how sensor robots move, all of them in one call of the sensor policy
         :return:
         """
-
-        for sense_id in range(self.num_sensors):
-            if self.use_greedy:
-                self.sensorGreedyMove(sense_id)
-            elif self.scene == 1:
-                self.sensorPolicyS1(sense_id)
-            elif self.scene == 2:
-                self.sensorPolicyS2(sense_id)
-            else:
-                self.sensorPolicyS3(sense_id)
-
-    def getDistancesForLethals(self, leth_id):
-        """
-        Calculates distances between all objects and lethal robots for use in policies
-        :param leth_id:
-        :return:
-        """
-
-        x_leth = self.lethal_loc[leth_id, 0]
-        y_leth = self.lethal_loc[leth_id, 1]
-        unk_distances = np.zeros(self.num_unknown)  # Unknown to lethal
-        wf_distances = np.zeros(self.num_humans)  # Human to lethal
-        sensor_distances = np.zeros(self.num_sensors)  # Sensor to lethal
-        unk_wf_distances = np.zeros((self.num_unknown, self.num_humans))  # Unknown to Human
-
-        # Distance between unknowns and lethal robots and unknowns and warfighters
-        for unk_id in range(self.num_unknown):
-            if self.unknown_alive[unk_id]:
-                x_targ = self.unknown_loc[unk_id, 0]
-                y_targ = self.unknown_loc[unk_id, 1]
-                x_dist = x_targ - x_leth
-                y_dist = y_targ - y_leth
-                unk_distances[unk_id] = math.sqrt((x_dist*x_dist) + (y_dist*y_dist))
-                if unk_distances[unk_id] == 0.0:
-                    unk_distances[unk_id] = 0.1
-
-                for wf_id in range(self.num_humans):
-                    if self.human_alive[wf_id]:
-                        x_hum = self.human_loc[wf_id, 0]
-                        y_hum = self.human_loc[wf_id, 1]
-                        x_dist = x_hum - x_targ
-                        y_dist = y_hum - y_targ
-                        unk_wf_distances[unk_id, wf_id] = math.sqrt((x_dist*x_dist) + (y_dist*y_dist))
-                        if unk_wf_distances[unk_id, wf_id] == 0.0:
-                            unk_wf_distances[unk_id, wf_id] = 0.1
-                    else:
-                        unk_wf_distances[unk_id, wf_id] = 1000.00  # Human is dead
-            else:
-                unk_distances[unk_id] = 1000.00
-                for wf_id in range(self.num_humans):
-                    unk_wf_distances[unk_id, wf_id] = 1000.00
-
-        # Distance between warfighters and lethal robots
-        for wf_id in range(self.num_humans):
-            if self.human_alive[wf_id]:
-                x_wf = self.human_loc[wf_id, 0]
-                y_wf = self.human_loc[wf_id, 1]
-                x_dist = x_wf - x_leth
-                y_dist = y_wf - y_leth
-                wf_distances[wf_id] = math.sqrt((x_dist*x_dist) + (y_dist*y_dist))
-                if wf_distances[wf_id] == 0.0:
-                    wf_distances[wf_id] = 0.1
-            else:
-                wf_distances[wf_id] = 1000.00
-
-        # Distance between sensors and lethal robots
-        for sens_id in range(self.num_sensors):
-            x_sense = self.sensor_loc[sens_id, 0]
-            y_sense = self.sensor_loc[sens_id, 1]
-            x_dist = x_sense - x_leth
-            y_dist = y_sense - y_leth
-            sensor_distances[sens_id] = math.sqrt((x_dist*x_dist) + (y_dist*y_dist))
-            if sensor_distances[sens_id] == 0.0:
-                sensor_distances[sens_id] = 0.1
-
-        return unk_distances, wf_distances, sensor_distances, unk_wf_distances
-
-
-    def lethalGreedyMove(self, leth_id):
-        """
-        Lethal platforms move greedily towards the closest target with uncertainty above threshold
-        :return:
-        """
-        distances = np.zeros(self.num_unknown)
-        x_leth = self.lethal_loc[leth_id, 0]
-        y_leth = self.lethal_loc[leth_id, 1]
-
-        for unk_id in range(self.num_unknown):
-            if self.unknown_alive[unk_id] and self.unknown_estimates[unk_id] > self.tau:
-                x_unk = self.unknown_loc[unk_id, 0]
-                y_unk = self.unknown_loc[unk_id, 1]
-                x_dist = x_unk - x_leth
-                y_dist = y_unk - y_leth
-                distances[unk_id] = math.sqrt((x_dist*x_dist) + (y_dist*y_dist))
-                if distances[unk_id] == 0.0:
-                    distances[unk_id] = 0.5
-            else:
-                distances[unk_id] = 1000.00
-
-        targ_id = np.argmin(distances)
-        if distances[targ_id] < 1000.00:  # Move towards closest combatant
-            x_targ = self.unknown_loc[targ_id, 0]
-            y_targ = self.unknown_loc[targ_id, 1]
-            dx = ((x_targ - x_leth)/distances[targ_id])*self.lethal_max_step_size
-            dy = ((y_targ - y_leth)/distances[targ_id])*self.lethal_max_step_size
-            self.lethal_loc[leth_id, 0] += dx
-            self.lethal_loc[leth_id, 1] += dy
-
-
-    def lethalPolicyS1(self, leth_id):
-        """
-        Lethal platforms move according to policy
-        :return:
-        """
-
-        x_leth = self.lethal_loc[leth_id, 0]
-        y_leth = self.lethal_loc[leth_id, 1]
-        unk_distances, wf_distances, sensor_distances, unk_wf_distances = self.getDistancesForLethals(leth_id)
-
-        action_count = 0
-        for targ_id in range(self.num_unknown):  # Move towards identified combatant
-            if self.unknown_estimates[targ_id] > self.tau and self.unknown_alive[targ_id]:
-                x_targ = self.unknown_loc[targ_id, 0]
-                y_targ = self.unknown_loc[targ_id, 1]
-                dx = ((x_targ - x_leth) / unk_distances[targ_id]) * self.lethal_max_step_size
-                dy = ((y_targ - y_leth) / unk_distances[targ_id]) * self.lethal_max_step_size
-                self.lethal_loc[leth_id, 0] += dx
-                self.lethal_loc[leth_id, 1] += dy
-                action_count += 1
-                break
-
-        min_wf_id = np.argmin(wf_distances)
-        if wf_distances[min_wf_id] < 1000.00 and action_count == 0:  # Follow closest warfighter
-            x_targ = self.human_loc[min_wf_id, 0]
-            y_targ = self.human_loc[min_wf_id, 1]
-            dx = ((x_targ - x_leth) / wf_distances[min_wf_id]) * self.lethal_max_step_size
-            dy = ((y_targ - y_leth) / wf_distances[min_wf_id]) * self.lethal_max_step_size
-            self.lethal_loc[leth_id, 0] += dx
-            self.lethal_loc[leth_id, 1] += dy
-
-
-    def lethalPolicyS2(self, leth_id):
-        """
-        Lethal platforms move according to policy
-        :return:
-        """
-
-        x_leth = self.lethal_loc[leth_id, 0]
-        y_leth = self.lethal_loc[leth_id, 1]
-        unk_distances, wf_distances, sensor_distances, unk_wf_distances = self.getDistancesForLethals(leth_id)
-
-        action_count = 0
-        for targ_id in range(self.num_unknown):  # Move towards identified combatant
-            if self.unknown_estimates[targ_id] > self.tau and self.unknown_alive[targ_id]:
-                x_targ = self.unknown_loc[targ_id, 0]
-                y_targ = self.unknown_loc[targ_id, 1]
-                dx = ((x_targ - x_leth) / unk_distances[targ_id]) * self.lethal_max_step_size
-                dy = ((y_targ - y_leth) / unk_distances[targ_id]) * self.lethal_max_step_size
-                self.lethal_loc[leth_id, 0] += dx
-                self.lethal_loc[leth_id, 1] += dy
-                action_count += 1
-                break
-
-        min_wf_id = np.argmin(wf_distances)
-        if wf_distances[min_wf_id] < 1000.00 and action_count == 0:  # Follow closest warfighter
-            x_targ = self.human_loc[min_wf_id, 0]
-            y_targ = self.human_loc[min_wf_id, 1]
-            dx = ((x_targ - x_leth) / wf_distances[min_wf_id]) * self.lethal_max_step_size
-            dy = ((y_targ - y_leth) / wf_distances[min_wf_id]) * self.lethal_max_step_size
-            self.lethal_loc[leth_id, 0] += dx
-            self.lethal_loc[leth_id, 1] += dy
-
-
-    def lethalPolicyS3(self, leth_id):
-        """
-                Lethal platforms move according to policy
-                :return:
-                """
-
-        x_leth = self.lethal_loc[leth_id, 0]
-        y_leth = self.lethal_loc[leth_id, 1]
-        unk_distances, wf_distances, sensor_distances, unk_wf_distances = self.getDistancesForLethals(leth_id)
-
-        min_unk_id = np.argmin(unk_distances)  # Closest unknown
-        min_wf_id = np.argmin(wf_distances)  # Closest warfighter
-
-        action_count = 0
-        for targ_id in range(self.num_unknown):
-            min_unk_wf_dist = np.min(unk_wf_distances[targ_id, :])
-            if min_unk_wf_dist < 10.0:  # Move towards unknown if it is too close to a warfighter
-                targ_id = np.argmin(unk_wf_distances[targ_id, :])
-                x_targ = self.unknown_loc[targ_id, 0]
-                y_targ = self.unknown_loc[targ_id, 1]
-                dx = ((x_targ - x_leth) / min_unk_wf_dist) * self.sensor_max_step_size
-                dy = ((y_targ - y_leth) / min_unk_wf_dist) * self.sensor_max_step_size
-                self.sensor_loc[leth_id, 0] += dx
-                self.sensor_loc[leth_id, 1] += dy
-                action_count += 1
-                break
-            elif self.unknown_estimates[targ_id] > self.tau and self.unknown_alive[targ_id]:
-                x_targ = self.unknown_loc[targ_id, 0]
-                y_targ = self.unknown_loc[targ_id, 1]
-                dx = ((x_targ - x_leth) / unk_distances[targ_id]) * self.lethal_max_step_size
-                dy = ((y_targ - y_leth) / unk_distances[targ_id]) * self.lethal_max_step_size
-                self.lethal_loc[leth_id, 0] += dx
-                self.lethal_loc[leth_id, 1] += dy
-                action_count += 1
-                break
-
-        if action_count == 0:
-            if unk_distances[min_unk_id] < 1000.00 and leth_id == 0:  # Lethal 1 move to closest unknown
-                x_targ = self.unknown_loc[min_unk_id, 0]
-                y_targ = self.unknown_loc[min_unk_id, 1]
-                dx = ((x_targ - x_leth) / unk_distances[min_unk_id]) * self.lethal_max_step_size
-                dy = ((y_targ - y_leth) / unk_distances[min_unk_id]) * self.lethal_max_step_size
-                self.lethal_loc[leth_id, 0] += dx
-                self.lethal_loc[leth_id, 1] += dy
-            elif wf_distances[min_wf_id] < 1000.00 and leth_id == 1:  # Lethal 2 move to closest warfighter
-                x_targ = self.human_loc[min_wf_id, 0]
-                y_targ = self.human_loc[min_wf_id, 1]
-                dx = ((x_targ - x_leth) / wf_distances[min_wf_id]) * self.lethal_max_step_size
-                dy = ((y_targ - y_leth) / wf_distances[min_wf_id]) * self.lethal_max_step_size
-                self.lethal_loc[leth_id, 0] += dx
-                self.lethal_loc[leth_id, 1] += dy
-            else:  # Move to closest sensor
-                min_sense_id = np.argmin(sensor_distances)
-                x_targ = self.sensor_loc[min_sense_id, 0]
-                y_targ = self.sensor_loc[min_sense_id, 1]
-                dx = ((x_targ - x_leth) / sensor_distances[min_sense_id]) * self.lethal_max_step_size
-                dy = ((y_targ - y_leth) / sensor_distances[min_sense_id]) * self.lethal_max_step_size
-                self.lethal_loc[leth_id, 0] += dx
-                self.lethal_loc[leth_id, 1] += dy
-
+        view = WorldView(self)
+        view.apply(self.sensor_loc, self.sensor_policy(view))
+        self.distance_cache.invalidate("sensor")
 
     def updateLethalLocations(self):  # How lethal robots move
         """
         Fill in with the algorithm from problem 3c or 3d
-        This function controls how lethal robots move
+        This function controls how lethal robots move, all of them in one call of the lethal policy
         :return:
         """
-
-        for leth_id in range(self.num_lethal):
-            if self.use_greedy:
-                self.lethalGreedyMove(leth_id)
-            elif self.scene == 1:
-                self.lethalPolicyS1(leth_id)
-            elif self.scene == 2:
-                self.lethalPolicyS2(leth_id)
-            else:
-                self.lethalPolicyS3(leth_id)
+        view = WorldView(self)
+        view.apply(self.lethal_loc, self.lethal_policy(view))
+        self.distance_cache.invalidate("lethal")
 
 
     def updateHumanLocations(self):
@@ -734,67 +365,84 @@ class Simulator:
         Updates the locations of all human (non-controllable) warfighters.
         They move toward random goals in an 8-connected grid. Once a goal is sufficiently reached,
         a new goal is assigned.
+        A new goal is drawn for every warfighter each tick whether it is needed or not, so the random stream does
+        not depend on where the agents went.
         :return:
         """
+        new_goals = self.rng.integers(0, self.xy_size, [self.num_humans, 2])
         for i in range(self.num_humans):
             if self.human_alive[i]:
                 # conditionally generate new goal if prev goal reached
                 if np.linalg.norm(self.human_loc[i] - self.human_goal[i], 2) < 4:
-                    self.human_goal[i] = np.random.randint(0, self.xy_size, self.human_loc[i].shape)
+                    self.human_goal[i] = new_goals[i]
                 self.human_loc[i] += np.sign(self.human_goal[i] - self.human_loc[i])
+        self.distance_cache.invalidate("human")
 
 
     def updateUnknownLocations(self):
         """
-        Updates the locations of combats and civilians
+        Updates the locations of combats and civilians. Combatants step toward their closest living warfighter,
+        civilians walk to goals like the warfighters do. New goals are drawn for every unknown each tick.
         :return: None
         """
+        new_goals = self.rng.integers(0, self.xy_size, [self.num_unknown, 2])
+        closest = None
         for i in range(self.num_unknown):
             if self.unknown_alive[i]:
-                if self.unknown_ground_truth == "combatant":
+                if self.unknown_is_combatant[i]:
                     # Combatants move towards human warfighters
-                    minDistance = np.inf
-                    closestWarfighter = None
-                    for j in range(self.num_humans):
-                        if self.human_alive:
-                            distance = np.linalg.norm(self.unknown_loc[i] - self.human_loc[j], 2)
-                            if distance < minDistance:
-                                minDistance = distance
-                                closestWarfighter = j
-                    if closestWarfighter is not None:
+                    if closest is None:
+                        closest = self.closestWarfighters()
+                    closestWarfighter = closest[i]
+                    if closestWarfighter >= 0:
                         self.unknown_loc[i] += np.sign(self.human_loc[closestWarfighter] - self.unknown_loc[i])
                 else:
                     # Move civilian toward goal or generate new goal
                     if np.linalg.norm(self.unknown_loc[i] - self.unknown_goal[i], 2) < 4:
-                        self.unknown_goal[i] = np.random.randint(0, self.xy_size, self.unknown_goal[i].shape)
+                        self.unknown_goal[i] = new_goals[i]
                     self.unknown_loc[i] += np.sign(self.unknown_goal[i] - self.unknown_loc[i])
+        self.distance_cache.invalidate("unknown")
 
 
-    def calcEuclideanDistanceSensors(self):
+    def closestWarfighters(self):
         """
-        Calculates the euclidean distance between sensors and unknowns
-        :return:
+        Finds the closest living warfighter of every unknown, ties go to the lower warfighter index
+        :return: (num_unknown,) int array of warfighter indices, -1 where no warfighter is alive
         """
-        sensor_target_distances = np.zeros((self.num_sensors, self.num_unknown))
-        for sen_id in range(self.num_sensors):
-            sensor_x = self.sensor_loc[sen_id, 0]
-            sensor_y = self.sensor_loc[sen_id, 1]
+        alive = np.flatnonzero(self.human_alive)
+        if self.spatial_index:
+            # grid cells of about one warfighter each, so the search only has to look at a few cells
+            cell_size = max(self.xy_size / math.sqrt(max(len(alive), 1)), 1.0)
+            closest, _ = UniformGrid(self.human_loc[alive], cell_size, ids=alive).nearest(self.unknown_loc)
+            return closest
 
-            for targ_id in range(self.num_unknown):
-                target_x = self.unknown_loc[targ_id, 0]
-                target_y = self.unknown_loc[targ_id, 1]
-                x_dist = target_x - sensor_x
-                y_dist = target_y - sensor_y
-                eucl_dist = math.sqrt((x_dist*x_dist) + (y_dist*y_dist))
-                sensor_target_distances[sen_id, targ_id] = eucl_dist
+        closest = np.full(self.num_unknown, -1)
+        if len(alive):
+            distances = self.distance_cache.get("unknown", "human")[:, alive]
+            closest = alive[np.argmin(distances, axis=1)]
+        return closest
 
-        return sensor_target_distances
 
+    def calcEuclideanDistanceSensors(self):
+        """
+        Calculates the euclidean distance between sensors and unknowns
+        :return: (num_sensors, num_unknown) array, shared with the distance cache
+        """
+        return self.distance_cache.get("sensor", "unknown")
 
-    def simSensor(self, unk_id, falseNegativeRate, falsePositiveRate):
 
-        x = random()
-        if self.unknown_ground_truth[unk_id] == "combatant":
+    def simSensor(self, unk_id, falseNegativeRate, falsePositiveRate, x=None):
+        """
+        Simulates one reading of the sensors on an unknown
+        :param unk_id: which unknown is measured
+        :param falseNegativeRate: probability that a combatant reads as a civilian
+        :param falsePositiveRate: probability that a civilian reads as a combatant
+        :param x: uniform [0, 1) draw deciding the reading, drawn from self.rng if not given
+        :return: 1 if the reading says combatant, 0 otherwise
+        """
+        if x is None:
+            x = self.rng.random()
+        if self.unknown_is_combatant[unk_id]:
             if x > falseNegativeRate:  # Probability that a combatant is identified as a civ
                 return 1
             else:
@@ -810,68 +458,36 @@ class Simulator:
         """
         # Fill in with the model from problem 3a
         # Should be different for different scenarios
-        Use the self.simSensor() function to generate positive and negative measurements
+        Measurements follow the sensor model of self.simSensor(), drawn for all unknowns at once, see estimation.py
+        :return: bool mask of the unknowns that got a reading
         """
-        distances = self.calcEuclideanDistanceSensors()
-
-        p_fp = 0.0001  # Probability that a civ is identified as a combatant
-        for unk_id in range(self.num_unknown):
-            if self.unknown_alive[unk_id]:
-                dist = np.min(distances[:, unk_id])  # Uses the shortest distance (most confident reading)
-                if dist <= 0.0:
-                    dist = 0.01
-                if dist < self.sensor_range:  # Only updates estimate if sensor is within range
-                    p_fn = 1 - math.exp(-dist / self.sensor_range)  # Probability that a combatant is identified as a civ
-                    measurement = self.simSensor(unk_id, p_fn, p_fp)
-
-                    p_com = self.unknown_estimates[unk_id]
-                    p_civ = 1 - p_com
-
-                    if measurement == 0:  # Sensor reads a civ
-                        if self.unknown_estimates[unk_id] <= self.tau:  # I believe this is a civ
-                            assert (self.unknown_estimates[unk_id] <= self.tau)
-                            p_s0 = ((1 - p_fp) * p_civ) + (p_fn * p_com)  # Prob of civ and true neg, Prob of com and false neg
-                            self.unknown_estimates[unk_id] = (1 - p_fp)*p_civ / p_s0
+        draws = self.rng.random(self.num_unknown)  # one sensor noise draw per unknown, used or not
+        # Uses the shortest distance (most confident reading), all unknowns are updated at once
+        return updateEstimates(self.unknown_estimates, self.closestSensorDistances(), self.unknown_alive,
+                               self.unknown_is_combatant, draws, self.tau, self.sensor_range)
 
-                        else:  # I believe this is a combatant
-                            assert (self.unknown_estimates[unk_id] > self.tau)
-                            p_s0 = ((1 - p_fp) * p_civ) + (p_fn * p_com)  # Prob of civ and true neg, Prob of com and false neg
-                            self.unknown_estimates[unk_id] = p_fn * p_com / p_s0
 
-                    else:  # Sensor reads a combatant
-                        if self.unknown_estimates[unk_id] <= self.tau:  # I believe this is a civ
-                            assert (self.unknown_estimates[unk_id] <= self.tau)
-                            p_s1 = (p_fp * p_civ) + ((1 - p_fn) * p_com)  # prob of civ and false pos, prob of com and true pos
-                            self.unknown_estimates[unk_id] = p_fp * p_civ / p_s1
-
-                        else:  # I believe this is a combatant
-                            assert (self.unknown_estimates[unk_id] > self.tau)
-                            p_s1 = (p_fp * p_civ) + ((1 - p_fn) * p_com)  # prob of civ and false pos, prob of com and true pos
-                            self.unknown_estimates[unk_id] = (1 - p_fn) * p_com / p_s1
-
-                    assert(self.unknown_estimates[unk_id] >= 0.0)
-                    assert(self.unknown_estimates[unk_id] <= 1.0)
+    def closestSensorDistances(self):
+        """
+        Distance from every unknown to its closest sensor. Only distances below sensor_range are exact, the rest
+        may be reported as inf
+        :return: (num_unknown,) float array
+        """
+        if self.spatial_index:
+            grid = UniformGrid(self.sensor_loc, self.sensor_range)
+            unk_ids, _, distances = grid.pairsWithin(self.unknown_loc, self.sensor_range)
+            closest = np.full(self.num_unknown, np.inf)
+            np.minimum.at(closest, unk_ids, distances)
+            return closest
+        return np.min(self.calcEuclideanDistanceSensors(), axis=0)
 
 
     def calcEuclideanDistanceLethal(self):
         """
-        Calculates the euclidean distance between sensors and unknowns
-        :return:
+        Calculates the euclidean distance between lethal robots and unknowns
+        :return: (num_lethal, num_unknown) array, shared with the distance cache
         """
-        lethal_target_distances = np.zeros((self.num_sensors, self.num_unknown))
-        for leth_id in range(self.num_sensors):
-            sensor_x = self.lethal_loc[leth_id, 0]
-            sensor_y = self.lethal_loc[leth_id, 1]
-
-            for targ_id in range(self.num_unknown):
-                target_x = self.unknown_loc[targ_id, 0]
-                target_y = self.unknown_loc[targ_id, 1]
-                x_dist = target_x - sensor_x
-                y_dist = target_y - sensor_y
-                eucl_dist = math.sqrt((x_dist*x_dist) + (y_dist*y_dist))
-                lethal_target_distances[leth_id, targ_id] = eucl_dist
-
-        return lethal_target_distances
+        return self.distance_cache.get("lethal", "unknown")
 
 
     def updateLethalActions(self):
@@ -879,25 +495,34 @@ class Simulator:
         This function determines if human warfighters are "disabled" by combatants
         :return:
         """
-        for i in range(self.num_humans):
-            for j in range(self.num_unknown):
-                if (self.unknown_ground_truth[j] == "combatant") and self.unknown_alive[j]:
-                    distance = np.linalg.norm(self.unknown_loc[j]-self.human_loc[i], 2)
-                    if distance < self.lethal_radius:
-                        self.human_alive[i] = False
+        if self.spatial_index:
+            armed = np.flatnonzero(self.unknown_is_combatant & self.unknown_alive)
+            grid = UniformGrid(self.unknown_loc[armed], self.lethal_radius, ids=armed)
+            wf_ids, _, _ = grid.pairsWithin(self.human_loc, self.lethal_radius)
+            self.human_alive[wf_ids] = False
+        else:
+            # no policy reads these distances, the pairs in range come from a neighbour list instead of the full matrix
+            armed = self.unknown_is_combatant & self.unknown_alive
+            (wf_ids, unk_ids), _ = self.distance_cache.within("human", "unknown", self.lethal_radius)
+            self.human_alive[wf_ids[armed[unk_ids]]] = False
+        self.distance_cache.aliveChanged("human")
 
         # Below determine if combatants are disabled by our lethal assets
         # Fill in with behaviorist architecture from problem 1
 
-        distances = self.calcEuclideanDistanceLethal()
-
-        for leth_id in range(self.num_lethal):
-            for unk_id in range(self.num_unknown):
-                if distances[leth_id, unk_id] <= self.lethal_radius and self.unknown_estimates[unk_id] > self.tau:
-                    if self.scene == 3:
-                        self.unknown_alive[unk_id] = False  # Give em the stabbo
-                    elif (self.unknown_estimates[unk_id] - self.unknown_estimates[unk_id]*0.01) > self.tau:
-                        self.unknown_alive[unk_id] = False  # Give em the stabbo
+        estimates = self.unknown_estimates
+        confident = estimates > self.tau
+        if self.scene != 3:
+            confident &= (estimates - estimates*0.01) > self.tau
+        if self.spatial_index:
+            targets = np.flatnonzero(confident)
+            grid = UniformGrid(self.unknown_loc[targets], self.lethal_radius, ids=targets)
+            _, unk_ids, _ = grid.pairsWithin(self.lethal_loc, self.lethal_radius, inclusive=True)
+            self.unknown_alive[unk_ids] = False  # Give em the stabbo
+        else:
+            distances = self.calcEuclideanDistanceLethal()
+            self.unknown_alive &= ~np.any((distances <= self.lethal_radius) & confident, axis=0)  # Give em the stabbo
+        self.distance_cache.aliveChanged("unknown")
 
 
 if __name__ == '__main__':
@@ -0,0 +1,77 @@
+"""
+Binary snapshots of the state of a simulation, see Simulator.snapshot(), restore() and fork().
+
+A snapshot is one bytes object: a magic string, the length of a small JSON header, the header, and then one numpy
+structured record holding every state array as a field. The header has the field names, dtypes and shapes of the
+record plus the scalar state (the tick, the random generator state). Packing copies every array once into the
+record and unpacking reads the record in place, so a snapshot round-trips at about the speed of copying its arrays:
+
+    sim = Simulator(3, 0.9, seed=0)
+    sim.run(until=20)
+    blob = sim.snapshot()                          # a few KB
+    branches = sim.fork(1000, seed=1, sensor_policy="greedy")
+    results = [branch.run() for branch in branches]
+    sim.restore(blob)                              # back to tick 20, with the same random stream as before
+"""
+import json
+import struct
+
+import numpy as np
+
+MAGIC = b"SIMSNAP1"
+_LENGTH = struct.Struct("<I")
+
+
+def packState(meta, arrays):
+    """
+    :param meta: JSON-able dict of the scalar state
+    :param arrays: dict of field name -> array
+    :return: bytes, see unpackState()
+    """
+    fields = [(name, np.asarray(array).dtype.str, list(np.shape(array))) for name, array in arrays.items()]
+    record = np.zeros((), dtype=_recordDtype(fields))
+    for name, array in arrays.items():
+        record[name] = array
+    header = json.dumps({"fields": fields, "meta": meta}).encode()
+    return MAGIC + _LENGTH.pack(len(header)) + header + record.tobytes()
+
+
+def unpackState(blob):
+    """
+    :param blob: bytes from packState()
+    :return: (meta dict, read-only structured record whose fields are views into blob)
+    :raises: ValueError if blob is not a snapshot
+    """
+    blob = memoryview(blob)
+    start = len(MAGIC) + _LENGTH.size
+    if bytes(blob[:len(MAGIC)]) != MAGIC:
+        raise ValueError("not a simulation snapshot")
+    length, = _LENGTH.unpack(blob[len(MAGIC):start])
+    header = json.loads(bytes(blob[start:start + length]))
+    dtype = _recordDtype(header["fields"])
+    if len(blob) - start - length != dtype.itemsize:
+        raise ValueError("truncated simulation snapshot")
+    record = np.frombuffer(blob, dtype=dtype, count=1, offset=start + length)[0]
+    return header["meta"], record
+
+
+def _recordDtype(fields):
+    return np.dtype([(name, dtype, tuple(shape)) for name, dtype, shape in fields])
+
+
+def rngState(rng):
+    """
+    :param rng: numpy.random.Generator
+    :return: JSON-able state of its bit generator
+    """
+    return rng.bit_generator.state
+
+
+def rngFromState(state):
+    """
+    :param state: from rngState()
+    :return: new numpy.random.Generator that continues where the one the state came from was
+    """
+    bit_generator = getattr(np.random, state["bit_generator"])()
+    bit_generator.state = state
+    return np.random.Generator(bit_generator)
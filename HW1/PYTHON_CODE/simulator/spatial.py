@@ -0,0 +1,184 @@
+"""
+Uniform grid spatial index for range and nearest neighbour queries between agent groups.
+
+Points are bucketed into square cells and kept sorted by cell, so finding the points of a cell is a binary search.
+Queries only look at the cells around each query point and then compute exact distances for those candidates, with
+the same formula as distances.pairwiseDistances, so the answers are identical to a brute-force scan over all pairs.
+All queries are vectorized over the query points.
+"""
+import numpy as np
+
+# Cell coordinates are clipped to +-_CELL_LIMIT so far away points still get a valid key. Clipping can
+# only put far apart points into the same cell, which the exact distance check afterwards takes care of.
+_CELL_LIMIT = 2**20
+_CELL_STRIDE = 2*_CELL_LIMIT + 3
+
+_NEIGHBOURS = [(dx, dy) for dx in (-1, 0, 1) for dy in (-1, 0, 1)]
+
+
+def _ring(k):
+    """
+    Cell offsets at Chebyshev distance exactly k
+    :param k: ring number, 0 is the cell itself
+    :return: list of (dx, dy)
+    """
+    if k == 0:
+        return [(0, 0)]
+    return [(dx, dy) for dx in range(-k, k + 1) for dy in range(-k, k + 1) if max(abs(dx), abs(dy)) == k]
+
+
+class UniformGrid:
+    def __init__(self, points, cell_size, ids=None):
+        """
+        Buckets points into square cells of side cell_size
+        :param points: (n, 2) array of locations
+        :param cell_size: side of a cell, should be at least the largest radius that is going to be queried
+        :param ids: (n,) ids reported for the points, defaults to their row numbers. Ties in nearest() are broken
+                    toward the smaller id
+        """
+        if cell_size <= 0:
+            raise ValueError("cell_size must be positive")
+        self.points = np.asarray(points)
+        self.cell_size = float(cell_size)
+        self.ids = np.arange(len(self.points)) if ids is None else np.asarray(ids)
+
+        cells = self.cellsOf(self.points)
+        keys = self._keys(cells)
+        self._order = np.argsort(keys, kind='stable')
+        self._sorted_keys = keys[self._order]
+
+    def __len__(self):
+        return len(self.points)
+
+    def cellsOf(self, locations):
+        """
+        :param locations: (n, 2) array of locations
+        :return: (n, 2) int array of the cells they fall into
+        """
+        with np.errstate(invalid='ignore'):
+            cells = np.floor(locations / self.cell_size)
+        cells = np.nan_to_num(cells, nan=_CELL_LIMIT, posinf=_CELL_LIMIT, neginf=-_CELL_LIMIT)
+        return np.clip(cells, -_CELL_LIMIT, _CELL_LIMIT).astype(np.int64)
+
+    def _keys(self, cells):
+        return (cells[:, 0] + _CELL_LIMIT + 1)*_CELL_STRIDE + (cells[:, 1] + _CELL_LIMIT + 1)
+
+    def _candidates(self, query_cells, offsets):
+        """
+        All (query, point) pairs where the point lies in one of the cells at the given offsets from the query's cell
+        :param query_cells: (q, 2) cells of the query points
+        :param offsets: list of (dx, dy) cell offsets to look at
+        :return: query row numbers, point row numbers
+        """
+        query_rows, point_rows = [], []
+        for offset in offsets:
+            keys = self._keys(query_cells + offset)
+            lo = np.searchsorted(self._sorted_keys, keys, 'left')
+            hi = np.searchsorted(self._sorted_keys, keys, 'right')
+            counts = hi - lo
+            total = np.sum(counts)
+            if total == 0:
+                continue
+            before = np.cumsum(counts) - counts
+            query_rows.append(np.repeat(np.arange(len(keys)), counts))
+            point_rows.append(self._order[np.repeat(lo - before, counts) + np.arange(total)])
+        if not query_rows:
+            return np.zeros(0, dtype=int), np.zeros(0, dtype=int)
+        return np.concatenate(query_rows), np.concatenate(point_rows)
+
+    def _distances(self, queries, query_rows, point_rows):
+        diff = queries[query_rows] - self.points[point_rows]
+        return np.sqrt(np.sum(diff*diff, axis=-1))
+
+    def pairsWithin(self, queries, radius, inclusive=False):
+        """
+        Every (query, point) pair closer than radius
+        :param queries: (q, 2) array of query locations
+        :param radius: search radius, at most cell_size
+        :param inclusive: also report pairs at exactly radius
+        :return: query row numbers, point ids, distances. Sorted by query then id
+        """
+        if radius > self.cell_size:
+            raise ValueError("radius can not be larger than the cell size of the grid")
+        queries = np.asarray(queries)
+        query_rows, point_rows = self._candidates(self.cellsOf(queries), _NEIGHBOURS)
+        distances = self._distances(queries, query_rows, point_rows)
+        with np.errstate(invalid='ignore'):
+            keep = distances <= radius if inclusive else distances < radius
+        query_rows, ids, distances = query_rows[keep], self.ids[point_rows[keep]], distances[keep]
+        order = np.lexsort((ids, query_rows))
+        return query_rows[order], ids[order], distances[order]
+
+    def nearest(self, queries, max_rings=4):
+        """
+        Closest point to every query point, ties go to the smallest id.
+        Rings of cells are searched outward from each query; queries still unresolved after max_rings rings are
+        answered with a brute-force scan.
+        :param queries: (q, 2) array of query locations
+        :param max_rings: rings of cells to search before falling back to brute force
+        :return: (q,) ids of the closest points (-1 if the grid is empty), (q,) their distances (inf if empty)
+        """
+        queries = np.asarray(queries)
+        best_id = np.full(len(queries), -1)
+        best_dist = np.full(len(queries), np.inf)
+        if len(self.points) == 0 or len(queries) == 0:
+            return best_id, best_dist
+
+        pending = np.arange(len(queries))
+        query_cells = self.cellsOf(queries)
+        for k in range(max_rings + 1):
+            query_rows, point_rows = self._candidates(query_cells[pending], _ring(k))
+            self._keepClosest(best_id, best_dist, pending[query_rows], self.ids[point_rows],
+                              self._distances(queries[pending], query_rows, point_rows))
+            # anything outside the rings searched so far is at least k cells away
+            pending = pending[~(best_dist[pending] < k*self.cell_size)]
+            if len(pending) == 0:
+                return best_id, best_dist
+
+        query_rows = np.repeat(np.arange(len(pending)), len(self.points))
+        point_rows = np.tile(np.arange(len(self.points)), len(pending))
+        self._keepClosest(best_id, best_dist, pending[query_rows], self.ids[point_rows],
+                          self._distances(queries[pending], query_rows, point_rows))
+        return best_id, best_dist
+
+    @staticmethod
+    def _keepClosest(best_id, best_dist, query_rows, ids, distances):
+        """
+        Folds candidate pairs into the running closest point per query, preferring smaller ids on ties
+        :return: None
+        """
+        if len(query_rows) == 0:
+            return
+        with np.errstate(invalid='ignore'):
+            keep = distances <= best_dist[query_rows]
+        query_rows, ids, distances = query_rows[keep], ids[keep], distances[keep]
+        order = np.lexsort((ids, distances, query_rows))
+        query_rows, ids, distances = query_rows[order], ids[order], distances[order]
+        first = np.ones(len(query_rows), dtype=bool)
+        first[1:] = query_rows[1:] != query_rows[:-1]
+        query_rows, ids, distances = query_rows[first], ids[first], distances[first]
+        better = (distances < best_dist[query_rows]) | (ids < best_id[query_rows]) | (best_id[query_rows] < 0)
+        best_id[query_rows[better]] = ids[better]
+        best_dist[query_rows[better]] = distances[better]
+
+
+if __name__ == '__main__':
+    # Check the grid against brute force on random integer locations, like the simulator uses
+    from .distances import pairwiseDistances
+
+    rng = np.random.default_rng(0)
+    for n_points, n_queries, size in ((5, 7, 50), (2000, 3000, 1000), (300, 20, 5000)):
+        points = rng.integers(0, size, (n_points, 2))
+        queries = rng.integers(0, size, (n_queries, 2))
+        brute = pairwiseDistances(queries, points)
+        grid = UniformGrid(points, 10.0)
+
+        query_rows, ids, dists = grid.pairsWithin(queries, 10.0)
+        expected_rows, expected_ids = np.nonzero(brute < 10.0)
+        assert np.array_equal(query_rows, expected_rows) and np.array_equal(ids, expected_ids)
+        assert np.array_equal(dists, brute[expected_rows, expected_ids])
+
+        ids, dists = grid.nearest(queries)
+        assert np.array_equal(ids, np.argmin(brute, axis=1))
+        assert np.array_equal(dists, np.min(brute, axis=1))
+        print("{} points, {} queries on a {} map: ok".format(n_points, n_queries, size))
@@ -0,0 +1,123 @@
+"""
+Threshold sweeps: every tau value is evaluated on the same worlds and the same random numbers.
+
+TauSweep is a BatchSimulator whose rows are (world, tau) pairs. Every random draw is made once per world and repeated
+for each tau, so the initial locations, goals, ground truth and sensor noise are shared by all thresholds (common
+random numbers) and the differences between the points of a curve come from tau alone. Column k of a sweep gives
+exactly what BatchSimulator(scenario, taus[k], n_trials, seed=seed) gives.
+
+Command line use, e.g. the kill rate curves of all scenarios:
+    python -m simulator.sweep --scenario 1 2 3 --trials 2000 --seed 0
+"""
+import argparse
+import json
+
+import numpy as np
+
+from .batch import BatchSimulator
+from .runner import RESULT_COLUMNS
+
+
+class TauSweep(BatchSimulator):
+    def __init__(self, scenario, taus, n_trials, greedy=True, seed=None, rng=None, sensor_policy=None,
+                 lethal_policy=None):
+        """
+        :param scenario: scenario number 1 2 or 3, ScenarioSpec, preset name or scenario file, see scenario.py
+        :param taus: sequence of classification thresholds, each in [0, 1]
+        :param n_trials: number of worlds, every one is run with every tau
+        :param greedy: use the greedy sensor/lethal policies instead of the per-scenario ones
+        :param seed: seed for the random generator, anything np.random.default_rng() accepts
+        :param rng: a numpy.random.Generator to draw from instead, can not be combined with seed
+        :param sensor_policy: name of a registered sensor policy or a policy function, see policies.py
+        :param lethal_policy: the same for the lethal robots
+        """
+        taus = np.asarray(taus, dtype=float).ravel()
+        if len(taus) == 0 or np.any((taus < 0) | (taus > 1)):
+            raise ValueError("taus must be a non-empty sequence of floats in [0, 1]")
+        if n_trials < 1:
+            raise ValueError("n_trials must be a positive int")
+        self.taus = taus
+        self.n_worlds = n_trials
+        super().__init__(scenario, taus[0], n_trials*len(taus), greedy=greedy, seed=seed, rng=rng,
+                         sensor_policy=sensor_policy, lethal_policy=lethal_policy)
+        # row w*len(taus) + k runs world w with taus[k], the policies compare against tau per row
+        self.tau = np.tile(taus, n_trials)[:, None]
+
+    def _shared(self, draw, shape):
+        world_draw = draw((self.n_worlds,) + tuple(shape[1:]))
+        return np.repeat(world_draw, len(self.taus), axis=0)
+
+    def drawLocations(self, shape):
+        return self._shared(super().drawLocations, shape)
+
+    def drawUniform(self, shape):
+        return self._shared(super().drawUniform, shape)
+
+    def run(self):
+        """
+        :return: (n_trials, len(taus), 6) int array of result rows, see BatchSimulator.run()
+        """
+        return super().run().reshape(self.n_worlds, len(self.taus), -1)
+
+
+def killRates(results):
+    """
+    Fraction of every kind of agent killed, pooled over the trials
+    :param results: (n_trials, len(taus), 6) array from TauSweep.run()
+    :return: dict of (len(taus),) arrays: combatants, warfighters, civilians
+    """
+    totals = np.sum(results, axis=0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return {"combatants": totals[:, 0] / totals[:, 3],
+                "warfighters": totals[:, 1] / totals[:, 4],
+                "civilians": totals[:, 2] / totals[:, 5]}
+
+
+def sweepTau(scenario, taus, n_trials, greedy=True, seed=None):
+    """
+    Runs a sweep and summarizes it as kill rate curves
+    :return: dict with the taus, the kill rates (see killRates) and the mean and standard error of every result
+             column (see RESULT_COLUMNS) per tau
+    """
+    results = TauSweep(scenario, taus, n_trials, greedy=greedy, seed=seed).run()
+    curve = {"scenario": scenario if isinstance(scenario, (int, str)) else scenario.name,
+             "greedy": greedy,
+             "trials": n_trials,
+             "tau": np.asarray(taus, dtype=float)}
+    curve.update(killRates(results))
+    curve["columns"] = RESULT_COLUMNS
+    curve["mean"] = np.mean(results, axis=0)
+    curve["std_error"] = np.std(results, axis=0, ddof=1) / np.sqrt(n_trials) if n_trials > 1 else None
+    return curve
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Kill rates against the classification threshold, with every "
+                                                 "threshold evaluated on the same worlds")
+    parser.add_argument("--scenario", nargs="+", default=["1", "2", "3"],
+                        help="scenario numbers, preset names or scenario files, see scenario.py")
+    parser.add_argument("--tau", type=float, nargs="+", default=list(np.round(np.linspace(0, 1, 11), 2)))
+    parser.add_argument("--trials", type=int, default=1000)
+    parser.add_argument("--greedy", action=argparse.BooleanOptionalAction, default=True)
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--output", help="JSON file the curves are written to")
+    args = parser.parse_args(argv)
+
+    curves = []
+    for scenario in args.scenario:
+        curve = sweepTau(scenario, args.tau, args.trials, greedy=args.greedy, seed=args.seed)
+        curves.append(curve)
+        print("Scenario {}, greedy={}, {} worlds per tau:".format(scenario, args.greedy, args.trials))
+        print("\t  tau  combatants  warfighters  civilians")
+        for k, tau in enumerate(curve["tau"]):
+            print("\t{:5.2f}  {:10.4f}  {:11.4f}  {:9.4f}".format(
+                tau, curve["combatants"][k], curve["warfighters"][k], curve["civilians"][k]))
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump([{key: value.tolist() if isinstance(value, np.ndarray) else value
+                        for key, value in curve.items()} for curve in curves], f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,210 @@
+"""
+Per-tick trajectory logs of Simulator and BatchSimulator episodes, for analysis and replay after the fact.
+
+A TrajectoryRecorder preallocates one structured record per tick (plus one for the initial state) holding the
+*_loc and *_alive arrays and unknown_estimates, with the trial axis of a batch kept inside every field. With a file
+name the records are written straight into a memory-mapped .npy file, and the static parts of the episode (scenario,
+tau, world size, ground truth) go into a .json file next to it:
+
+    sim = Simulator(1, 0.9, seed=0, trajectory=TrajectoryRecorder("episode.npy"))
+    sim.run()
+    log = loadTrajectory("episode.npy")        # memory-mapped, nothing is read until it is used
+    log.killEvents()
+    log.replay(GIFWriter("episode.gif"))
+
+Reading fields of a loaded trajectory gives views into the mapped file, so nothing is copied until it is used.
+"""
+import json
+
+import numpy as np
+
+GROUPS = ("sensor", "lethal", "human", "unknown")
+MORTAL_GROUPS = ("human", "unknown")
+
+
+def _tickDtype(sim):
+    """
+    Record type of one tick of a simulation, shaped after its current arrays
+    :param sim: Simulator or BatchSimulator
+    :return: numpy structured dtype
+    """
+    fields = [("t", np.int32)]
+    for group in GROUPS:
+        loc = getattr(sim, group + "_loc")
+        fields.append((group + "_loc", loc.dtype, loc.shape))
+    for group in MORTAL_GROUPS:
+        fields.append((group + "_alive", np.bool_, getattr(sim, group + "_alive").shape))
+    fields.append(("unknown_estimates", sim.unknown_estimates.dtype, sim.unknown_estimates.shape))
+    return np.dtype(fields)
+
+
+def _groundTruth(sim):
+    """
+    :return: bool array, True for the unknowns that are combatants
+    """
+    truth = getattr(sim, "unknown_is_combatant", None)
+    if truth is None:
+        truth = np.array([g == "combatant" for g in sim.unknown_ground_truth], dtype=bool)
+    return truth
+
+
+class TrajectoryRecorder:
+    def __init__(self, filename=None):
+        """
+        Pass as trajectory= to Simulator or BatchSimulator, run() then records every tick into it
+        :param filename: .npy file the records are memory-mapped to, plus a .json file with the same name for the
+                         episode parameters. None keeps the records in memory
+        """
+        self.filename = filename
+        self.buffer = None
+        self.meta = None
+        self._count = 0
+
+    def start(self, sim):
+        """
+        Allocates the records for a whole episode and records the initial state as tick -1
+        :param sim: Simulator or BatchSimulator that is about to run
+        :return: None
+        """
+        dtype = _tickDtype(sim)
+        shape = (sim.endTime + 1,)
+        if self.filename is None:
+            self.buffer = np.zeros(shape, dtype=dtype)
+        else:
+            self.buffer = np.lib.format.open_memmap(self.filename, mode='w+', dtype=dtype, shape=shape)
+        self.meta = {"scenario": sim.scene, "spec": sim.spec.toDict(), "tau": sim.tau, "xy_size": sim.xy_size,
+                     "lethal_radius": sim.lethal_radius, "sensor_range": sim.sensor_range,
+                     "n_trials": getattr(sim, "n_trials", None),
+                     "unknown_is_combatant": _groundTruth(sim).tolist()}
+        self._count = 0
+        self.record(sim, -1)
+
+    def record(self, sim, t):
+        """
+        Copies the current state of the simulation into the next record
+        :param sim: Simulator or BatchSimulator
+        :param t: timestep that just finished
+        :return: None
+        """
+        i = self._count
+        rows = getattr(sim, "active_rows", None)
+        if rows is not None and len(rows) < sim.n_trials:
+            # trials that finished early (see BatchSimulator.retire()) keep their last state
+            self.buffer[i] = self.buffer[i - 1]
+        else:
+            rows = Ellipsis
+        self.buffer["t"][i] = t
+        for group in GROUPS:
+            self.buffer[group + "_loc"][i][rows] = getattr(sim, group + "_loc")
+        for group in MORTAL_GROUPS:
+            self.buffer[group + "_alive"][i][rows] = getattr(sim, group + "_alive")
+        self.buffer["unknown_estimates"][i][rows] = sim.unknown_estimates
+        self._count += 1
+
+    def close(self):
+        """
+        Flushes the records to disk and writes the episode parameters, when recording to a file
+        :return: None
+        """
+        self.meta["n_ticks"] = self._count
+        if self.filename is not None:
+            self.buffer.flush()
+            with open(_metaName(self.filename), "w") as f:
+                json.dump(self.meta, f)
+
+    def trajectory(self):
+        """
+        :return: Trajectory over what has been recorded so far
+        """
+        return Trajectory(self.buffer[:self._count], self.meta)
+
+
+def _metaName(filename):
+    return filename[:-4] + ".json" if filename.endswith(".npy") else filename + ".json"
+
+
+def loadTrajectory(filename, mmap_mode='r'):
+    """
+    Opens a trajectory written by a TrajectoryRecorder
+    :param filename: the .npy file
+    :param mmap_mode: passed to np.load, None reads the whole file into memory
+    :return: Trajectory
+    """
+    with open(_metaName(filename)) as f:
+        meta = json.load(f)
+    ticks = np.load(filename, mmap_mode=mmap_mode)
+    return Trajectory(ticks[:meta["n_ticks"]], meta)
+
+
+class Trajectory:
+    def __init__(self, ticks, meta):
+        """
+        :param ticks: structured array of tick records, the first one is the initial state
+        :param meta: dict of episode parameters, see TrajectoryRecorder.start()
+        """
+        self.ticks = ticks
+        self.meta = meta
+        self.batched = meta["n_trials"] is not None
+        self.unknown_is_combatant = np.array(meta["unknown_is_combatant"], dtype=bool)
+
+    def __len__(self):
+        return len(self.ticks)
+
+    def __getitem__(self, field):
+        """
+        :param field: e.g. "human_loc", the per-tick history of that array
+        :return: (ticks, ...) view of the field
+        """
+        return self.ticks[field]
+
+    def state(self, i, trial=None):
+        """
+        The world at one record, with the same attribute names as a Simulator
+        :param i: record number, 0 is the initial state
+        :param trial: which trial of a batch, required for batches
+        :return: object with t, *_loc, *_alive and unknown_estimates attributes, all views into the records
+        """
+        if self.batched and trial is None:
+            raise ValueError("pick a trial of the batch")
+        row = self.ticks[i]
+        state = _State()
+        state.t = int(row["t"])
+        for name in row.dtype.names[1:]:
+            state.__dict__[name] = row[name] if trial is None else row[name][trial]
+        return state
+
+    def killEvents(self):
+        """
+        Every death in the log, from the alive masks of consecutive records
+        :return: list of (t, trial, group, agent id) sorted by time, trial is 0 for a single simulation
+        """
+        events = []
+        t = self.ticks["t"]
+        for group in MORTAL_GROUPS:
+            alive = self.ticks[group + "_alive"]
+            if not self.batched:
+                alive = alive[:, None]
+            died = alive[:-1] & ~alive[1:]
+            for row, trial, agent in zip(*np.nonzero(died)):
+                events.append((int(t[row + 1]), int(trial), group, int(agent)))
+        events.sort()
+        return events
+
+    def replay(self, writer, trial=None):
+        """
+        Renders the recorded ticks, e.g. to re-create the frames of an episode that ran without display
+        :param writer: frame writer from recording.py, closed at the end
+        :param trial: which trial of a batch, required for batches
+        :return: None
+        """
+        from .renderer import Renderer
+
+        renderer = Renderer(self.meta["xy_size"], self.meta["tau"], writer)
+        for i in range(1, len(self)):
+            state = self.state(i, trial)
+            renderer.draw(state, state.t)
+        renderer.close()
+
+
+class _State:
+    pass
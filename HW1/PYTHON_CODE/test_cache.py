@@ -0,0 +1,74 @@
+"""
+Checks the result cache of simulator/cache.py: cached runs give the statistics of simulated ones without simulating,
+the LRU bound and the code version in the keys.
+"""
+import shutil
+
+import numpy as np
+
+from simulator import cache as cache_module
+from simulator.cache import ResultCache
+from simulator.metrics import SimulationMetrics
+from simulator.runner import runTrials
+
+
+def test_cachedRunsAreNotSimulatedAgain(tmp_path):
+    cache = ResultCache(str(tmp_path / "cache.sqlite"))
+    config = dict(workers=1, greedy=False, seed=11, chunk_size=25)
+
+    first = runTrials(3, 0.9, 100, cache=cache, **config)
+    assert len(cache) == 4
+    metrics = SimulationMetrics()
+    again = runTrials(3, 0.9, 100, cache=cache, metrics=metrics, **config)
+    assert np.array_equal(again.toArray(), first.toArray())
+    assert metrics.counters["trial_ticks"] == 0
+
+    # the first 4 chunks of a longer run are the cached ones, only the 2 after them are simulated
+    uncached, cached = SimulationMetrics(), SimulationMetrics()
+    expected = runTrials(3, 0.9, 150, metrics=uncached, **config)
+    longer = runTrials(3, 0.9, 150, cache=cache, metrics=cached, **config)
+    assert np.array_equal(longer.toArray(), expected.toArray())
+    assert len(cache) == 6
+    first_metrics = SimulationMetrics()
+    runTrials(3, 0.9, 100, metrics=first_metrics, **config)
+    simulated = uncached.counters["trial_ticks"] - first_metrics.counters["trial_ticks"]
+    assert 0 < cached.counters["trial_ticks"] == simulated
+
+
+def test_leastRecentlyUsedDropped(tmp_path):
+    values = np.arange(10, dtype=np.float64)
+    entry = len("k0") + values.nbytes
+    cache = ResultCache(str(tmp_path / "cache.sqlite"), max_bytes=3*entry)
+    for key in ("k0", "k1", "k2"):
+        cache.put(key, values)
+    assert cache.get("k0") is not None  # k1 is the least recently used now
+    cache.put("k3", values)
+    assert cache.size() <= cache.max_bytes
+    assert cache.get("k1") is None
+    for key in ("k0", "k2", "k3"):
+        assert np.array_equal(cache.get(key), values), key
+
+
+def test_codeVersionFollowsSources(tmp_path):
+    package = tmp_path / "simulator"
+    shutil.copytree(cache_module._PACKAGE_DIR, package, ignore=shutil.ignore_patterns("__pycache__"))
+    saved = cache_module._PACKAGE_DIR, cache_module._code_version
+    try:
+        cache_module._PACKAGE_DIR, cache_module._code_version = str(package), None
+        version = cache_module.codeVersion()
+        with open(package / "policies.py", "a") as f:
+            f.write("\n")
+        cache_module._code_version = None
+        assert cache_module.codeVersion() != version
+    finally:
+        cache_module._PACKAGE_DIR, cache_module._code_version = saved
+
+
+if __name__ == '__main__':
+    import tempfile
+    from pathlib import Path
+
+    for test in (test_cachedRunsAreNotSimulatedAgain, test_leastRecentlyUsedDropped, test_codeVersionFollowsSources):
+        with tempfile.TemporaryDirectory() as directory:
+            test(Path(directory))
+    print("The result cache checks out")
@@ -0,0 +1,19 @@
+"""
+Checks that ending an episode once its outcome is decided does not change its kill counts, see
+Simulator.outcomeDecided().
+"""
+from simulator import Simulator
+
+
+def test_earlyStopKeepsResults():
+    for s in (1, 2, 3):
+        for greedy in (True, False):
+            for seed in range(5):
+                expected = Simulator(s, 0.9, greedy=greedy, early_stop=False, seed=seed).run()
+                stopped = Simulator(s, 0.9, greedy=greedy, early_stop=True, seed=seed).run()
+                assert stopped == expected, (s, greedy, seed)
+
+
+if __name__ == '__main__':
+    test_earlyStopKeepsResults()
+    print("Early stopping keeps the results")
@@ -0,0 +1,31 @@
+"""
+Checks that the tick kernel gives the trials of the reference Simulator with the same seed, see simulator/kernel.py.
+Runs without numba too, as Python, only slower.
+"""
+import numpy as np
+
+from simulator import Simulator, BatchSimulator
+from simulator.kernel import KernelSimulator
+
+
+def test_kernelMatchesSimulator():
+    for s in (1, 2, 3):
+        for greedy in (True, False):
+            for seed in range(5):
+                expected = Simulator(s, 0.9, greedy=greedy, seed=seed).run()
+                kernel = KernelSimulator(s, 0.9, 1, greedy=greedy, seed=seed).run()[0]
+                assert tuple(kernel) == expected, (s, greedy, seed)
+
+
+def test_kernelMatchesBatch():
+    for s in (1, 2, 3):
+        for greedy in (True, False):
+            batch = BatchSimulator(s, 0.5, 50, greedy=greedy, seed=1).run()
+            kernel = KernelSimulator(s, 0.5, 50, greedy=greedy, seed=1).run()
+            assert np.array_equal(batch, kernel), (s, greedy)
+
+
+if __name__ == '__main__':
+    test_kernelMatchesSimulator()
+    test_kernelMatchesBatch()
+    print("The kernel matches Simulator and BatchSimulator")
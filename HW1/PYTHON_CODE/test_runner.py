@@ -0,0 +1,21 @@
+"""
+Checks that runTrials gives the same statistics however its chunks are spread over processes, see
+simulator/runner.py.
+"""
+import numpy as np
+
+from simulator.runner import runTrials
+
+
+def test_workersGiveSameStats():
+    for s in (1, 3):
+        expected = runTrials(s, 0.9, 250, workers=1, greedy=False, seed=7, chunk_size=40).toArray()
+        for shared_memory in (False, True):
+            stats = runTrials(s, 0.9, 250, workers=2, greedy=False, seed=7, chunk_size=40,
+                              shared_memory=shared_memory)
+            assert np.array_equal(stats.toArray(), expected), (s, shared_memory)
+
+
+if __name__ == '__main__':
+    test_workersGiveSameStats()
+    print("The runner gives the same statistics with any number of workers")
@@ -0,0 +1,158 @@
+"""
+Checks the HTTP service of simulator/service.py end to end: a SimulationService on an ephemeral port of this
+process, talked to over plain sockets.
+"""
+import asyncio
+import json
+
+from simulator.cache import ResultCache
+from simulator.runner import runTrials
+from simulator.service import MAX_BODY, Job, SimulationService, aggregates, parseJob
+
+
+def serve(test, **kwargs):
+    """
+    Runs test(service, port) against a started service and closes it afterwards
+    """
+    async def main():
+        service = SimulationService(workers=1, **kwargs)
+        server = await service.start("127.0.0.1", 0)
+        try:
+            return await test(service, server.sockets[0].getsockname()[1])
+        finally:
+            service.close()
+            server.close()
+            await server.wait_closed()
+
+    return asyncio.run(main())
+
+
+async def request(port, method, path, body=None, raw=None):
+    """
+    :return: (status, decoded JSON body, or the text of an event stream)
+    """
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    if raw is None:
+        data = b"" if body is None else json.dumps(body).encode()
+        raw = "{} {} HTTP/1.1\r\nContent-Length: {}\r\n\r\n".format(method, path, len(data)).encode() + data
+    writer.write(raw)
+    await writer.drain()
+    reply = await reader.read()
+    writer.close()
+    head, _, content = reply.partition(b"\r\n\r\n")
+    status = int(head.split()[1])
+    if b"text/event-stream" in head:
+        return status, content.decode()
+    return status, json.loads(content)
+
+
+def events(stream):
+    """
+    :return: the event names of an event stream
+    """
+    return [line[len("event: "):] for line in stream.split("\n") if line.startswith("event: ")]
+
+
+async def waitFor(port, job_id, states):
+    while True:
+        _, job = await request(port, "GET", "/jobs/" + job_id)
+        if job["state"] in states:
+            return job
+        await asyncio.sleep(0.02)
+
+
+def test_jobMatchesRunTrials():
+    async def test(service, port):
+        status, job = await request(port, "POST", "/jobs",
+                                    {"scenario": 3, "taus": [0.5, 0.9], "trials": 250, "chunk_size": 100, "seed": 5})
+        assert status == 202
+        status, stream = await request(port, "GET", "/jobs/{}/events".format(job["id"]))
+        assert status == 200
+        names = events(stream)
+        assert names[0] == "queued" and names[-1] == "done" and "progress" in names
+        _, done = await request(port, "GET", "/jobs/" + job["id"])
+        for tau, result in zip((0.5, 0.9), done["results"]):
+            stats = runTrials(3, tau, 250, workers=1, seed=done["seed"], chunk_size=100)
+            assert result == json.loads(json.dumps(aggregates(tau, stats)))
+
+        # the replay of a finished job ends in the same done event
+        _, stream = await request(port, "GET", "/jobs/{}/events".format(job["id"]))
+        assert events(stream) == names
+
+    serve(test)
+
+
+def test_badRequests():
+    async def test(service, port):
+        assert (await request(port, None, None, raw=b"POST /jobs HTTP/1.1\r\nContent-Length: 5\r\n\r\n{bad}"))[0] == 400
+        assert (await request(port, "POST", "/jobs", {"trials": 10, "colour": "red"}))[0] == 400
+        assert (await request(port, "POST", "/jobs", {"trials": -1}))[0] == 400
+        assert (await request(port, "POST", "/jobs", {"taus": [2.0]}))[0] == 400
+        assert (await request(port, None, None, raw=b"GET\r\n\r\n"))[0] == 400
+        assert (await request(port, None, None, raw=b"POST /jobs HTTP/1.1\r\nContent-Length: abc\r\n\r\n"))[0] == 400
+        assert (await request(port, None, None, raw=b"POST /jobs HTTP/1.1\r\nContent-Length: -5\r\n\r\n"))[0] == 400
+        too_large = "POST /jobs HTTP/1.1\r\nContent-Length: {}\r\n\r\n".format(MAX_BODY + 1).encode()
+        assert (await request(port, None, None, raw=too_large))[0] == 413
+
+        assert (await request(port, "GET", "/nothing"))[0] == 404
+        assert (await request(port, "GET", "/jobs/1/other"))[0] == 404
+        assert (await request(port, "GET", "/jobs/99"))[0] == 404
+        assert (await request(port, "PUT", "/jobs"))[0] == 405
+        assert service.jobs == {}
+
+        status, job = await request(port, "POST", "/jobs", {"trials": 10, "chunk_size": 10})
+        assert status == 202
+        assert (await request(port, "POST", "/jobs/" + job["id"]))[0] == 405
+        assert (await request(port, "DELETE", "/jobs/{}/events".format(job["id"])))[0] == 405
+        assert (await request(port, "GET", "/jobs"))[1][0]["id"] == job["id"]
+
+    serve(test)
+
+
+def test_cancelQueuedAndRunning():
+    async def test(service, port):
+        long_job = {"scenario": 3, "trials": 100000, "chunk_size": 50}
+        _, running = await request(port, "POST", "/jobs", long_job)
+        _, queued = await request(port, "POST", "/jobs", long_job)
+        await waitFor(port, running["id"], ("running",))
+
+        status, job = await request(port, "DELETE", "/jobs/" + queued["id"])
+        assert status == 200 and job["state"] == "cancelled"
+        status, job = await request(port, "DELETE", "/jobs/" + running["id"])
+        assert status == 200 and job["state"] == "cancelled"
+        for job_id in (queued["id"], running["id"]):
+            _, stream = await request(port, "GET", "/jobs/{}/events".format(job_id))
+            assert events(stream)[-1] == "cancelled"
+
+    serve(test)
+
+
+def test_cancelDuringCacheLookups(tmp_path):
+    async def test(service, port):
+        # thousands of one-trial chunks keep the job looking them up in the cache for a while
+        _, job = await request(port, "POST", "/jobs", {"scenario": 1, "trials": 5000, "chunk_size": 1})
+        await asyncio.sleep(0.05)
+        assert service.jobs[job["id"]].state == "queued"
+        _, job = await request(port, "DELETE", "/jobs/" + job["id"])
+        assert job["state"] == "cancelled"
+        assert service.jobs[job["id"]].events[-1][0] == "cancelled"
+
+        # a job whose task is cancelled before runJob() ran at all
+        job = Job("unscheduled", parseJob({"trials": 10, "chunk_size": 10}))
+        job.task = asyncio.create_task(service.runJob(job))
+        await service.cancel(job)
+        assert job.state == "cancelled" and job.events[-1][0] == "cancelled"
+
+    serve(test, cache=ResultCache(str(tmp_path / "cache.sqlite")))
+
+
+if __name__ == '__main__':
+    import tempfile
+    from pathlib import Path
+
+    test_jobMatchesRunTrials()
+    test_badRequests()
+    test_cancelQueuedAndRunning()
+    with tempfile.TemporaryDirectory() as directory:
+        test_cancelDuringCacheLookups(Path(directory))
+    print("The service passes")
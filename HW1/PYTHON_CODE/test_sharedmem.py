@@ -0,0 +1,38 @@
+"""
+Checks that runTrials frees the shared memory blocks its workers write into, see simulator/sharedmem.py.
+"""
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from simulator.runner import runTrials
+
+SHM_DIR = "/dev/shm"
+
+
+def _blocks():
+    return set(os.listdir(SHM_DIR))
+
+
+def test_blocksUnlinkedAfterEarlyStop():
+    for shared_pool in (False, True):
+        before = _blocks()
+        seen = set()
+
+        def stopAtFirstChunk(stats):
+            seen.update(_blocks() - before)
+            return True
+
+        if shared_pool:
+            with ProcessPoolExecutor(max_workers=2) as pool:
+                stats = runTrials(3, 0.9, 1000, workers=2, seed=3, chunk_size=50, executor=pool,
+                                  callback=stopAtFirstChunk)
+        else:
+            stats = runTrials(3, 0.9, 1000, workers=2, seed=3, chunk_size=50, callback=stopAtFirstChunk)
+        assert stats.count == 50
+        assert seen, "the run used no shared memory block"
+        assert not seen & _blocks(), shared_pool
+
+
+if __name__ == '__main__':
+    test_blocksUnlinkedAfterEarlyStop()
+    print("The shared memory blocks are unlinked")
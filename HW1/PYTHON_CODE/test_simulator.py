@@ -5,15 +5,12 @@ Updated: 2020-01-23
 
 Example testing using the simulator provided. This file instantiate the simulator, calls it, and collects data on it.
 """
-from simulator import Simulator
+from simulator import Simulator, BatchSimulator
 import numpy as np
 
 trials = 100
-data = np.zeros((trials, 6))
-for t in range(trials):
-    sim = Simulator(1, 0.9, greedy=False)
-    combatants_killed, warfighters_killed, civ_killed, num_combatants, num_warfighters, num_civ = sim.run()
-    data[t, :] = [combatants_killed, warfighters_killed, civ_killed, num_combatants, num_warfighters, num_civ]
+# all trials run side by side, each row of data holds the same 6 values Simulator.run() returns
+data = BatchSimulator(1, 0.9, trials, greedy=False).run()
 
 print("Final average values:")
 print("\tAverage combatants killed: {}/{}".format(np.average(data[:, 0]), np.average(data[:, 3])))
@@ -0,0 +1,41 @@
+"""
+Checks snapshot(), restore() and fork() of Simulator, see simulator/snapshot.py.
+"""
+from simulator import Simulator
+
+
+def test_restoreContinuesBitForBit():
+    for spatial_index in (False, True):
+        for s in (1, 2, 3):
+            for seed in range(3):
+                whole = Simulator(s, 0.9, greedy=False, spatial_index=spatial_index, seed=seed)
+                expected = whole.run()
+
+                interrupted = Simulator(s, 0.9, greedy=False, spatial_index=spatial_index, seed=seed)
+                interrupted.run(until=40)
+                state = interrupted.snapshot()
+                interrupted.run()
+                restored = Simulator(s, 0.9, greedy=False, spatial_index=spatial_index, seed=seed + 100)
+                restored.restore(state)
+                assert restored.run() == expected, (spatial_index, s, seed)
+                assert restored.snapshot() == whole.snapshot(), (spatial_index, s, seed)
+
+
+def test_forkBranchesDivergeParentUntouched():
+    sim = Simulator(3, 0.5, greedy=False, seed=4)
+    sim.run(until=20)
+    state = sim.snapshot()
+    branches = sim.fork(4, seed=0)
+    ends = []
+    for branch in branches:
+        assert branch.tick == sim.tick
+        branch.run()
+        ends.append(branch.snapshot())
+    assert len(set(ends)) == len(branches)
+    assert sim.snapshot() == state
+
+
+if __name__ == '__main__':
+    test_restoreContinuesBitForBit()
+    test_forkBranchesDivergeParentUntouched()
+    print("Restored and forked episodes check out")
@@ -0,0 +1,18 @@
+"""
+Checks that the uniform-grid spatial index gives the results of the all-pairs queries, see simulator/spatial.py.
+"""
+from simulator import Simulator
+
+
+def test_spatialIndexMatchesAllPairs():
+    for s in (1, 2, 3):
+        for greedy in (True, False):
+            for seed in range(5):
+                expected = Simulator(s, 0.9, greedy=greedy, seed=seed).run()
+                indexed = Simulator(s, 0.9, greedy=greedy, spatial_index=True, seed=seed).run()
+                assert indexed == expected, (s, greedy, seed)
+
+
+if __name__ == '__main__':
+    test_spatialIndexMatchesAllPairs()
+    print("The spatial index matches the all-pairs queries")
@@ -0,0 +1,23 @@
+"""
+Checks that every tau of a TauSweep gives the trials of a BatchSimulator with that tau and the same seed, see
+simulator/sweep.py.
+"""
+import numpy as np
+
+from simulator import BatchSimulator
+from simulator.sweep import TauSweep
+
+
+def test_sweepMatchesBatch():
+    taus = (0.1, 0.5, 0.9)
+    for s in (1, 2, 3):
+        for greedy in (True, False):
+            sweep = TauSweep(s, taus, 30, greedy=greedy, seed=2).run()
+            for k, tau in enumerate(taus):
+                batch = BatchSimulator(s, tau, 30, greedy=greedy, seed=2).run()
+                assert np.array_equal(sweep[:, k], batch), (s, greedy, tau)
+
+
+if __name__ == '__main__':
+    test_sweepMatchesBatch()
+    print("The tau sweep matches BatchSimulator")